@@ -0,0 +1,124 @@
+﻿import tkinter as tk
+
+EMPTY_CELL = ' '
+CELL_SIZE = 32
+
+# Trạng thái nền của ô -> khóa màu trong THEMES. Mỗi ô mang tag trạng thái của nó để đổi theme bằng vài lệnh itemconfigure.
+BACKGROUND_COLORS = {'empty': 'BTN_COLOR', 'hover': 'BTN_ACTIVE', 'taken': 'BTN_ACTIVE', 'last': 'LAST_MOVE'}
+STONE_COLORS = {'X': 'X_COLOR', 'O': 'O_COLOR'}
+
+class BoardCanvas(tk.Canvas):
+    # Bàn cờ vẽ trên một Canvas: mỗi ô là một hình chữ nhật và một chữ, tạo một lần duy nhất.
+    # Chỉ những ô bị đánh dấu "dirty" mới được vẽ lại khi flush(); hover và click tính ô từ tọa độ chuột.
+    def __init__(self, master, size, colors, on_click, cell_size=CELL_SIZE):
+        super().__init__(master, width=size * cell_size, height=size * cell_size,
+                         bg=colors["BOARD_BG"], highlightthickness=0)
+        self.size = size
+        self.cell_size = cell_size
+        self.colors = colors
+        self.on_click = on_click
+        self.board = [[EMPTY_CELL for _ in range(size)] for _ in range(size)]  # những gì đang được vẽ
+        self.last_move = None
+        self.hover = None
+        self.enabled = False
+        self.dirty = set()
+        self.rects = []
+        self.texts = []
+        for r in range(size):
+            row_rects, row_texts = [], []
+            for c in range(size):
+                x, y = c * cell_size, r * cell_size
+                row_rects.append(self.create_rectangle(x + 1, y + 1, x + cell_size - 1, y + cell_size - 1,
+                                                       fill=colors["BTN_COLOR"], outline="", tags=('empty',)))
+                row_texts.append(self.create_text(x + cell_size // 2, y + cell_size // 2, text="",
+                                                  font=("Arial", 14, "bold")))
+            self.rects.append(row_rects)
+            self.texts.append(row_texts)
+        self.bind("<Motion>", self.on_motion)
+        self.bind("<Leave>", self.on_leave)
+        self.bind("<Button-1>", self.on_press)
+
+    def cell_at(self, x, y):
+        row, col = y // self.cell_size, x // self.cell_size
+        if 0 <= row < self.size and 0 <= col < self.size:
+            return row, col
+        return None
+
+    def set_cell(self, row, col, symbol):
+        if self.board[row][col] != symbol:
+            self.board[row][col] = symbol
+            self.dirty.add((row, col))
+
+    def set_last_move(self, last_move):
+        cell = (last_move['row'], last_move['col']) if last_move else None
+        if cell != self.last_move:
+            if self.last_move:
+                self.dirty.add(self.last_move)
+            if cell:
+                self.dirty.add(cell)
+            self.last_move = cell
+
+    def load(self, board, last_move):
+        # Nhận cả bàn cờ (game_start, update_board, board_sync) nhưng chỉ vẽ lại các ô khác với hiện tại.
+        for r in range(self.size):
+            for c in range(self.size):
+                self.set_cell(r, c, board[r][c])
+        self.set_last_move(last_move)
+        self.flush()
+
+    def set_enabled(self, enabled):
+        if enabled != self.enabled:
+            self.enabled = enabled
+            if self.hover:
+                self.dirty.add(self.hover)
+            self.flush()
+
+    def flush(self):
+        for row, col in self.dirty:
+            self.draw_cell(row, col)
+        self.dirty.clear()
+
+    def draw_cell(self, row, col):
+        symbol = self.board[row][col]
+        if (row, col) == self.last_move:
+            state = 'last'
+        elif symbol != EMPTY_CELL:
+            state = 'taken'
+        elif self.enabled and (row, col) == self.hover:
+            state = 'hover'
+        else:
+            state = 'empty'
+        self.itemconfigure(self.rects[row][col], fill=self.colors[BACKGROUND_COLORS[state]], tags=(state,))
+        color_key = STONE_COLORS.get(symbol)
+        self.itemconfigure(self.texts[row][col], text=symbol.strip(),
+                           fill=self.colors[color_key or "BTN_TEXT"], tags=(symbol,) if color_key else ())
+
+    def set_colors(self, colors):
+        # Đổi theme: mỗi nhóm ô đổi màu bằng một lệnh theo tag thay vì cấu hình lại từng ô.
+        self.colors = colors
+        self.configure(bg=colors["BOARD_BG"])
+        for tag, color_key in BACKGROUND_COLORS.items():
+            self.itemconfigure(tag, fill=colors[color_key])
+        for tag, color_key in STONE_COLORS.items():
+            self.itemconfigure(tag, fill=colors[color_key])
+
+    def on_motion(self, event):
+        cell = self.cell_at(event.x, event.y)
+        if cell != self.hover:
+            if self.hover:
+                self.dirty.add(self.hover)
+            if cell:
+                self.dirty.add(cell)
+            self.hover = cell
+            self.flush()
+
+    def on_leave(self, event):
+        if self.hover:
+            self.dirty.add(self.hover)
+            self.hover = None
+            self.flush()
+
+    def on_press(self, event):
+        cell = self.cell_at(event.x, event.y)
+        if cell and self.enabled and self.board[cell[0]][cell[1]] == EMPTY_CELL:
+            self.on_click(*cell)
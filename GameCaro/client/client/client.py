@@ -1,15 +1,16 @@
-﻿import socket
+﻿import asyncio
 import threading
-import json
 import tkinter as tk
-from tkinter import messagebox
+from tkinter import messagebox, simpledialog
 from datetime import datetime
 
-HOST = '172.20.10.6'
-PORT = 12345
+from board_canvas import BoardCanvas
+from clientcore import BOARD_SIZE, EMPTY_CELL, GAMES_RETRY_DELAY, HOST, PORT, ClientCore
 
-BOARD_SIZE = 15
-EMPTY_CELL = ' '
+# Bàn cờ tự do (server chạy --board-size khác 15): chỉ hiện một khung BOARD_SIZE x BOARD_SIZE,
+# mỗi lần di chuyển khung đi PAN_STEP ô và xin server các quân trong khung mới bằng 'viewport'
+PAN_STEP = 5
+PAN_KEYS = {'Up': (-1, 0), 'Down': (1, 0), 'Left': (0, -1), 'Right': (0, 1)}
 
 THEMES = {
     "light": {
@@ -46,6 +47,10 @@ THEMES = {
     }
 }
 
+# Giao diện Tk trên ClientCore (clientcore.py): lõi chạy trên vòng lặp asyncio ở một thread riêng,
+# sự kiện của lõi được chuyển sang thread Tk bằng master.after, còn thao tác của người chơi được
+# gửi sang vòng lặp bằng call_soon_threadsafe. Giao diện chỉ đọc trạng thái ván của lõi.
+
 class CaroGameClient:
     def __init__(self, master):
         self.theme = "light"
@@ -56,22 +61,16 @@ class CaroGameClient:
         master.resizable(False, False)
         master.configure(bg=self.colors["BG_COLOR"])
         self.username = ""
-        self.opponent_name = ""
-        self.is_connected = False
-        self.my_symbol = ''
-        self.is_my_turn = False
-        self.game_board = [[EMPTY_CELL for _ in range(BOARD_SIZE)] for _ in range(BOARD_SIZE)]
-        self.buttons = []
-        self.client_socket = None
-        self.receive_buffer = ""
-        self.rematch_requested = False
-        self.opponent_rematch = False
-        self.stats = {"win": 0, "loss": 0, "draw": 0}
+        self.core = None
+        self.loop = asyncio.new_event_loop()
+        threading.Thread(target=self.loop.run_forever, daemon=True).start()
+        self.board_canvas = None
         self.sound_enabled = True
-        self.last_move = None
+        self.view_top = 0
+        self.view_left = 0
+        self.watching = False
         self.wait_frame = None
         self.game_frame = None
-        self.rematch_declined = False
         self.create_wait_screen()
         self.master.protocol("WM_DELETE_WINDOW", self.on_closing)
 
@@ -89,6 +88,12 @@ class CaroGameClient:
                              command=self.start_game)
         start_btn.pack(pady=20)
 
+        watch_btn = tk.Button(self.wait_frame, text="Xem trận đấu", font=("Arial", 18, "bold"),
+                              bg=self.colors["BTN_COLOR"], fg=self.colors["BTN_TEXT"],
+                              activebackground=self.colors["BTN_ACTIVE"], width=20, height=2,
+                              command=self.start_watching)
+        watch_btn.pack(pady=20)
+
         info_btn = tk.Button(self.wait_frame, text="Thông tin trò chơi", font=("Arial", 18, "bold"),
                              bg=self.colors["BTN_COLOR"], fg=self.colors["BTN_TEXT"],
                              activebackground=self.colors["BTN_ACTIVE"], width=20, height=2,
@@ -105,6 +110,17 @@ class CaroGameClient:
         self.wait_frame.destroy()
         self.create_widgets()
 
+    def start_watching(self):
+        self.wait_frame.destroy()
+        self.create_widgets()
+        self.watching = True
+        self.username_entry.config(state=tk.DISABLED)
+        self.set_username_button.config(state=tk.DISABLED)
+        self.username_label.config(text="Chế độ xem")
+        self.avatar_label1.config(text="X")
+        self.avatar_label2.config(text="O")
+        self.connect_to_server()
+
     def show_game_info(self):
         info_text = (
             "Hướng dẫn chơi Caro:\n\n"
@@ -121,17 +137,9 @@ class CaroGameClient:
         self.master.destroy()
 
     def disconnect_from_server(self):
-        if self.is_connected and self.client_socket:
-            try:
-                self.is_connected = False
-                self.client_socket.shutdown(socket.SHUT_RDWR)
-            except Exception as e:
-                print(f"Error shutting down socket: {e}")
-            try:
-                self.client_socket.close()
-            except Exception as e:
-                print(f"Error closing socket: {e}")
-            self.client_socket = None
+        if self.core is not None:
+            self.call(self.core.close)
+            self.core = None
 
     def create_widgets(self):
         self.header_frame = tk.Frame(self.master, bg=self.colors["HEADER_BG"])
@@ -184,6 +192,12 @@ class CaroGameClient:
         self.clear_chat_button = tk.Button(self.control_frame, text="Xóa chat", command=self.clear_chat,
                                            bg=self.colors["BTN_COLOR"], fg=self.colors["BTN_TEXT"], font=("Arial", 10))
         self.clear_chat_button.pack(side=tk.LEFT, padx=5)
+        self.hint_button = tk.Button(self.control_frame, text="Gợi ý", command=self.request_hint,
+                                     bg=self.colors["BTN_COLOR"], fg=self.colors["BTN_TEXT"], font=("Arial", 10))
+        self.hint_button.pack(side=tk.LEFT, padx=5)
+        self.leaderboard_button = tk.Button(self.control_frame, text="Xếp hạng", command=self.request_leaderboard,
+                                            bg=self.colors["BTN_COLOR"], fg=self.colors["BTN_TEXT"], font=("Arial", 10))
+        self.leaderboard_button.pack(side=tk.LEFT, padx=5)
 
         self.info_frame = tk.Frame(self.master, bd=2, relief=tk.GROOVE, bg=self.colors["BG_COLOR"])
         self.info_frame.pack(side=tk.TOP, fill=tk.X, padx=10, pady=5)
@@ -196,21 +210,20 @@ class CaroGameClient:
 
         self.board_frame = tk.Frame(self.master, bd=2, relief=tk.SUNKEN, bg=self.colors["BOARD_BG"])
         self.board_frame.pack(side=tk.TOP, padx=10, pady=5, expand=True)
-        self.buttons = []
-        for r in range(BOARD_SIZE): 
-            row_buttons = []
-            for c in range(BOARD_SIZE):
-                button = tk.Button(self.board_frame, text=EMPTY_CELL, width=3, height=1,
-                                   font=("Arial", 12, "bold"),
-                                   command=lambda r=r, c=c: self.make_move(r, c),
-                                   state=tk.DISABLED,
-                                   bg=self.colors["BTN_COLOR"], fg=self.colors["BTN_TEXT"],
-                                   activebackground=self.colors["BTN_ACTIVE"])
-                button.grid(row=r, column=c, padx=1, pady=1)
-                button.bind("<Enter>", lambda e, b=button: b.config(bg=self.colors["BTN_ACTIVE"]))
-                button.bind("<Leave>", lambda e, b=button: b.config(bg=self.colors["BTN_COLOR"]))
-                row_buttons.append(button)
-            self.buttons.append(row_buttons)
+        self.board_canvas = BoardCanvas(self.board_frame, BOARD_SIZE, self.colors, self.make_move)
+        self.board_canvas.pack(padx=1, pady=1)
+
+        # Chỉ hiện khi chơi bàn cờ tự do
+        self.pan_frame = tk.Frame(self.info_frame, bg=self.colors["BG_COLOR"])
+        self.view_label = tk.Label(self.pan_frame, text="", font=("Arial", 10), bg=self.colors["BG_COLOR"])
+        self.view_label.pack(side=tk.LEFT, padx=5)
+        self.pan_buttons = []
+        for text, key in (("◀", 'Left'), ("▲", 'Up'), ("▼", 'Down'), ("▶", 'Right')):
+            button = tk.Button(self.pan_frame, text=text, command=lambda key=key: self.pan(*PAN_KEYS[key]),
+                               bg=self.colors["BTN_COLOR"], fg=self.colors["BTN_TEXT"], font=("Arial", 10), width=2)
+            button.pack(side=tk.LEFT, padx=1)
+            self.pan_buttons.append(button)
+        self.master.bind("<Key>", self.on_pan_key)
 
         self.chat_history_frame = tk.Frame(self.master, bd=2, relief=tk.GROOVE, bg=self.colors["BG_COLOR"])
         self.chat_history_frame.pack(side=tk.BOTTOM, fill=tk.X, padx=10, pady=5)
@@ -255,15 +268,13 @@ class CaroGameClient:
     def connect_to_server(self):
         self.status_label.config(text="Đang kết nối...")
         self.disconnect_from_server()
-        self.client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.is_connected = False
-        self.receive_buffer = ""
+        self.core = ClientCore(self.username, self.post_event, HOST, PORT, watching=self.watching)
         try:
-            self.client_socket.connect((HOST, PORT))
-            self.is_connected = True
-            self.send_to_server('username_set', {'username': self.username})
+            asyncio.run_coroutine_threadsafe(self.core.connect(), self.loop).result()
+            if self.watching:
+                self.status_label.config(text="Đã kết nối, đang lấy danh sách trận...")
+                return
             self.status_label.config(text="Đã kết nối, chờ đối thủ...")
-            threading.Thread(target=self.listen_from_server, daemon=True).start()
             self.chat_entry.config(state=tk.NORMAL)
             self.send_button.config(state=tk.NORMAL)
         except ConnectionRefusedError:
@@ -273,75 +284,253 @@ class CaroGameClient:
             messagebox.showerror("Lỗi", f"Lỗi kết nối: {e}")
             self.master.destroy()
 
-    def process_server_message(self, message):
-        msg_type = message.get('type')
-        msg_data = message.get('data')
-        if msg_type == 'game_start':
-            self.my_symbol = msg_data['symbol']
-            self.is_my_turn = msg_data['is_turn']
-            self.game_board = msg_data['board']
-            self.opponent_name = msg_data.get('opponent_name', 'Đối thủ')
-            self.symbol_label.config(text=f"Ký hiệu của bạn: {self.my_symbol}")
-            self.opponent_label.config(text=f"Đối thủ: {self.opponent_name}")
-            self.last_move = None
-            self.update_board_gui()
-            self.update_turn_highlight()
-            if self.is_my_turn:
-                self.status_label.config(text="Đến lượt của bạn!")
-                self.enable_board_buttons()
-            else:
-                self.status_label.config(text="Chờ đối thủ đi...")
-                self.disable_board_buttons()
-            messagebox.showinfo("Game Start", f"Trò chơi bắt đầu! Bạn là '{self.my_symbol}'. Đối thủ của bạn là {self.opponent_name}.")
-        elif msg_type == 'update_board':
-            self.game_board = msg_data['board']
-            self.last_move = msg_data.get('last_move')
-            self.update_board_gui()
-        elif msg_type == 'your_turn':
-            self.is_my_turn = True
+    def call(self, func, *args):
+        # Chạy một thao tác của lõi trên vòng lặp của nó
+        self.loop.call_soon_threadsafe(func, *args)
+
+    def send_to_server(self, message_type, data):
+        if self.core is not None:
+            self.call(self.core.send, message_type, data)
+
+    def post_event(self, event, data):
+        # Gọi trên thread của vòng lặp asyncio
+        try:
+            self.master.after(0, self.handle_event, event, data)
+        except (RuntimeError, tk.TclError):
+            pass  # cửa sổ đã đóng
+
+    def handle_event(self, event, data):
+        handler = getattr(self, 'handle_' + event, None)
+        if handler is not None:
+            handler(data)
+
+    # --- Kết nối ---
+
+    def handle_connection_lost(self, data):
+        self.disable_board_buttons()
+        self.status_label.config(text="Mất kết nối với server. Đang kết nối lại...")
+
+    def handle_reconnect_attempt(self, data):
+        self.status_label.config(text=f"Mất kết nối với server. Đang thử lại (lần {data['attempt']})...")
+
+    def handle_reconnected(self, data):
+        self.status_label.config(text="Đã kết nối lại.")
+
+    def handle_reconnect_failed(self, data):
+        messagebox.showerror("Lỗi", "Mất kết nối với server.")
+        self.master.destroy()
+
+    def handle_failed(self, data):
+        messagebox.showerror("Lỗi", f"Lỗi không xác định: {data['message']}")
+        self.master.destroy()
+
+    # --- Ván đấu ---
+
+    def show_game_state(self):
+        core = self.core
+        if core.free_style:
+            self.start_free_style(core.last_move)
+        self.symbol_label.config(text=f"Ký hiệu của bạn: {core.my_symbol}")
+        self.opponent_label.config(text=f"Đối thủ: {core.opponent_name}")
+        self.update_board_gui()
+        self.update_turn_highlight()
+        if core.is_my_turn:
             self.status_label.config(text="Đến lượt của bạn!")
-            self.update_turn_highlight()
             self.enable_board_buttons()
-        elif msg_type == 'wait_turn':
-            self.is_my_turn = False
+        else:
             self.status_label.config(text="Chờ đối thủ đi...")
-            self.update_turn_highlight()
             self.disable_board_buttons()
-        elif msg_type == 'game_over':
-            winner_info = msg_data['winner']
-            message = msg_data['message']
+
+    def start_free_style(self, last_move):
+        # Server không gửi bàn cờ: đặt khung nhìn quanh nước đi cuối (hoặc giữa bàn) rồi xin 'viewport'
+        if last_move:
+            center = (last_move['row'], last_move['col'])
+        else:
+            center = (self.core.board_limit // 2, self.core.board_limit // 2)
+        self.view_top, self.view_left = self.clamp_view(center[0] - BOARD_SIZE // 2, center[1] - BOARD_SIZE // 2)
+        self.pan_frame.pack(side=tk.RIGHT, padx=10)
+        self.request_viewport()
+
+    def clamp_view(self, top, left):
+        if not self.core.board_limit:
+            return top, left
+        highest = max(self.core.board_limit - BOARD_SIZE, 0)
+        return min(max(top, 0), highest), min(max(left, 0), highest)
+
+    def in_view(self, row, col):
+        return 0 <= row - self.view_top < BOARD_SIZE and 0 <= col - self.view_left < BOARD_SIZE
+
+    def to_view(self, move):
+        if move and self.in_view(move['row'], move['col']):
+            return {'row': move['row'] - self.view_top, 'col': move['col'] - self.view_left}
+        return None
+
+    def view_rows(self):
+        stones = self.core.stones
+        return [[stones.get((self.view_top + r, self.view_left + c), EMPTY_CELL) for c in range(BOARD_SIZE)]
+                for r in range(BOARD_SIZE)]
+
+    def request_viewport(self):
+        self.call(self.core.request_viewport, self.view_top, self.view_left)
+
+    def pan(self, drow, dcol):
+        if self.core is None or not self.core.free_style:
+            return
+        top, left = self.clamp_view(self.view_top + drow * PAN_STEP, self.view_left + dcol * PAN_STEP)
+        if (top, left) != (self.view_top, self.view_left):
+            self.view_top, self.view_left = top, left
+            self.update_board_gui()  # vẽ ngay các quân đã biết, phần còn lại đến cùng 'viewport'
+            self.request_viewport()
+
+    def on_pan_key(self, event):
+        if event.keysym in PAN_KEYS and not isinstance(event.widget, tk.Entry):
+            self.pan(*PAN_KEYS[event.keysym])
+
+    def handle_game_start(self, data):
+        self.show_game_state()
+        messagebox.showinfo("Game Start", f"Trò chơi bắt đầu! Bạn là '{self.core.my_symbol}'. "
+                                          f"Đối thủ của bạn là {self.core.opponent_name}.")
+
+    handle_sparse_start = handle_game_start
+
+    def handle_resync(self, data):
+        # Đã vào lại ván cũ: bàn cờ, lượt và nước đi cuối đến trong một tin
+        self.show_game_state()
+        self.chat_entry.config(state=tk.NORMAL)
+        self.send_button.config(state=tk.NORMAL)
+        self.append_chat_message("Đã kết nối lại vào ván đấu.")
+        if not data['in_progress'] and not self.core.rematch_requested:
             self.status_label.config(text="Trò chơi kết thúc.")
             self.disable_board_buttons()
-            self.update_stats(winner_info)
-            messagebox.showinfo("Kết thúc game", message)
-            self.ask_rematch()
-        elif msg_type == 'error':
-            messagebox.showerror("Lỗi", msg_data['message'])
-            self.status_label.config(text="Lỗi: " + msg_data['message'])
-        elif msg_type == 'wait':
-            self.status_label.config(text=msg_data['message'])
-        elif msg_type == 'opponent_disconnected':
-            messagebox.showinfo("Đối thủ ngắt kết nối", msg_data['message'])
-            self.status_label.config(text="Đối thủ đã ngắt kết nối. Trò chơi kết thúc.")
-            self.opponent_label.config(text="Đối thủ: ")
-            self.reset_game_state()
-        elif msg_type == 'chat':
-            sender = msg_data.get('sender', 'Đối thủ')
-            chat_message = msg_data['message']
-            self.append_chat_message(f"{sender}: {chat_message}")
-        elif msg_type == 'rematch_request':
-            self.opponent_rematch = True
-            if self.rematch_requested:
-                self.start_rematch()
-            else:
-                self.status_label.config(text="Đối thủ muốn đấu lại! Bạn có muốn đấu lại không?")
-                self.ask_rematch(opponent_requested=True)
-        elif msg_type == 'rematch_start':
-            self.start_rematch()
-        elif msg_type == 'rematch_declined':
-            self.status_label.config(text="Đối thủ đã từ chối đấu lại. Đang chờ đối thủ mới...")
-            self.reset_game_state()
-            self.wait_for_new_opponent()
+            self.ask_rematch(opponent_requested=self.core.opponent_rematch)
+
+    def handle_resume_failed(self, data):
+        # Ván cũ đã bị hủy: lõi đã vào hàng chờ như người chơi mới
+        self.reset_view()
+        self.status_label.config(text=data['message'])
+
+    def handle_opponent_away(self, data):
+        self.status_label.config(text=data['message'])
+
+    def handle_opponent_back(self, data):
+        self.status_label.config(text=data['message'] + (" Đến lượt của bạn!" if self.core.is_my_turn else ""))
+
+    def handle_games(self, data):
+        self.choose_game(data['games'])
+
+    def handle_spectate_start(self, data):
+        # Ảnh chụp ván đang xem; sau đó chỉ nhận các move_made
+        if self.core.free_style:
+            self.start_free_style(data.get('last_move'))
+        self.symbol_label.config(text=f"X: {data['x_name']}")
+        self.opponent_label.config(text=f"O: {data['o_name']}")
+        self.update_board_gui()
+        self.disable_board_buttons()
+        self.status_label.config(text=f"Đang xem trận #{data['game_id']}")
+
+    def handle_spectate_over(self, data):
+        self.status_label.config(text=data['message'])
+        self.append_chat_message(f"Trận #{self.core.watch_game_id}: {data['message']}")
+
+    def handle_spectate_end(self, data):
+        self.append_chat_message(data['message'])
+        self.status_label.config(text="Trận đấu đã kết thúc. Đang lấy danh sách trận...")
+
+    def handle_update_board(self, data):
+        self.update_board_gui()
+
+    def handle_move_made(self, data):
+        # Chỉ vẽ lại ô vừa đánh và ô được tô "nước đi cuối" cũ/mới
+        self.board_canvas.set_cell(data['row'], data['col'], data['symbol'])
+        self.board_canvas.set_last_move({'row': data['row'], 'col': data['col']})
+        self.board_canvas.flush()
+
+    def handle_stone(self, data):
+        # Nước đi trên bàn cờ tự do, tọa độ tính trên cả bàn chứ không theo khung nhìn
+        row, col = data['row'], data['col']
+        if self.in_view(row, col):
+            self.board_canvas.set_cell(row - self.view_top, col - self.view_left, data['symbol'])
+        self.board_canvas.set_last_move(self.to_view({'row': row, 'col': col}))
+        self.board_canvas.flush()
+
+    def handle_viewport(self, data):
+        self.update_board_gui()
+
+    def handle_board_sync(self, data):
+        self.update_board_gui()
+
+    def handle_analysis(self, data):
+        moves = ", ".join(f"({move['row']}, {move['col']}) {move['pattern'] or ''}".rstrip() for move in data['moves'])
+        self.append_chat_message(f"Gợi ý cho {data['to_move']} sau {data['seq']} nước "
+                                 f"(điểm {data['score']}): {moves}")
+
+    def handle_leaderboard(self, data):
+        lines = [f"{player['rank']}. {player['username']} {player['rating']} "
+                 f"({player['wins']}/{player['draws']}/{player['losses']})" for player in data['players']]
+        self.append_chat_message("Bảng xếp hạng (thắng/hòa/thua):\n" + ("\n".join(lines) or "Chưa có ván nào."))
+        you = data.get('you')
+        if you:
+            self.append_chat_message(f"Bạn xếp thứ {you['rank']} với {you['rating']} điểm.")
+            self.update_stats_label()
+
+    def handle_your_turn(self, data):
+        self.status_label.config(text="Đến lượt của bạn!")
+        self.update_turn_highlight()
+        self.enable_board_buttons()
+
+    def handle_wait_turn(self, data):
+        self.status_label.config(text="Chờ đối thủ đi...")
+        self.update_turn_highlight()
+        self.disable_board_buttons()
+
+    def handle_game_over(self, data):
+        self.status_label.config(text="Trò chơi kết thúc.")
+        self.disable_board_buttons()
+        self.update_stats_label()
+        messagebox.showinfo("Kết thúc game", data['message'])
+        self.ask_rematch()
+
+    def handle_error(self, data):
+        messagebox.showerror("Lỗi", data['message'])
+        self.status_label.config(text="Lỗi: " + data['message'])
+
+    def handle_wait(self, data):
+        self.status_label.config(text=data['message'])
+
+    def handle_opponent_disconnected(self, data):
+        messagebox.showinfo("Đối thủ ngắt kết nối", data['message'])
+        self.status_label.config(text="Đối thủ đã ngắt kết nối. Trò chơi kết thúc.")
+        self.opponent_label.config(text="Đối thủ: ")
+        self.reset_view()
+
+    def handle_chat(self, data):
+        self.append_chat_message(f"{data.get('sender', 'Đối thủ')}: {data['message']}")
+
+    def handle_rematch_request(self, data):
+        self.status_label.config(text="Đối thủ muốn đấu lại! Bạn có muốn đấu lại không?")
+        self.ask_rematch(opponent_requested=True)
+
+    def handle_rematch_started(self, data):
+        self.reset_view()
+        self.status_label.config(text="Đã bắt đầu trận đấu lại! Chờ đối thủ...")
+
+    def handle_rematch_declined(self, data):
+        self.status_label.config(text="Đối thủ đã từ chối đấu lại. Đang chờ đối thủ mới...")
+        self.reset_view()
+        self.wait_for_new_opponent()
+
+    def choose_game(self, games):
+        if not games:
+            self.status_label.config(text="Chưa có trận nào đang diễn ra. Đang chờ...")
+            return  # lõi tự xin lại danh sách
+        listing = "\n".join(f"#{game['game_id']}: {game['x_name']} (X) - {game['o_name']} (O), "
+                            f"{game['seq']} nước, {game['spectators']} người xem" for game in games)
+        game_id = simpledialog.askinteger("Xem trận đấu", f"{listing}\n\nNhập mã trận muốn xem:",
+                                          initialvalue=games[0]['game_id'], parent=self.master)
+        if game_id is None:
+            self.call(self.core.request_games, GAMES_RETRY_DELAY)
+            return
+        self.call(self.core.watch, game_id)
 
     def ask_rematch(self, opponent_requested=False):
         if opponent_requested:
@@ -349,21 +538,13 @@ class CaroGameClient:
         else:
             question = "Bạn có muốn đấu lại không?"
         result = messagebox.askyesno("Đấu lại", question)
+        self.call(self.core.answer_rematch, result)
         if result:
-            self.rematch_requested = True
-            self.rematch_declined = False
-            self.send_to_server('rematch_request', {})
-            if self.opponent_rematch:
-                self.start_rematch()
-            else:
+            if not self.core.opponent_rematch:
                 self.status_label.config(text="Đang chờ đối thủ đồng ý đấu lại...")
         else:
-            self.rematch_requested = False
-            self.opponent_rematch = False
-            self.rematch_declined = True
             self.status_label.config(text="Bạn đã từ chối đấu lại.")
-            self.send_to_server('rematch_declined', {})
-            self.reset_game_state()
+            self.reset_view()
             self.wait_for_new_opponent()
 
     def wait_for_new_opponent(self):
@@ -372,12 +553,12 @@ class CaroGameClient:
         self.send_button.config(state=tk.DISABLED)
         self.status_label.config(text="Đang chờ đối thủ mới...")
 
-    def start_rematch(self):
-        self.rematch_requested = False
-        self.opponent_rematch = False
-        self.send_to_server('rematch_start', {})
-        self.reset_game_state()
-        self.status_label.config(text="Đã bắt đầu trận đấu lại! Chờ đối thủ...")
+    def request_hint(self):
+        # Server trả về vài nước tốt nhất cho thế cờ hiện tại; dùng được cả sau khi ván kết thúc
+        self.send_to_server('analyze', {'top': 3})
+
+    def request_leaderboard(self):
+        self.send_to_server('leaderboard', {'limit': 10})
 
     def send_chat_message(self, event=None):
         message = self.chat_entry.get().strip()
@@ -417,149 +598,74 @@ class CaroGameClient:
         self.theme_button.config(bg=self.colors["BTN_COLOR"], fg=self.colors["BTN_TEXT"])
         self.sound_button.config(bg=self.colors["BTN_COLOR"], fg=self.colors["BTN_TEXT"])
         self.clear_chat_button.config(bg=self.colors["BTN_COLOR"], fg=self.colors["BTN_TEXT"])
+        self.hint_button.config(bg=self.colors["BTN_COLOR"], fg=self.colors["BTN_TEXT"])
+        self.leaderboard_button.config(bg=self.colors["BTN_COLOR"], fg=self.colors["BTN_TEXT"])
         self.info_frame.config(bg=self.colors["BG_COLOR"])
         self.status_label.config(bg=self.colors["BG_COLOR"])
         self.symbol_label.config(bg=self.colors["BG_COLOR"])
         self.opponent_label.config(bg=self.colors["BG_COLOR"])
         self.board_frame.config(bg=self.colors["BOARD_BG"])
+        self.pan_frame.config(bg=self.colors["BG_COLOR"])
+        self.view_label.config(bg=self.colors["BG_COLOR"])
+        for button in self.pan_buttons:
+            button.config(bg=self.colors["BTN_COLOR"], fg=self.colors["BTN_TEXT"])
         self.chat_history_frame.config(bg=self.colors["BG_COLOR"])
         self.chat_history.config(bg=self.colors["CHAT_BG"], fg=self.colors["CHAT_TEXT"])
         self.chat_frame.config(bg=self.colors["BG_COLOR"])
         self.footer_frame.config(bg=self.colors["HEADER_BG"])
         self.footer_label.config(bg=self.colors["HEADER_BG"], fg=self.colors["HEADER_TEXT"])
-        self.update_board_gui()
+        self.board_canvas.set_colors(self.colors)
 
     def toggle_sound(self):
         self.sound_enabled = not self.sound_enabled
         self.sound_button.config(text="Bật âm" if not self.sound_enabled else "Tắt âm")
 
     def update_board_gui(self):
-        for r in range(BOARD_SIZE):
-            for c in range(BOARD_SIZE):
-                btn = self.buttons[r][c]
-                symbol = self.game_board[r][c]
-            
-                # Cập nhật văn bản của nút
-                btn.config(text=symbol)
-            
-                # Đặt màu chữ dựa trên ký hiệu và CẬP NHẬT THÊM disabledforeground
-                if symbol == 'X':
-                    btn.config(fg=self.colors["X_COLOR"], disabledforeground=self.colors["X_COLOR"])
-                elif symbol == 'O':
-                    btn.config(fg=self.colors["O_COLOR"], disabledforeground=self.colors["O_COLOR"])
-                else:
-                    # Đặt lại màu chữ mặc định cho ô trống
-                    btn.config(fg=self.colors["BTN_TEXT"], disabledforeground=self.colors["BTN_TEXT"])
-
-                # Logic tô màu nền cho các ô
-                is_last_move = self.last_move and (r, c) == (self.last_move.get('row'), self.last_move.get('col'))
-            
-                if is_last_move:
-                    btn.config(bg=self.colors["LAST_MOVE"])
-                elif symbol != EMPTY_CELL:
-                    btn.config(bg=self.colors["BTN_ACTIVE"])
-                else:
-                    btn.config(bg=self.colors["BTN_COLOR"])
-                
-                # Cập nhật lại sự kiện hover để sử dụng màu nền mới
-                btn.bind("<Enter>", lambda e, b=btn: b.config(bg=self.colors["BTN_ACTIVE"]))
-                btn.bind("<Leave>", lambda e, b=btn: b.config(bg=self.colors["BTN_COLOR"]))
+        core = self.core
+        if core is not None and core.free_style:
+            self.board_canvas.load(self.view_rows(), self.to_view(core.last_move))
+            self.view_label.config(text=f"Khung nhìn: ({self.view_top}, {self.view_left})")
+        elif core is not None:
+            self.board_canvas.load(core.game_board, core.last_move)
 
     def enable_board_buttons(self):
-        for r in range(BOARD_SIZE):
-            for c in range(BOARD_SIZE):
-                if self.game_board[r][c] == EMPTY_CELL:
-                    self.buttons[r][c].config(state=tk.NORMAL)
+        self.board_canvas.set_enabled(True)
 
     def disable_board_buttons(self):
-        for r in range(BOARD_SIZE):
-            for c in range(BOARD_SIZE):
-                self.buttons[r][c].config(state=tk.DISABLED)
+        self.board_canvas.set_enabled(False)
 
     def update_turn_highlight(self):
-        if self.is_my_turn:
+        if self.core.is_my_turn:
             self.avatar_label1.config(font=("Arial", 12, "bold"))
             self.avatar_label2.config(font=("Arial", 12))
         else:
             self.avatar_label1.config(font=("Arial", 12))
             self.avatar_label2.config(font=("Arial", 12, "bold"))
 
-    def update_stats(self, winner_info):
-        if winner_info is True:
-            self.stats["win"] += 1
-        elif winner_info is False:
-            self.stats["loss"] += 1
-        else:
-            self.stats["draw"] += 1
-        self.stats_label.config(text=f"Thắng: {self.stats['win']}  Thua: {self.stats['loss']}  Hòa: {self.stats['draw']}")
+    def update_stats_label(self):
+        stats = self.core.stats
+        self.stats_label.config(text=f"Thắng: {stats['win']}  Thua: {stats['loss']}  Hòa: {stats['draw']}")
 
     def make_move(self, row, col):
-        if self.is_my_turn and self.game_board[row][col] == EMPTY_CELL:
-            move_data = {'row': row, 'col': col}
-            self.last_move = {'row': row, 'col': col}
-            self.send_to_server('move', move_data)
+        core = self.core
+        if core.free_style:
+            row, col = self.view_top + row, self.view_left + col
+        error = core.move_error(row, col)
+        if error == 'turn':
+            messagebox.showwarning("Lượt đi", "Chưa đến lượt của bạn.")
+        elif error == 'cell':
+            messagebox.showwarning("Ô đã chọn", "Ô này không hợp lệ.")
+        else:
+            self.call(core.make_move, row, col)
             self.disable_board_buttons()
             self.status_label.config(text="Chờ đối thủ đi...")
-            
-        else:
-            if not self.is_my_turn:
-                messagebox.showwarning("Lượt đi", "Chưa đến lượt của bạn.")
-            else:
-                messagebox.showwarning("Ô đã chọn", "Ô này không hợp lệ.")
 
-    def send_to_server(self, message_type, data):
-        message = {'type': message_type, 'data': data}
-        try:
-            self.client_socket.sendall((json.dumps(message) + '\n').encode('utf-8'))
-        except (socket.error, BrokenPipeError) as e:
-            print(f"Error sending to server: {e}")
-            self.is_connected = False
-            self.master.after(0, lambda: messagebox.showerror("Lỗi", "Mất kết nối với server."))
-            self.master.after(0, self.master.destroy)
-
-    def listen_from_server(self):
-        while self.is_connected:
-            try:
-                data = self.client_socket.recv(4096).decode('utf-8')
-                if not data:
-                    print("Server đã đóng kết nối.")
-                    self.is_connected = False
-                    self.master.after(0, lambda: messagebox.showerror("Lỗi", "Mất kết nối với server."))
-                    self.master.after(0, self.master.destroy)
-                    break
-                self.receive_buffer += data
-                while '\n' in self.receive_buffer:
-                    message_str, self.receive_buffer = self.receive_buffer.split('\n', 1)
-                    if message_str:
-                        try:
-                            message = json.loads(message_str)
-                            self.master.after(0, self.process_server_message, message)
-                        except json.JSONDecodeError as e:
-                            print(f"Lỗi phân tích JSON: {e} - Dữ liệu: '{message_str}'")
-                            continue
-            except (socket.error, ConnectionResetError, BrokenPipeError) as e:
-                print(f"Lỗi nhận dữ liệu từ server: {e}")
-                self.is_connected = False
-                self.master.after(0, lambda: messagebox.showerror("Lỗi", "Mất kết nối với server."))
-                self.master.after(0, self.master.destroy)
-                break
-            except Exception as e:
-                print(f"Lỗi không mong muốn trong listen_from_server: {e}")
-                self.is_connected = False
-                self.master.after(0, lambda: messagebox.showerror("Lỗi", f"Lỗi không xác định: {e}"))
-                self.master.after(0, self.master.destroy)
-                break
-
-    def reset_game_state(self):
-        self.my_symbol = ''
-        self.is_my_turn = False
-        self.game_board = [[EMPTY_CELL for _ in range(BOARD_SIZE)] for _ in range(BOARD_SIZE)]
-        self.last_move = None
-        self.update_board_gui()
+    def reset_view(self):
+        # Lõi có thể chưa kịp xóa ván cũ, nên vẽ thẳng bàn cờ trống
+        self.board_canvas.load([[EMPTY_CELL for _ in range(BOARD_SIZE)] for _ in range(BOARD_SIZE)], None)
         self.disable_board_buttons()
         self.status_label.config(text="Sẵn sàng cho game mới. Đang chờ đối thủ...")
         self.symbol_label.config(text="Ký hiệu của bạn: ")
-        self.opponent_name = ""
         self.opponent_label.config(text="Đối thủ: ")
         self.chat_history.config(state=tk.NORMAL)
         self.chat_history.delete(1.0, tk.END)
@@ -0,0 +1,501 @@
+﻿import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'shared'))
+
+from protocol import FrameDecoder, RECV_SIZE, encode_binary, encode_message
+
+HOST = '172.20.10.6'
+PORT = 12345
+
+FEATURES = ['delta', 'binary', 'resume', 'heartbeat', 'sparse']
+# Server im lặng quá SERVER_SILENCE_PING giây thì gửi 'ping'; quá SERVER_TIMEOUT giây coi như mất kết nối
+SERVER_SILENCE_PING = 15
+SERVER_TIMEOUT = 45
+ALIVE_CHECK_INTERVAL = 5
+# Mất kết nối thì tự kết nối lại, chờ lâu dần giữa các lần thử; bỏ cuộc sau RECONNECT_GIVE_UP giây
+RECONNECT_DELAYS = (0.5, 1, 2, 4, 8)
+RECONNECT_GIVE_UP = 60
+CONNECT_TIMEOUT = 5
+# Khi đang xem trận: chờ bao lâu rồi mới xin lại danh sách trận
+GAMES_RETRY_DELAY = 3
+SPECTATE_END_DELAY = 2
+
+BOARD_SIZE = 15
+EMPTY_CELL = ' '
+
+# Lõi client không phụ thuộc Tk: kết nối, khung tin, tự kết nối lại, heartbeat và trạng thái ván
+# (ký hiệu, lượt, bàn cờ, cờ đấu lại). Mọi thứ chạy trên một vòng lặp asyncio, không có thread
+# riêng cho mỗi kết nối, nên một process chạy được hàng nghìn phiên cùng lúc.
+#
+# Sau khi cập nhật trạng thái theo một tin của server, lõi gọi on_event(loại, dữ liệu). Loại là
+# loại tin của server, trừ 'move_made' và 'stone' chỉ được báo khi nước đi khớp seq (thiếu nước
+# thì lõi tự xin đồng bộ), cộng thêm các sự kiện của kết nối: 'connection_lost',
+# 'reconnect_attempt', 'reconnected', 'reconnect_failed', 'failed' (lỗi không mong muốn, lõi đã
+# đóng) và 'rematch_started'.
+# Các phương thức của lõi chỉ được gọi trên vòng lặp của nó (từ thread khác thì qua
+# loop.call_soon_threadsafe); đọc trạng thái từ thread khác thì được.
+
+class ClientCore:
+    def __init__(self, username='', on_event=None, host=HOST, port=PORT, watching=False, reconnect=True):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.on_event = on_event
+        self.watching = watching
+        self.reconnect = reconnect
+        self.reader = None
+        self.writer = None
+        self.decoder = None
+        self.binary = False
+        self.heartbeat = False
+        self.is_connected = False
+        self.reconnecting = False
+        self.closed = False
+        self.last_received = time.monotonic()
+        self.alive_timer = None
+        self.resume_token = None
+        self.watch_game_id = None
+        self.opponent_name = ""
+        self.rematch_requested = False
+        self.opponent_rematch = False
+        self.rematch_declined = False
+        self.stats = {"win": 0, "loss": 0, "draw": 0}
+        self.free_style = False
+        self.board_limit = 0  # cạnh bàn cờ tự do, 0 là vô hạn
+        self.viewport = None  # (top, left, rows, cols) xin lần cuối, để xin lại khi thiếu nước đi
+        self.reset_game_state()
+
+    def reset_game_state(self):
+        self.my_symbol = ''
+        self.is_my_turn = False
+        self.game_board = [[EMPTY_CELL for _ in range(BOARD_SIZE)] for _ in range(BOARD_SIZE)]
+        self.stones = {}  # bàn cờ tự do: {(hàng, cột): ký hiệu} các quân đã biết
+        self.last_move = None
+        self.move_seq = 0
+        self.sync_pending = False
+        self.opponent_name = ""
+
+    def emit(self, event, data=None):
+        if self.on_event is not None:
+            self.on_event(event, data)
+
+    # --- Kết nối ---
+
+    async def connect(self):
+        # Lỗi kết nối (OSError) được ném ra cho nơi gọi
+        self.resume_token = None
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(self.host, self.port), CONNECT_TIMEOUT)
+        self.attach(reader, writer)
+
+    def attach(self, reader, writer):
+        self.reader, self.writer = reader, writer
+        # Đề nghị dùng khung nhị phân: bộ giải mã tự chuyển sang nhị phân sau tin 'protocol' của server
+        self.decoder = FrameDecoder(on_invalid=self.report_invalid_frame, negotiating=True)
+        self.binary = False
+        self.heartbeat = False
+        self.last_received = time.monotonic()
+        self.is_connected = True
+        if self.watch_game_id is not None:
+            self.send('watch', {'game_id': self.watch_game_id, 'features': FEATURES})
+        elif self.watching:
+            self.send('list_games', {})
+        elif self.resume_token:
+            # Đang giữa ván: xin server trả lại chỗ cũ thay vì vào hàng chờ
+            self.send('resume', {'token': self.resume_token, 'features': FEATURES})
+        else:
+            self.send('username_set', {'username': self.username, 'features': FEATURES})
+        asyncio.ensure_future(self.read_loop(reader, writer))
+        if self.alive_timer is None:
+            self.alive_timer = asyncio.get_running_loop().call_later(ALIVE_CHECK_INTERVAL, self.check_server_alive)
+
+    async def read_loop(self, reader, writer):
+        # Mỗi kết nối có một task đọc riêng; task của kết nối cũ tự dừng khi đã kết nối lại
+        decoder = self.decoder
+        try:
+            while self.writer is writer:
+                data = await reader.read(RECV_SIZE)
+                self.last_received = time.monotonic()
+                if not data:
+                    break
+                for message in decoder.feed(data):
+                    if self.writer is not writer:
+                        return
+                    self.process_server_message(message)
+        except OSError as e:
+            print(f"Lỗi nhận dữ liệu từ server: {e}")
+        except Exception as e:
+            print(f"Lỗi không mong muốn khi đọc tin từ server: {e}")
+            if self.writer is writer:
+                self.close()
+                self.emit('failed', {'message': str(e)})
+            return
+        self.connection_lost_on(writer)
+
+    def check_server_alive(self):
+        # Phát hiện kết nối "chết một nửa": server không gửi gì và cũng không trả lời ping
+        self.alive_timer = None
+        if self.closed:
+            return
+        if self.heartbeat and self.is_connected:
+            silence = time.monotonic() - self.last_received
+            if silence > SERVER_TIMEOUT:
+                print(f"Server im lặng {silence:.0f}s, kết nối lại.")
+                self.connection_lost()
+            elif silence > SERVER_SILENCE_PING:
+                self.send('ping', {})
+        self.alive_timer = asyncio.get_running_loop().call_later(ALIVE_CHECK_INTERVAL, self.check_server_alive)
+
+    def connection_lost_on(self, writer):
+        # Bỏ qua nếu người chơi tự thoát hoặc kết nối này đã được thay bằng kết nối mới
+        if self.is_connected and self.writer is writer:
+            self.connection_lost()
+
+    def connection_lost(self):
+        if self.reconnecting or self.writer is None or self.closed:
+            return
+        self.drop_connection()
+        self.emit('connection_lost')
+        if self.reconnect:
+            self.reconnecting = True
+            asyncio.ensure_future(self.reconnect_loop())
+        else:
+            self.emit('reconnect_failed')
+
+    async def reconnect_loop(self):
+        deadline = time.monotonic() + RECONNECT_GIVE_UP
+        attempt = 0
+        while time.monotonic() < deadline and not self.closed:
+            # Thêm chút ngẫu nhiên để các client cùng mất kết nối không thử lại cùng lúc
+            delay = RECONNECT_DELAYS[min(attempt, len(RECONNECT_DELAYS) - 1)]
+            await asyncio.sleep(delay * random.uniform(0.8, 1.2))
+            attempt += 1
+            try:
+                reader, writer = await asyncio.wait_for(asyncio.open_connection(self.host, self.port), CONNECT_TIMEOUT)
+            except (OSError, asyncio.TimeoutError) as e:
+                print(f"Kết nối lại lần {attempt} thất bại: {e}")
+                self.emit('reconnect_attempt', {'attempt': attempt})
+                continue
+            self.reconnecting = False
+            if self.closed:
+                writer.close()
+                return
+            self.emit('reconnected')
+            self.attach(reader, writer)
+            return
+        self.reconnecting = False
+        if not self.closed:
+            self.emit('reconnect_failed')
+
+    def drop_connection(self):
+        self.is_connected = False
+        writer, self.writer = self.writer, None
+        if writer is not None:
+            try:
+                writer.close()
+            except Exception as e:
+                print(f"Error closing socket: {e}")
+
+    def close(self):
+        self.closed = True
+        if self.alive_timer is not None:
+            self.alive_timer.cancel()
+            self.alive_timer = None
+        self.drop_connection()
+
+    def send(self, message_type, data):
+        if not self.is_connected:
+            return  # đang kết nối lại; server sẽ gửi lại trạng thái ván khi vào lại
+        encode = encode_binary if self.binary else encode_message
+        try:
+            self.writer.write(encode(message_type, data))
+        except (OSError, RuntimeError) as e:
+            print(f"Error sending to server: {e}")
+            asyncio.get_running_loop().call_soon(self.connection_lost)
+
+    def report_invalid_frame(self, frame, error):
+        print(f"Lỗi phân tích JSON: {error} - Dữ liệu: {frame!r}")
+
+    # --- Trạng thái ván ---
+
+    def apply_game_state(self, msg_data):
+        self.my_symbol = msg_data['symbol']
+        self.is_my_turn = msg_data['is_turn']
+        if 'board' in msg_data:
+            self.free_style = False
+            self.game_board = msg_data['board']
+        else:
+            self.start_free_style(msg_data['size'])
+        self.opponent_name = msg_data.get('opponent_name', 'Đối thủ')
+        self.last_move = msg_data.get('last_move')
+        self.move_seq = msg_data.get('seq', 0)
+        self.sync_pending = False
+
+    def start_free_style(self, size):
+        # Server không gửi bàn cờ: bên dùng lõi tự chọn khung nhìn rồi gọi request_viewport
+        self.free_style = True
+        self.stones = {}
+        self.board_limit = size
+        self.viewport = None
+
+    def in_board(self, row, col):
+        if not self.free_style:
+            return 0 <= row < BOARD_SIZE and 0 <= col < BOARD_SIZE
+        return not self.board_limit or (0 <= row < self.board_limit and 0 <= col < self.board_limit)
+
+    def cell(self, row, col):
+        if self.free_style:
+            return self.stones.get((row, col), EMPTY_CELL)
+        return self.game_board[row][col]
+
+    def move_error(self, row, col):
+        # None nếu đi được vào (row, col); 'turn' khi chưa đến lượt, 'cell' khi ô không hợp lệ
+        if not self.is_my_turn:
+            return 'turn'
+        if not self.in_board(row, col) or self.cell(row, col) != EMPTY_CELL:
+            return 'cell'
+        return None
+
+    def make_move(self, row, col):
+        # Tọa độ tính trên cả bàn, kể cả với bàn cờ tự do
+        if self.move_error(row, col) is not None:
+            return False
+        self.last_move = {'row': row, 'col': col}
+        self.send('place' if self.free_style else 'move', {'row': row, 'col': col})
+        return True
+
+    def request_viewport(self, top, left, rows=BOARD_SIZE, cols=BOARD_SIZE):
+        self.viewport = (top, left, rows, cols)
+        self.send('viewport', {'top': top, 'left': left, 'rows': rows, 'cols': cols})
+
+    def request_games(self, delay=0):
+        if delay:
+            asyncio.get_running_loop().call_later(delay, self.request_games)
+        elif self.watching and self.watch_game_id is None:
+            self.send('list_games', {})
+
+    def watch(self, game_id):
+        self.send('watch', {'game_id': game_id, 'features': FEATURES})
+
+    def answer_rematch(self, accept):
+        if accept:
+            self.rematch_requested = True
+            self.rematch_declined = False
+            self.send('rematch_request', {})
+            if self.opponent_rematch:
+                self.start_rematch()
+        else:
+            self.rematch_requested = False
+            self.opponent_rematch = False
+            self.rematch_declined = True
+            self.send('rematch_declined', {})
+            self.resume_token = None
+            self.reset_game_state()
+
+    def start_rematch(self):
+        self.rematch_requested = False
+        self.opponent_rematch = False
+        self.send('rematch_start', {})
+        self.reset_game_state()
+        self.emit('rematch_started')
+
+    def update_stats(self, winner_info):
+        if winner_info is True:
+            self.stats["win"] += 1
+        elif winner_info is False:
+            self.stats["loss"] += 1
+        else:
+            self.stats["draw"] += 1
+
+    def process_server_message(self, message):
+        msg_type = message.get('type')
+        msg_data = message.get('data')
+        if msg_type == 'protocol':
+            self.heartbeat = 'heartbeat' in msg_data['features']
+            if 'binary' in msg_data['features']:
+                # Trả lời bằng JSON lần cuối, sau đó gửi khung nhị phân
+                self.send('protocol', {'features': msg_data['features']})
+                self.binary = True
+        elif msg_type == 'ping':
+            self.send('pong', {})
+        elif msg_type == 'session':
+            self.resume_token = msg_data['token']
+        elif msg_type in ('game_start', 'sparse_start', 'resync'):
+            self.apply_game_state(msg_data)
+            if msg_type == 'resync' and not msg_data['in_progress'] and not self.rematch_requested:
+                self.opponent_rematch = msg_data.get('rematch_requested', False)
+        elif msg_type == 'resume_failed':
+            # Ván cũ đã bị hủy: vào hàng chờ như người chơi mới
+            self.resume_token = None
+            self.reset_game_state()
+            self.send('username_set', {'username': self.username, 'features': FEATURES})
+        elif msg_type == 'games':
+            if not msg_data['games']:
+                self.request_games(GAMES_RETRY_DELAY)
+        elif msg_type == 'spectate_start':
+            # Ảnh chụp ván đang xem; sau đó chỉ nhận các move_made
+            self.watch_game_id = msg_data['game_id']
+            if msg_data['board'] is None:
+                self.start_free_style(msg_data['size'])
+            else:
+                self.free_style = False
+                self.game_board = msg_data['board']
+            self.last_move = msg_data.get('last_move')
+            self.move_seq = msg_data['seq']
+            self.sync_pending = False
+        elif msg_type == 'spectate_end':
+            self.watch_game_id = None
+            self.request_games(SPECTATE_END_DELAY)
+        elif msg_type == 'update_board':
+            self.game_board = msg_data['board']
+            self.last_move = msg_data.get('last_move')
+        elif msg_type == 'move_made' or msg_type == 'stone':
+            seq = msg_data['seq']
+            if seq != self.move_seq + 1:
+                if seq > self.move_seq + 1 and not self.sync_pending:
+                    # Thiếu nước đi ở giữa: xin lại toàn bộ bàn cờ, hoặc các quân trong khung nhìn
+                    # với bàn cờ tự do (phần ngoài khung sẽ đến khi di chuyển khung)
+                    self.sync_pending = True
+                    if msg_type == 'move_made':
+                        self.send('sync_request', {})
+                    elif self.viewport is not None:
+                        self.request_viewport(*self.viewport)
+                return
+            row, col = msg_data['row'], msg_data['col']
+            if msg_type == 'move_made':
+                self.game_board[row][col] = msg_data['symbol']
+            else:
+                self.stones[(row, col)] = msg_data['symbol']
+            self.last_move = {'row': row, 'col': col}
+            self.move_seq = seq
+        elif msg_type == 'viewport':
+            for key, symbol in (('x', 'X'), ('o', 'O')):
+                cells = msg_data[key]
+                for i in range(0, len(cells), 2):
+                    self.stones[(cells[i], cells[i + 1])] = symbol
+            if msg_data['seq'] >= self.move_seq:
+                self.move_seq = msg_data['seq']
+                self.last_move = msg_data.get('last_move')
+            self.sync_pending = False
+        elif msg_type == 'board_sync':
+            self.game_board = msg_data['board']
+            self.last_move = msg_data.get('last_move')
+            self.move_seq = msg_data['seq']
+            self.sync_pending = False
+        elif msg_type == 'your_turn':
+            self.is_my_turn = True
+        elif msg_type == 'wait_turn':
+            self.is_my_turn = False
+        elif msg_type == 'game_over':
+            self.is_my_turn = False
+            self.update_stats(msg_data['winner'])
+        elif msg_type == 'leaderboard':
+            you = msg_data.get('you')
+            if you:
+                # Thành tích lưu trên server thay cho số đếm của phiên này
+                self.stats = {"win": you['wins'], "loss": you['losses'], "draw": you['draws']}
+        elif msg_type == 'error':
+            self.request_games()
+        elif msg_type == 'opponent_disconnected':
+            self.resume_token = None
+            self.reset_game_state()
+        elif msg_type == 'rematch_request':
+            self.opponent_rematch = True
+            if self.rematch_requested:
+                self.start_rematch()
+                return
+        elif msg_type == 'rematch_start':
+            self.start_rematch()
+            return
+        elif msg_type == 'rematch_declined':
+            self.resume_token = None
+            self.reset_game_state()
+        self.emit(msg_type, msg_data)
+
+# --- Chạy không giao diện: nhiều người chơi máy đánh ngẫu nhiên trong một process ---
+
+class RandomPlayer:
+    def __init__(self, index, args, results):
+        self.args = args
+        self.results = results
+        self.rng = random.Random(args.seed * 1000003 + index)
+        self.games = 0
+        self.core = ClientCore(f"{args.prefix}{index}", self.on_event, args.host, args.port)
+        self.done = asyncio.get_running_loop().create_future()
+
+    def on_event(self, event, data):
+        core = self.core
+        if event in ('game_start', 'sparse_start', 'resync', 'your_turn') and core.is_my_turn:
+            self.play()
+        elif event == 'game_over':
+            self.games += 1
+            self.results['games'] += 1
+            if self.games >= self.args.games:
+                self.finish()
+            else:
+                core.answer_rematch(True)
+        elif event in ('reconnect_failed', 'opponent_disconnected', 'rematch_declined') and self.games >= self.args.games:
+            self.finish()
+        elif event == 'error':
+            self.results['errors'] += 1
+
+    def play(self):
+        # Bàn cờ tự do: thử các ô quanh nước đi cuối, nới rộng dần khi vùng gần đã kín
+        core = self.core
+        if core.free_style:
+            around = core.last_move or {'row': core.board_limit // 2, 'col': core.board_limit // 2}
+            cells = [(around['row'] + self.rng.randint(-radius, radius), around['col'] + self.rng.randint(-radius, radius))
+                     for radius in (2, 4, 8, 16, 32, 64) for _ in range(50)]
+        else:
+            cells = [(r, c) for r in range(BOARD_SIZE) for c in range(BOARD_SIZE) if core.game_board[r][c] == EMPTY_CELL]
+            self.rng.shuffle(cells)
+        for row, col in cells:
+            if core.make_move(row, col):
+                self.results['moves'] += 1
+                return
+
+    def finish(self):
+        if not self.done.done():
+            self.core.close()
+            self.done.set_result(None)
+
+async def run_players(args):
+    results = {'games': 0, 'moves': 0, 'errors': 0, 'connect_failures': 0}
+    players = []
+    started = time.perf_counter()
+    for i in range(args.sessions):
+        player = RandomPlayer(i, args, results)
+        try:
+            await player.core.connect()
+        except (OSError, asyncio.TimeoutError) as e:
+            results['connect_failures'] += 1
+            print(f"Người chơi {i} không kết nối được: {e}", file=sys.stderr)
+            continue
+        players.append(player)
+    # Hai người cuối có thể không có đối thủ: dừng sau --timeout giây
+    await asyncio.wait([player.done for player in players], timeout=args.timeout)
+    for player in players:
+        player.core.close()
+    elapsed = time.perf_counter() - started
+    print(f"{len(players)} phiên, {results['games']} lần kết thúc ván, {results['moves']} nước trong {elapsed:.1f}s "
+          f"({results['moves'] / elapsed:.0f} nước/giây), {results['errors']} lỗi, "
+          f"{results['connect_failures']} kết nối thất bại")
+
+def main():
+    parser = argparse.ArgumentParser(description="Chạy nhiều người chơi máy không giao diện trên lõi client")
+    parser.add_argument('--host', default=HOST)
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('--sessions', type=int, default=100, help="số phiên chơi cùng lúc")
+    parser.add_argument('--games', type=int, default=1, help="số ván mỗi phiên chơi trước khi thoát")
+    parser.add_argument('--timeout', type=float, default=120, help="dừng sau số giây này dù chưa chơi xong")
+    parser.add_argument('--prefix', default='headless', help="tiền tố tên người chơi")
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    asyncio.run(run_players(args))
+
+if __name__ == "__main__":
+    main()
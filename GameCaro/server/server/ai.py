@@ -0,0 +1,365 @@
+﻿import json
+import logging
+import random
+import threading
+import time
+
+from board import BOARD_SIZE, EMPTY_CELL, SYMBOL_X, SYMBOL_O, WIN_CONDITION
+from openingbook import open_book
+
+log = logging.getLogger('caro.bot')
+
+# Search engine for the server-side bot. Positions are scored with the classic "window" count:
+# every run of WIN_CONDITION cells that holds stones of only one player is worth WINDOW_VALUE
+# of its stone count to that player. Window counts are updated incrementally on play/undo, so
+# both evaluation and threat-based move ordering only touch the windows through one cell.
+
+CELLS = BOARD_SIZE * BOARD_SIZE
+WIN_SCORE = 10 ** 7
+WINDOW_VALUE = (0, 1, 12, 150, 2000, WIN_SCORE)
+NEIGHBOR_DISTANCE = 2
+ROOT_BRANCHING = 12
+NODE_BRANCHING = 8
+TIME_CHECK_INTERVAL = 256
+TABLE_BITS = 18  # 262144 transposition table slots per worker process
+
+EXACT, LOWER, UPPER = 0, 1, 2
+
+def build_windows():
+    windows = []
+    for row in range(BOARD_SIZE):
+        for col in range(BOARD_SIZE):
+            for dr, dc in ((0, 1), (1, 0), (1, 1), (1, -1)):
+                end_row, end_col = row + dr * (WIN_CONDITION - 1), col + dc * (WIN_CONDITION - 1)
+                if 0 <= end_row < BOARD_SIZE and 0 <= end_col < BOARD_SIZE:
+                    windows.append(tuple((row + dr * i) * BOARD_SIZE + col + dc * i for i in range(WIN_CONDITION)))
+    cell_windows = [[] for _ in range(CELLS)]
+    for window_id, window in enumerate(windows):
+        for cell in window:
+            cell_windows[cell].append(window_id)
+    return windows, [tuple(ids) for ids in cell_windows]
+
+WINDOWS, CELL_WINDOWS = build_windows()
+
+def build_neighbors():
+    neighbors = []
+    for row in range(BOARD_SIZE):
+        for col in range(BOARD_SIZE):
+            neighbors.append(tuple(r * BOARD_SIZE + c
+                                   for r in range(max(0, row - NEIGHBOR_DISTANCE), min(BOARD_SIZE, row + NEIGHBOR_DISTANCE + 1))
+                                   for c in range(max(0, col - NEIGHBOR_DISTANCE), min(BOARD_SIZE, col + NEIGHBOR_DISTANCE + 1))
+                                   if (r, c) != (row, col)))
+    return neighbors
+
+NEIGHBORS = build_neighbors()
+
+# WINDOW_SCORE[a][b]: value for player 1 of a window holding a stones of player 1 and b of player 2.
+WINDOW_SCORE = [[0 if a and b else WINDOW_VALUE[a] - WINDOW_VALUE[b] for b in range(WIN_CONDITION + 1)]
+                for a in range(WIN_CONDITION + 1)]
+
+_zobrist_rng = random.Random(20240615)
+ZOBRIST = [(0, _zobrist_rng.getrandbits(64), _zobrist_rng.getrandbits(64)) for _ in range(CELLS)]
+
+class SearchTimeout(Exception):
+    pass
+
+class TranspositionTable:
+    # Fixed number of slots indexed by the low bits of the Zobrist key, always-replace.
+    def __init__(self, bits=TABLE_BITS):
+        self.mask = (1 << bits) - 1
+        self.slots = [None] * (1 << bits)
+
+    def get(self, key):
+        entry = self.slots[key & self.mask]
+        if entry is not None and entry[0] == key:
+            return entry
+        return None
+
+    def put(self, key, depth, flag, score, move):
+        self.slots[key & self.mask] = (key, depth, flag, score, move)
+
+class SearchEngine:
+    def __init__(self, table=None):
+        self.cells = [0] * CELLS
+        self.counts = (None, [0] * len(WINDOWS), [0] * len(WINDOWS))
+        self.near = [0] * CELLS
+        self.score = 0  # from player 1's point of view
+        self.key = 0
+        self.stones = 0
+        self.table = table or TranspositionTable()
+        self.nodes = 0
+        self.deadline = None
+
+    def play(self, cell, player):
+        won = False
+        counts = self.counts[player]
+        mine_first = player == 1
+        other = self.counts[3 - player]
+        delta = 0
+        for window_id in CELL_WINDOWS[cell]:
+            mine = counts[window_id]
+            theirs = other[window_id]
+            if mine_first:
+                delta -= WINDOW_SCORE[mine][theirs] - WINDOW_SCORE[mine + 1][theirs]
+            else:
+                delta -= WINDOW_SCORE[theirs][mine] - WINDOW_SCORE[theirs][mine + 1]
+            counts[window_id] = mine + 1
+            if mine + 1 == WIN_CONDITION:
+                won = True
+        self.score += delta
+        self.cells[cell] = player
+        self.key ^= ZOBRIST[cell][player]
+        self.stones += 1
+        for neighbor in NEIGHBORS[cell]:
+            self.near[neighbor] += 1
+        return won
+
+    def undo(self, cell, player):
+        counts = self.counts[player]
+        other = self.counts[3 - player]
+        delta = 0
+        for window_id in CELL_WINDOWS[cell]:
+            mine = counts[window_id]
+            theirs = other[window_id]
+            if player == 1:
+                delta += WINDOW_SCORE[mine - 1][theirs] - WINDOW_SCORE[mine][theirs]
+            else:
+                delta += WINDOW_SCORE[theirs][mine - 1] - WINDOW_SCORE[theirs][mine]
+            counts[window_id] = mine - 1
+        self.score += delta
+        self.cells[cell] = 0
+        self.key ^= ZOBRIST[cell][player]
+        self.stones -= 1
+        for neighbor in NEIGHBORS[cell]:
+            self.near[neighbor] -= 1
+
+    def threat(self, cell, player):
+        # How much `cell` is worth to `player` (attack) plus what it takes away from the
+        # opponent (defence): the threat-based ordering key.
+        mine_counts = self.counts[player]
+        their_counts = self.counts[3 - player]
+        attack = defence = 0
+        for window_id in CELL_WINDOWS[cell]:
+            mine = mine_counts[window_id]
+            theirs = their_counts[window_id]
+            if not theirs:
+                attack += WINDOW_VALUE[mine + 1] - WINDOW_VALUE[mine]
+            if not mine:
+                defence += WINDOW_VALUE[theirs + 1] - WINDOW_VALUE[theirs]
+        return attack + defence * 0.9
+
+    def candidates(self, player, limit):
+        cells = self.cells
+        near = self.near
+        if self.stones == 0:
+            return [(BOARD_SIZE // 2) * BOARD_SIZE + BOARD_SIZE // 2]
+        scored = [(self.threat(cell, player), cell) for cell in range(CELLS) if not cells[cell] and near[cell]]
+        scored.sort(reverse=True)
+        return [cell for _, cell in scored[:limit]]
+
+    def negamax(self, depth, alpha, beta, player, ply):
+        self.nodes += 1
+        if self.nodes % TIME_CHECK_INTERVAL == 0 and time.perf_counter() > self.deadline:
+            raise SearchTimeout()
+        sign = 1 if player == 1 else -1
+        if depth == 0:
+            return sign * self.score
+        if self.stones == CELLS:
+            return 0
+
+        alpha_original = alpha
+        entry = self.table.get(self.key)
+        hash_move = None
+        if entry is not None:
+            _, entry_depth, flag, entry_score, hash_move = entry
+            if entry_depth >= depth:
+                if flag == EXACT:
+                    return entry_score
+                if flag == LOWER:
+                    alpha = max(alpha, entry_score)
+                elif flag == UPPER:
+                    beta = min(beta, entry_score)
+                if alpha >= beta:
+                    return entry_score
+
+        moves = self.candidates(player, NODE_BRANCHING)
+        if hash_move is not None and hash_move in moves:
+            moves.remove(hash_move)
+            moves.insert(0, hash_move)
+        best_score = -WIN_SCORE * 2
+        best_move = moves[0] if moves else None
+        for cell in moves:
+            if self.play(cell, player):
+                score = WIN_SCORE - ply
+            else:
+                score = -self.negamax(depth - 1, -beta, -alpha, 3 - player, ply + 1)
+            self.undo(cell, player)
+            if score > best_score:
+                best_score, best_move = score, cell
+            if score > alpha:
+                alpha = score
+            if alpha >= beta:
+                break
+
+        if best_score <= alpha_original:
+            flag = UPPER
+        elif best_score >= beta:
+            flag = LOWER
+        else:
+            flag = EXACT
+        self.table.put(self.key, depth, flag, best_score, best_move)
+        return best_score
+
+    def search_root(self, depth, player, moves):
+        best_score, best_move = -WIN_SCORE * 2, moves[0]
+        alpha, beta = -WIN_SCORE * 2, WIN_SCORE * 2
+        for cell in moves:
+            if self.play(cell, player):
+                score = WIN_SCORE
+            else:
+                score = -self.negamax(depth - 1, -beta, -alpha, 3 - player, 1)
+            self.undo(cell, player)
+            if score > best_score:
+                best_score, best_move = score, cell
+            alpha = max(alpha, score)
+        return best_score, best_move
+
+    def search(self, player, time_budget, max_depth=20):
+        # Iterative deepening: every finished depth leaves a usable answer, the best move of the
+        # previous depth is searched first, and the search stops when the time budget runs out.
+        started = time.perf_counter()
+        self.deadline = started + time_budget
+        self.nodes = 0
+        moves = self.candidates(player, ROOT_BRANCHING)
+        best_move, best_score, completed_depth = moves[0], 0, 0
+        for depth in range(1, max_depth + 1):
+            try:
+                score, move = self.search_root(depth, player, moves)
+            except SearchTimeout:
+                break
+            best_move, best_score, completed_depth = move, score, depth
+            moves.remove(move)
+            moves.insert(0, move)
+            if abs(score) >= WIN_SCORE - max_depth:
+                break
+        elapsed = time.perf_counter() - started
+        return best_move, {
+            'depth': completed_depth,
+            'score': best_score,
+            'nodes': self.nodes,
+            'seconds': round(elapsed, 3),
+            'nodes_per_sec': int(self.nodes / elapsed) if elapsed > 0 else 0,
+        }
+
+PLAYER_OF_SYMBOL = {SYMBOL_X: 1, SYMBOL_O: 2}
+
+# One table per worker process, reused across moves: Zobrist keys stay valid between positions.
+_worker_table = None
+
+def book_move(book_path, rows, symbol):
+    # (row, col, stats) from the opening book, or None. The book key does not depend on move
+    # order, so the wire board is enough.
+    stones = [(row * BOARD_SIZE + col, PLAYER_OF_SYMBOL[rows[row][col]])
+              for row in range(BOARD_SIZE) for col in range(BOARD_SIZE) if rows[row][col] != EMPTY_CELL]
+    x_count = sum(1 for _, player in stones if player == 1)
+    if PLAYER_OF_SYMBOL[symbol] != (1 if 2 * x_count == len(stones) else 2):
+        return None
+    found = open_book(book_path).lookup(stones)
+    if found is None or rows[found[0]][found[1]] != EMPTY_CELL:
+        return None
+    row, col, games, score = found
+    return row, col, {'depth': 0, 'score': score, 'nodes': 0, 'seconds': 0.0, 'nodes_per_sec': 0, 'book': games}
+
+def choose_move(rows, symbol, time_budget, max_depth=20, book_path=None):
+    # Entry point for the worker pool: takes the list-of-lists wire board, returns (row, col, stats).
+    global _worker_table
+    if book_path:
+        move = book_move(book_path, rows, symbol)
+        if move is not None:
+            return move
+    if _worker_table is None:
+        _worker_table = TranspositionTable()
+    engine = SearchEngine(_worker_table)
+    for row in range(BOARD_SIZE):
+        for col in range(BOARD_SIZE):
+            if rows[row][col] != EMPTY_CELL:
+                engine.play(row * BOARD_SIZE + col, PLAYER_OF_SYMBOL[rows[row][col]])
+    cell, stats = engine.search(PLAYER_OF_SYMBOL[symbol], time_budget, max_depth)
+    return cell // BOARD_SIZE, cell % BOARD_SIZE, stats
+
+class BotClient:
+    # Stands in for a client connection: the server sends it the same encoded messages as a
+    # human player and it answers with protocol messages through `reply`, so games against the
+    # bot use the normal session flow. Searches run in `pool` and never on the network loop.
+    def __init__(self, bot_id, pool, reply, time_budget, book_path=None):
+        self.peername = ('bot', bot_id)
+        self.pool = pool
+        self.reply = reply
+        self.time_budget = time_budget
+        self.book_path = book_path
+        self.max_queue_depth = 0
+        self.send_blocked_seconds = 0.0
+        self.closed = False
+        self.lock = threading.Lock()
+        self.rows = None
+        self.symbol = None
+        self.seq = 0
+        self.round = 0
+
+    def getpeername(self):
+        return self.peername
+
+    def send(self, message_type, payload):
+        if self.closed:
+            return
+        data = json.loads(payload)['data']
+        think = False
+        with self.lock:
+            if message_type == 'game_start':
+                self.rows = data['board']
+                self.symbol = data['symbol']
+                self.seq = data['seq']
+                self.round += 1
+                think = data['is_turn']
+            elif message_type == 'move_made' and self.rows is not None:
+                self.rows[data['row']][data['col']] = data['symbol']
+                self.seq = data['seq']
+            elif message_type in ('update_board', 'board_sync'):
+                self.rows = data['board']
+            elif message_type == 'your_turn':
+                think = True
+        if message_type == 'rematch_request':
+            self.reply(self, {'type': 'rematch_request', 'data': {}})
+        elif think:
+            self.think()
+
+    def think(self):
+        with self.lock:
+            rows = [list(row) for row in self.rows]
+            position = (self.round, self.seq)
+            symbol = self.symbol
+        future = self.pool.submit(choose_move, rows, symbol, self.time_budget, book_path=self.book_path)
+        future.add_done_callback(lambda done: self.moved(done, position))
+
+    def moved(self, future, position):
+        # Runs on a pool thread. A result for a position that has since changed is dropped.
+        if self.closed or future.cancelled():
+            return
+        try:
+            row, col, stats = future.result()
+        except Exception as e:
+            log.error("Lỗi khi bot %s tìm nước đi: %s", self.peername, e)
+            return
+        with self.lock:
+            if (self.round, self.seq) != position:
+                return
+        if stats.get('book'):
+            log.info("Bot %s đi (%d, %d) theo sách khai cuộc (%d ván, điểm %.3f).", self.peername, row, col,
+                     stats['book'], stats['score'])
+        else:
+            log.info("Bot %s đi (%d, %d): độ sâu %d, %d nút trong %ss (%d nút/giây).", self.peername, row, col,
+                     stats['depth'], stats['nodes'], stats['seconds'], stats['nodes_per_sec'])
+        self.reply(self, {'type': 'move', 'data': {'row': row, 'col': col}})
+
+    def close(self):
+        self.closed = True
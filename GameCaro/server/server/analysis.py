@@ -0,0 +1,141 @@
+﻿import collections
+
+from ai import ZOBRIST
+from board import BOARD_SIZE, SYMBOL_X, SYMBOL_O, WIN_CONDITION
+from openingbook import open_book, stones_of
+
+# Evaluator behind the 'analyze' message. Every empty cell near the stones is scored by the line
+# shapes a stone there would make, for the side to move (attack) and for the opponent (the
+# threat it takes away). Shapes are matched on the WIN_CONDITION - 1 cells either side of the
+# cell in each of the four directions: 'x' is a stone of the player being scored (the new
+# stone included), '.' an empty cell, and anything else, the board edge too, blocks.
+
+REACH = WIN_CONDITION - 1
+CENTER = REACH  # index of the new stone in a line string
+NEIGHBOR_DISTANCE = 2
+DEFENCE_WEIGHT = 0.9
+TOP_MOVES = 20  # moves kept per analysed position; requests get a prefix of them
+
+# Best first; a shape only counts where it covers the new stone.
+PATTERNS = (
+    ('five', 1000000, ('xxxxx',)),
+    ('open_four', 100000, ('.xxxx.',)),
+    ('four', 10000, ('xxxx.', '.xxxx', 'xxx.x', 'x.xxx', 'xx.xx')),
+    ('open_three', 5000, ('..xxx.', '.xxx..', '.xx.x.', '.x.xx.')),
+    ('three', 500, ('.xxx.', 'xxx..', '..xxx', 'xx.x.', '.x.xx', 'xx..x', 'x..xx', 'x.x.x')),
+    ('open_two', 200, ('..xx..', '.x.x.', '.x..x.')),
+    ('two', 20, ('xx...', '...xx', 'x.x..', '..x.x', 'x..x.', '.x..x', 'x...x')),
+)
+WIN_SCORE = PATTERNS[0][1]
+DIRECTIONS = ((0, 1), (1, 0), (1, 1), (1, -1))
+SIDE_TO_MOVE_KEY = 0x9E3779B97F4A7C15  # xored in when O is to move
+
+def position_key(moves):
+    # Zobrist key of the position after `moves` (X first), with the same table as the bot's search.
+    key = 0
+    for i, (row, col) in enumerate(moves):
+        key ^= ZOBRIST[row * BOARD_SIZE + col][1 + i % 2]
+    return key ^ SIDE_TO_MOVE_KEY if len(moves) % 2 else key
+
+def line_shape(line):
+    for name, score, shapes in PATTERNS:
+        for shape in shapes:
+            # The first match at or after the earliest start that still covers the centre.
+            start = line.find(shape, max(0, CENTER + 1 - len(shape)))
+            if 0 <= start <= CENTER:
+                return name, score
+    return None, 0
+
+def cell_value(cells, row, col, player):
+    # (total score, best shape) of a stone of `player` at (row, col).
+    total, best, best_score = 0, None, 0
+    for dr, dc in DIRECTIONS:
+        chars = []
+        for step in range(-REACH, REACH + 1):
+            r, c = row + dr * step, col + dc * step
+            if step == 0:
+                chars.append('x')
+            elif 0 <= r < BOARD_SIZE and 0 <= c < BOARD_SIZE:
+                owner = cells[r * BOARD_SIZE + c]
+                chars.append('.' if not owner else 'x' if owner == player else 'o')
+            else:
+                chars.append('o')
+        name, score = line_shape(''.join(chars))
+        total += score
+        if score > best_score:
+            best, best_score = name, score
+    return total, best
+
+def analyze_position(moves, top=TOP_MOVES, book_path=None):
+    # Runs in a worker process. moves: [(row, col)] from the start of the round, X first.
+    result = evaluate_position(moves, top)
+    found = open_book(book_path).lookup(stones_of(moves)) if book_path else None
+    if found is not None:
+        # The book's move goes first, valued at its score in 1/1000, whatever the shapes say.
+        row, col, _, score = found
+        others = [move for move in result['moves'] if move[:2] != (row, col)]
+        result['moves'] = [(row, col, round(score * 1000), 'book')] + others[:top - 1]
+    return result
+
+def evaluate_position(moves, top):
+    cells = [0] * (BOARD_SIZE * BOARD_SIZE)
+    for i, (row, col) in enumerate(moves):
+        cells[row * BOARD_SIZE + col] = 1 + i % 2
+    player = 1 + len(moves) % 2
+    opponent = 3 - player
+    if not moves:
+        center = BOARD_SIZE // 2
+        return {'to_move': SYMBOL_X, 'score': 0, 'moves': [(center, center, 0, None)]}
+    candidates = set()
+    for row, col in moves:
+        for r in range(max(0, row - NEIGHBOR_DISTANCE), min(BOARD_SIZE, row + NEIGHBOR_DISTANCE + 1)):
+            for c in range(max(0, col - NEIGHBOR_DISTANCE), min(BOARD_SIZE, col + NEIGHBOR_DISTANCE + 1)):
+                if not cells[r * BOARD_SIZE + c]:
+                    candidates.add((r, c))
+    scored = []
+    best_attack = best_threat = 0
+    for row, col in candidates:
+        attack, attack_shape = cell_value(cells, row, col, player)
+        defence, defence_shape = cell_value(cells, row, col, opponent)
+        best_attack, best_threat = max(best_attack, attack), max(best_threat, defence)
+        if attack >= defence * DEFENCE_WEIGHT or defence_shape is None:
+            label = attack_shape
+        else:
+            label = 'block_' + defence_shape
+        scored.append((attack + DEFENCE_WEIGHT * defence, row, col, label))
+    scored.sort(key=lambda move: (-move[0], move[1], move[2]))
+    # From the side to move's point of view: its best shape against the best the opponent could
+    # make if left alone, discounted because the side to move gets there first. A five on the
+    # board for the taking is simply a win.
+    score = WIN_SCORE if best_attack >= WIN_SCORE else best_attack - DEFENCE_WEIGHT * best_threat
+    return {'to_move': SYMBOL_X if player == 1 else SYMBOL_O, 'score': int(score),
+            'moves': [(row, col, int(value), label) for value, row, col, label in scored[:top]]}
+
+class AnalysisCache:
+    # Bounded LRU of analyze_position results by position key. Not locked: the server calls it
+    # under its own lock.
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        result = self.entries.get(key)
+        if result is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return result
+
+    def put(self, key, result):
+        if self.capacity <= 0:
+            return
+        self.entries[key] = result
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self.entries)
@@ -0,0 +1,553 @@
+﻿import argparse
+import contextlib
+import io
+import json
+import random
+import shutil
+import statistics
+import tempfile
+import time
+import tracemalloc
+
+import server
+from analysis import AnalysisCache, analyze_position, position_key
+from matchmaker import Matchmaker
+from board import Board, BOARD_SIZE, EMPTY_CELL, SparseBoard, SYMBOL_X, SYMBOL_O, WIN_CONDITION
+from gamelog import GameLogReader, GameLogWriter, RESULT_ABANDONED
+from protocol import FRAME_HEADER, FrameDecoder, decode_binary, encode_binary, encode_message
+
+class FakeSocket:
+    def __init__(self, number):
+        self.number = number
+
+    def send(self, message_type, payload):
+        pass
+
+    def getpeername(self):
+        return ('127.0.0.1', self.number)
+
+    def close(self):
+        pass
+
+def reset_server_state():
+    server.matchmaker.entries.clear()
+    server.matchmaker.buckets.clear()
+    server.player_names.clear()
+    server.player_features.clear()
+    server.player_sessions.clear()
+    server.game_sessions.clear()
+    server.spectating.clear()
+
+def open_fake_games(count, named=True):
+    sessions = []
+    for i in range(count):
+        player1, player2 = FakeSocket(2 * i), FakeSocket(2 * i + 1)
+        if named:
+            server.player_names[player1] = f"p{2 * i}"
+            server.player_names[player2] = f"p{2 * i + 1}"
+        with server.matchmaker.lock:
+            sessions.append(server.open_session(player1, player2))
+    return sessions
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+def bench_cleanup(args):
+    print(f"{'games':>8} {'mean us':>10} {'p50 us':>10} {'p99 us':>10}")
+    for count in args.sizes:
+        reset_server_state()
+        # Anonymous players are not requeued, so this times cleanup alone; see 'matchmaking' for pairing.
+        sessions = open_fake_games(count, named=False)
+        # Clean up games spread across the whole table, not just the newest ones.
+        step = max(1, count // args.samples)
+        samples = []
+        with contextlib.redirect_stdout(io.StringIO()):
+            for session in sessions[::step][:args.samples]:
+                started = time.perf_counter()
+                server.cleanup_game(session)
+                samples.append((time.perf_counter() - started) * 1e6)
+        print(f"{count:>8} {statistics.mean(samples):>10.2f} {percentile(samples, 0.5):>10.2f} {percentile(samples, 0.99):>10.2f}")
+    reset_server_state()
+
+def time_per_call(func, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - started) / repeat * 1e6
+
+def bench_delta(args):
+    rng = random.Random(args.seed)
+    board = Board()
+    cells = [(r, c) for r in range(BOARD_SIZE) for c in range(BOARD_SIZE)]
+    for i, (row, col) in enumerate(rng.sample(cells, args.stones)):
+        board.place(row, col, SYMBOL_X if i % 2 == 0 else SYMBOL_O)
+    row, col = cells[0]
+    full = ('update_board', {'board': board.to_rows(), 'last_move': {'row': row, 'col': col}})
+    delta = ('move_made', {'row': row, 'col': col, 'symbol': SYMBOL_X, 'seq': args.stones})
+    print(f"board with {args.stones} stones")
+    print(f"{'message':>14} {'bytes':>8} {'encode us':>10} {'decode us':>10}")
+    results = {}
+    for message_type, data in (full, delta):
+        payload = server.encode_message(message_type, data)
+        encode_us = time_per_call(lambda: server.encode_message(message_type, data), args.repeat)
+        decode_us = time_per_call(lambda: json.loads(payload), args.repeat)
+        results[message_type] = (len(payload), encode_us, decode_us)
+        print(f"{message_type:>14} {len(payload):>8} {encode_us:>10.2f} {decode_us:>10.2f}")
+    (full_bytes, full_enc, full_dec), (delta_bytes, delta_enc, delta_dec) = results['update_board'], results['move_made']
+    print(f"reduction: bytes x{full_bytes / delta_bytes:.1f}, encode x{full_enc / delta_enc:.1f}, decode x{full_dec / delta_dec:.1f}")
+
+def bench_binary(args):
+    rng = random.Random(args.seed)
+    board = Board()
+    cells = [(r, c) for r in range(BOARD_SIZE) for c in range(BOARD_SIZE)]
+    for i, (row, col) in enumerate(rng.sample(cells, args.stones)):
+        board.place(row, col, SYMBOL_X if i % 2 == 0 else SYMBOL_O)
+    rows = board.to_rows()
+    last_move = {'row': 7, 'col': 7}
+    messages = [
+        ('move', {'row': 7, 'col': 7}),
+        ('move_made', {'row': 7, 'col': 7, 'symbol': SYMBOL_X, 'seq': args.stones}),
+        ('your_turn', {}),
+        ('wait_turn', {}),
+        ('game_over', {'winner': True, 'message': "Bạn đã thắng! Chúc mừng, alice!"}),
+        ('game_start', {'symbol': SYMBOL_X, 'is_turn': True, 'board': rows, 'seq': 0, 'opponent_name': 'bob'}),
+        ('update_board', {'board': rows, 'last_move': last_move}),
+        ('board_sync', {'board': rows, 'last_move': last_move, 'seq': args.stones}),
+        ('chat', {'message': 'Chào bạn, đấu lại nhé?', 'sender': 'alice'}),
+    ]
+    print(f"board with {args.stones} stones; times in us per message")
+    print(f"{'message':>13} {'json B':>7} {'bin B':>6} {'json enc':>9} {'bin enc':>8} {'json dec':>9} {'bin dec':>8}")
+    for message_type, data in messages:
+        line = encode_message(message_type, data)
+        frame = encode_binary(message_type, data)
+        code, body = frame[2], memoryview(frame)[FRAME_HEADER.size:]
+        assert decode_binary(code, body) == json.loads(line)
+        json_enc = time_per_call(lambda: encode_message(message_type, data), args.repeat)
+        bin_enc = time_per_call(lambda: encode_binary(message_type, data), args.repeat)
+        json_dec = time_per_call(lambda: json.loads(line), args.repeat)
+        bin_dec = time_per_call(lambda: decode_binary(code, body), args.repeat)
+        print(f"{message_type:>13} {len(line):>7} {len(frame):>6} {json_enc:>9.2f} {bin_enc:>8.2f} {json_dec:>9.2f} {bin_dec:>8.2f}")
+
+# The list-of-lists implementations server.py used before the bitboard, kept as the baseline.
+def legacy_check_win(board, row, col, symbol):
+    directions = [(0, 1), (1, 0), (1, 1), (1, -1)]
+    for dr, dc in directions:
+        count = 1
+        for i in range(1, WIN_CONDITION):
+            r, c = row + i * dr, col + i * dc
+            if 0 <= r < BOARD_SIZE and 0 <= c < BOARD_SIZE and board[r][c] == symbol:
+                count += 1
+            else:
+                break
+        for i in range(1, WIN_CONDITION):
+            r, c = row - i * dr, col - i * dc
+            if 0 <= r < BOARD_SIZE and 0 <= c < BOARD_SIZE and board[r][c] == symbol:
+                count += 1
+            else:
+                break
+        if count >= WIN_CONDITION:
+            return True
+    return False
+
+def legacy_is_board_full(board):
+    for r in range(BOARD_SIZE):
+        for c in range(BOARD_SIZE):
+            if board[r][c] == EMPTY_CELL:
+                return False
+    return True
+
+def random_games(rng, count):
+    cells = [(r, c) for r in range(BOARD_SIZE) for c in range(BOARD_SIZE)]
+    games = []
+    for _ in range(count):
+        rng.shuffle(cells)
+        games.append(list(cells))
+    return games
+
+def play_legacy(games):
+    moves = 0
+    for game in games:
+        board = [[EMPTY_CELL for _ in range(BOARD_SIZE)] for _ in range(BOARD_SIZE)]
+        for i, (row, col) in enumerate(game):
+            symbol = SYMBOL_X if i % 2 == 0 else SYMBOL_O
+            board[row][col] = symbol
+            moves += 1
+            if legacy_check_win(board, row, col, symbol) or legacy_is_board_full(board):
+                break
+    return moves
+
+def play_bitboard(games):
+    moves = 0
+    for game in games:
+        board = server.create_new_board()
+        for i, (row, col) in enumerate(game):
+            symbol = SYMBOL_X if i % 2 == 0 else SYMBOL_O
+            board.place(row, col, symbol)
+            moves += 1
+            if server.check_win(board, row, col, symbol) or server.is_board_full(board):
+                break
+    return moves
+
+def bench_board(args):
+    games = random_games(random.Random(args.seed), args.games)
+    print(f"{'engine':>10} {'moves':>8} {'us/move':>10}")
+    timings = {}
+    for name, play in (('legacy', play_legacy), ('bitboard', play_bitboard)):
+        started = time.perf_counter()
+        moves = play(games)
+        timings[name] = (time.perf_counter() - started) / moves * 1e6
+        print(f"{name:>10} {moves:>8} {timings[name]:>10.2f}")
+    print(f"speedup: x{timings['legacy'] / timings['bitboard']:.1f} (place + check_win + is_board_full per move)")
+
+    # A board with a single empty cell is the worst case for the old is_board_full scan.
+    legacy_board = [[SYMBOL_X if (r + c) % 2 else SYMBOL_O for c in range(BOARD_SIZE)] for r in range(BOARD_SIZE)]
+    legacy_board[BOARD_SIZE - 1][BOARD_SIZE - 1] = EMPTY_CELL
+    bitboard = server.create_new_board()
+    for r in range(BOARD_SIZE):
+        for c in range(BOARD_SIZE):
+            if legacy_board[r][c] != EMPTY_CELL:
+                bitboard.place(r, c, legacy_board[r][c])
+    center = BOARD_SIZE // 2
+    print(f"{'call':>28} {'legacy us':>10} {'bitboard us':>12}")
+    for name, legacy_call, bitboard_call in (
+            ('check_win (near-full board)', lambda: legacy_check_win(legacy_board, center, center, SYMBOL_X),
+             lambda: server.check_win(bitboard, center, center, SYMBOL_X)),
+            ('is_board_full (1 empty)', lambda: legacy_is_board_full(legacy_board),
+             lambda: server.is_board_full(bitboard))):
+        print(f"{name:>28} {time_per_call(legacy_call, args.repeat):>10.2f} {time_per_call(bitboard_call, args.repeat):>12.2f}")
+
+def bench_matchmaking(args):
+    rng = random.Random(args.seed)
+    print(f"{'mode':>9} {'players':>8} {'enqueue us':>11} {'cancel us':>10} {'pairs/s':>10} {'paired':>8}")
+    for ranked in (False, True):
+        clock = [0.0]
+        matchmaker = Matchmaker(lambda player1, player2: (player1, player2), ranked=ranked, clock=lambda: clock[0])
+        ratings = [rng.gauss(1500, 300) for _ in range(args.players)]
+
+        started = time.perf_counter()
+        for player, rating in enumerate(ratings):
+            matchmaker.enqueue(player, rating)
+        enqueue_us = (time.perf_counter() - started) / args.players * 1e6
+
+        # Cancel and re-enqueue a sample of players to time O(1) removal from the middle.
+        sample = rng.sample(range(args.players), min(args.players, 10000))
+        started = time.perf_counter()
+        for player in sample:
+            matchmaker.cancel(player)
+        cancel_us = (time.perf_counter() - started) / len(sample) * 1e6
+        for player in sample:
+            matchmaker.enqueue(player, ratings[player])
+
+        # Let everyone wait long enough for their windows to open up, then pair in passes.
+        clock[0] += 10
+        started = time.perf_counter()
+        pairs = 0
+        while True:
+            paired = len(matchmaker.run_pass())
+            if not paired:
+                break
+            pairs += paired
+        elapsed = time.perf_counter() - started
+        mode = 'ranked' if ranked else 'fifo'
+        print(f"{mode:>9} {args.players:>8} {enqueue_us:>11.2f} {cancel_us:>10.2f} {pairs / elapsed:>10.0f} {pairs * 2:>8}")
+
+def message_stream(rng, count):
+    # A game's traffic: mostly small deltas, some turn notices, full boards and chat. Chat is
+    # sent as raw UTF-8, as a non-Python client would, so Vietnamese text spans chunk borders.
+    board = [[EMPTY_CELL] * BOARD_SIZE for _ in range(BOARD_SIZE)]
+    frames = []
+    for i in range(count):
+        kind = rng.random()
+        if kind < 0.6:
+            data = {'type': 'move_made', 'data': {'row': rng.randrange(BOARD_SIZE), 'col': rng.randrange(BOARD_SIZE), 'symbol': SYMBOL_X, 'seq': i}}
+        elif kind < 0.85:
+            data = {'type': 'your_turn', 'data': {}}
+        elif kind < 0.95:
+            data = {'type': 'chat', 'data': {'message': 'Chào bạn, ván này hay quá! Đấu lại nhé?', 'sender': 'Người chơi'}}
+        else:
+            data = {'type': 'update_board', 'data': {'board': board, 'last_move': None}}
+        frames.append(json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8') + b'\n')
+    return b''.join(frames)
+
+def legacy_stream_decode(chunks):
+    # The receive loops before protocol.FrameDecoder: decode every chunk, append to a str buffer
+    # and split one message off the front at a time.
+    messages = errors = 0
+    buffer = ""
+    for chunk in chunks:
+        try:
+            buffer += chunk.decode('utf-8')
+        except UnicodeDecodeError:
+            errors += 1  # the real loops dropped the connection here
+            continue
+        while '\n' in buffer:
+            message_str, buffer = buffer.split('\n', 1)
+            if message_str:
+                try:
+                    json.loads(message_str)
+                    messages += 1
+                except ValueError:
+                    errors += 1
+    return messages, errors
+
+def framed_stream_decode(chunks):
+    decoder = FrameDecoder()
+    messages = 0
+    for chunk in chunks:
+        messages += len(decoder.feed(chunk))
+    return messages, 0
+
+def bench_framing(args):
+    stream = message_stream(random.Random(args.seed), args.messages)
+    print(f"{len(stream)} bytes, {args.messages} messages")
+    print(f"{'chunk':>8} {'legacy msg/s':>13} {'framed msg/s':>13} {'speedup':>8} {'legacy errors':>14}")
+    for chunk_size in args.chunk_sizes:
+        chunks = [stream[i:i + chunk_size] for i in range(0, len(stream), chunk_size)]
+        rates = []
+        for decode in (legacy_stream_decode, framed_stream_decode):
+            best = float('inf')
+            for _ in range(args.repeat):
+                started = time.perf_counter()
+                messages, errors = decode(chunks)
+                best = min(best, time.perf_counter() - started)
+            rates.append((messages / best, errors))
+        (legacy_rate, legacy_errors), (framed_rate, _) = rates
+        print(f"{chunk_size:>8} {legacy_rate:>13.0f} {framed_rate:>13.0f} {framed_rate / legacy_rate:>7.1f}x {legacy_errors:>14}")
+
+def bench_gamelog(args):
+    rng = random.Random(args.seed)
+    cells = [(r, c) for r in range(BOARD_SIZE) for c in range(BOARD_SIZE)]
+    games = []
+    for _ in range(args.games):
+        length = rng.randint(9, 60)
+        games.append([(row, col, 500 * i) for i, (row, col) in enumerate(rng.sample(cells, length))])
+    players = [f"player{i}" for i in range(args.players)]
+    directory = tempfile.mkdtemp(prefix='caro-gamelog-')
+    try:
+        writer = GameLogWriter(directory)
+        started = time.perf_counter()
+        for moves in games:
+            now = time.time()
+            writer.append(writer.next_game_id(), now, now, BOARD_SIZE, rng.randint(0, RESULT_ABANDONED),
+                          rng.choice(players), rng.choice(players), moves)
+        append_us = (time.perf_counter() - started) / args.games * 1e6
+        writer.close()
+        written = time.perf_counter() - started
+        print(f"write: {append_us:.2f} us/append on the caller, {args.games / written:.0f} games/s to disk "
+              f"({writer.bytes_written / 1e6:.1f} MB, {writer.batches} fsyncs)")
+
+        started = time.perf_counter()
+        reader = GameLogReader(directory)
+        indexed = time.perf_counter() - started
+        started = time.perf_counter()
+        moves = 0
+        for record in reader:
+            for _ in record.replay():
+                moves += 1
+        replayed = time.perf_counter() - started
+        sample = rng.sample(list(reader.game_ids()), min(len(reader), 10000))
+        started = time.perf_counter()
+        for game_id in sample:
+            reader.get(game_id)
+        lookup_us = (time.perf_counter() - started) / len(sample) * 1e6
+        started = time.perf_counter()
+        player_games = sum(len(reader.games_of(player)) for player in players[:100])
+        by_player_ms = (time.perf_counter() - started) / min(len(players), 100) * 1e3
+        print(f"read: index {len(reader)} games in {indexed:.2f}s ({len(reader) / indexed:.0f} games/s), "
+              f"replay {moves / replayed:.0f} moves/s, get {lookup_us:.2f} us, "
+              f"games_of {by_player_ms:.2f} ms ({player_games / min(len(players), 100):.0f} games/player)")
+        reader.close()
+    finally:
+        shutil.rmtree(directory)
+
+def bench_spectators(args):
+    rng = random.Random(args.seed)
+    reset_server_state()
+    session = open_fake_games(1)[0]
+    watchers = [FakeSocket(1000 + i) for i in range(args.spectators)]
+    for watcher in watchers:
+        binary = rng.random() < args.binary_share
+        server.player_features[watcher] = {'delta', 'binary'} if binary else {'delta'}
+        session.set_spectator(watcher, binary)
+        server.spectating[watcher] = session
+    cells = [(r, c) for r in range(BOARD_SIZE) for c in range(BOARD_SIZE)]
+    moves = [{'row': row, 'col': col, 'symbol': SYMBOL_X if i % 2 == 0 else SYMBOL_O, 'seq': i + 1}
+             for i, (row, col) in enumerate(rng.sample(cells, args.moves))]
+
+    def per_recipient():
+        # What the server would do with send_to_client: one features lookup and one encode each.
+        for delta in moves:
+            for watcher in list(session.spectators):
+                server.send_to_client(watcher, 'move_made', delta)
+
+    snapshot_seconds = []
+
+    def encode_once():
+        for delta in moves:
+            started = time.perf_counter()
+            with session.lock:
+                snapshot = session.watchers()
+            snapshot_seconds.append(time.perf_counter() - started)
+            server.broadcast(snapshot, 'move_made', delta)
+
+    print(f"one game, {args.spectators} spectators ({args.binary_share:.0%} binary), {args.moves} moves")
+    print(f"{'fan-out':>14} {'ms/move':>9} {'ns/spectator':>13} {'encodes/move':>13}")
+    results = {}
+    for name, func, encodes in (('per-recipient', per_recipient, args.spectators), ('encode-once', encode_once, 2)):
+        started = time.perf_counter()
+        for _ in range(args.repeat):
+            func()
+        per_move = (time.perf_counter() - started) / (args.repeat * args.moves)
+        results[name] = per_move
+        print(f"{name:>14} {per_move * 1e3:>9.2f} {per_move / args.spectators * 1e9:>13.0f} {encodes:>13}")
+    print(f"speed-up x{results['per-recipient'] / results['encode-once']:.1f}; "
+          f"lock held for the snapshot: p50 {percentile(snapshot_seconds, 0.5) * 1e6:.0f} us, "
+          f"p99 {percentile(snapshot_seconds, 0.99) * 1e6:.0f} us")
+    snapshot = session.spectate_data()
+    print(f"spectate_start snapshot: {len(encode_message('spectate_start', snapshot))} B JSON, "
+          f"{len(encode_binary('spectate_start', snapshot))} B in a binary frame")
+    reset_server_state()
+
+def allocated_by(build):
+    # Bytes still allocated by whatever build() returns.
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    kept = build()
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del kept
+    return used
+
+def bench_sparse(args):
+    rng = random.Random(args.seed)
+    size = args.size
+    view = BOARD_SIZE
+    print(f"{size}x{size} board; dense = list of rows sent whole, sparse = SparseBoard + {view}x{view} viewport")
+    print(f"{'stones':>7} {'dense mem':>10} {'sparse mem':>11} {'dense msg B':>12} {'viewport B':>11} {'stone B':>8} "
+          f"{'has_five_at us':>15}")
+    for stones in args.stones:
+        cells = rng.sample(range(size * size), stones)
+        moves = [(cell // size, cell % size, SYMBOL_X if i % 2 == 0 else SYMBOL_O) for i, cell in enumerate(cells)]
+
+        def build_dense():
+            rows = [[EMPTY_CELL] * size for _ in range(size)]
+            for row, col, symbol in moves:
+                rows[row][col] = symbol
+            return rows
+
+        def build_sparse():
+            board = SparseBoard(size)
+            for row, col, symbol in moves:
+                board.place(row, col, symbol)
+            return board
+
+        rows, board = build_dense(), build_sparse()
+        row, col, symbol = moves[-1]
+        session = server.GameSession(1, None, None)
+        session.board, session.move_count, session.last_move = board, stones, {'row': row, 'col': col}
+        viewport = session.viewport_data(row - view // 2, col - view // 2, view, view)
+        dense_bytes = len(encode_message('update_board', {'board': rows, 'last_move': session.last_move}))
+        stone_bytes = len(encode_binary('stone', {'row': row, 'col': col, 'symbol': symbol, 'seq': stones}))
+        check_us = time_per_call(lambda: board.has_five_at(row, col, symbol), args.repeat)
+        print(f"{stones:>7} {allocated_by(build_dense):>10} {allocated_by(build_sparse):>11} {dense_bytes:>12} "
+              f"{len(encode_message('viewport', viewport)):>11} {stone_bytes:>8} {check_us:>15.2f}")
+    # An unbounded board costs the same per stone however far apart the stones are.
+    board = SparseBoard(0)
+    spread = 10 ** 6
+    for i in range(max(args.stones)):
+        board.place(rng.randrange(-spread, spread), rng.randrange(-spread, spread), SYMBOL_X if i % 2 == 0 else SYMBOL_O)
+    started = time.perf_counter()
+    found = board.stones_in(-view // 2, -view // 2, view, view)
+    print(f"unbounded, {len(board.stones)} stones over +-{spread}: viewport lookup "
+          f"{(time.perf_counter() - started) * 1e6:.0f} us ({len(found)} in view)")
+
+def bench_analysis(args):
+    # What an 'analyze' request costs the server: an evaluation in the pool on a miss, only the
+    # key and an LRU lookup on a hit.
+    games = random_games(random.Random(args.seed), args.positions)
+    cache = AnalysisCache(args.positions)
+    print(f"{'stones':>7} {'evaluate ms':>12} {'key us':>7} {'hit us':>7}")
+    for stones in args.stones:
+        positions = [tuple(game[:stones]) for game in games]
+        started = time.perf_counter()
+        for moves in positions:
+            cache.put(position_key(moves), analyze_position(moves))
+        evaluate_ms = (time.perf_counter() - started) / len(positions) * 1e3
+        moves = positions[0]
+        key_us = time_per_call(lambda: position_key(moves), args.repeat)
+        hit_us = time_per_call(lambda: cache.get(position_key(moves)), args.repeat)
+        print(f"{stones:>7} {evaluate_ms:>12.2f} {key_us:>7.2f} {hit_us:>7.2f}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Caro server micro-benchmarks")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    cleanup = subparsers.add_parser('cleanup', help="cleanup_game latency vs. number of active games")
+    cleanup.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 1000, 10000, 50000])
+    cleanup.add_argument('--samples', type=int, default=1000)
+    cleanup.set_defaults(func=bench_cleanup)
+
+    delta = subparsers.add_parser('delta', help="full update_board vs. move_made delta per move")
+    delta.add_argument('--stones', type=int, default=60)
+    delta.add_argument('--repeat', type=int, default=20000)
+    delta.add_argument('--seed', type=int, default=1)
+    delta.set_defaults(func=bench_delta)
+
+    binary = subparsers.add_parser('binary', help="JSON lines vs. binary frames per message type")
+    binary.add_argument('--stones', type=int, default=60)
+    binary.add_argument('--repeat', type=int, default=20000)
+    binary.add_argument('--seed', type=int, default=1)
+    binary.set_defaults(func=bench_binary)
+
+    board = subparsers.add_parser('board', help="list-of-lists vs. bitboard check_win/is_board_full")
+    board.add_argument('--games', type=int, default=2000)
+    board.add_argument('--seed', type=int, default=1)
+    board.add_argument('--repeat', type=int, default=20000)
+    board.set_defaults(func=bench_board)
+
+    matchmaking = subparsers.add_parser('matchmaking', help="enqueue/cancel cost and pairing throughput")
+    matchmaking.add_argument('--players', type=int, default=100000)
+    matchmaking.add_argument('--seed', type=int, default=1)
+    matchmaking.set_defaults(func=bench_matchmaking)
+
+    framing = subparsers.add_parser('framing', help="str-buffer split loop vs. protocol.FrameDecoder")
+    framing.add_argument('--messages', type=int, default=20000)
+    framing.add_argument('--chunk-sizes', type=int, nargs='+', default=[1024, 4096, 65536, 262144])
+    framing.add_argument('--repeat', type=int, default=5)
+    framing.add_argument('--seed', type=int, default=1)
+    framing.set_defaults(func=bench_framing)
+
+    gamelog = subparsers.add_parser('gamelog', help="game log append cost, index build and replay speed")
+    gamelog.add_argument('--games', type=int, default=200000)
+    gamelog.add_argument('--players', type=int, default=5000)
+    gamelog.add_argument('--seed', type=int, default=1)
+    gamelog.set_defaults(func=bench_gamelog)
+
+    spectators = subparsers.add_parser('spectators', help="per-recipient send_to_client vs. encode-once broadcast")
+    spectators.add_argument('--spectators', type=int, default=10000)
+    spectators.add_argument('--moves', type=int, default=40)
+    spectators.add_argument('--binary-share', type=float, default=0.5, help="fraction of spectators using binary frames")
+    spectators.add_argument('--repeat', type=int, default=3)
+    spectators.add_argument('--seed', type=int, default=1)
+    spectators.set_defaults(func=bench_spectators)
+
+    sparse = subparsers.add_parser('sparse', help="dense rows vs. SparseBoard and viewports on a free-style board")
+    sparse.add_argument('--size', type=int, default=100)
+    sparse.add_argument('--stones', type=int, nargs='+', default=[50, 200, 1000, 5000])
+    sparse.add_argument('--repeat', type=int, default=20000)
+    sparse.add_argument('--seed', type=int, default=1)
+    sparse.set_defaults(func=bench_sparse)
+
+    analysis = subparsers.add_parser('analysis', help="pattern evaluator cost vs. an LRU hit per 'analyze' request")
+    analysis.add_argument('--positions', type=int, default=200)
+    analysis.add_argument('--stones', type=int, nargs='+', default=[10, 30, 60, 100])
+    analysis.add_argument('--repeat', type=int, default=20000)
+    analysis.add_argument('--seed', type=int, default=1)
+    analysis.set_defaults(func=bench_analysis)
+
+    args = parser.parse_args()
+    args.func(args)
+
+if __name__ == "__main__":
+    main()
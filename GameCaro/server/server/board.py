@@ -0,0 +1,138 @@
+﻿BOARD_SIZE = 15
+EMPTY_CELL = ' '
+
+SYMBOL_X = 'X'
+SYMBOL_O = 'O'
+WIN_CONDITION = 5
+
+# Each row takes BOARD_SIZE + 1 bits; the extra always-empty bit at the end of a row stops
+# horizontal and diagonal shifts from wrapping into the next row.
+STRIDE = BOARD_SIZE + 1
+DIRECTION_SHIFTS = (1, STRIDE, STRIDE + 1, STRIDE - 1)
+
+def line_steps(length):
+    # AND-ing a mask of line starts with itself shifted by `step` cells extends every line by
+    # `step`, so doubling reaches `length` in O(log length) operations (1 -> 2 -> 4 -> 5).
+    steps = []
+    covered = 1
+    while covered < length:
+        step = min(covered, length - covered)
+        steps.append(step)
+        covered += step
+    return steps
+
+LINE_SHIFTS = tuple(tuple(shift * step for step in line_steps(WIN_CONDITION)) for shift in DIRECTION_SHIFTS)
+
+def cell_bit(row, col):
+    return 1 << (row * STRIDE + col)
+
+def has_line(bits, line_shifts=LINE_SHIFTS):
+    for shifts in line_shifts:
+        run = bits
+        for shift in shifts:
+            run &= run >> shift
+        if run:
+            return True
+    return False
+
+class Board:
+    __slots__ = ('x_bits', 'o_bits', 'empty_cells')
+
+    def __init__(self):
+        self.x_bits = 0
+        self.o_bits = 0
+        self.empty_cells = BOARD_SIZE * BOARD_SIZE
+
+    def bits_of(self, symbol):
+        return self.x_bits if symbol == SYMBOL_X else self.o_bits
+
+    def get(self, row, col):
+        bit = cell_bit(row, col)
+        if self.x_bits & bit:
+            return SYMBOL_X
+        if self.o_bits & bit:
+            return SYMBOL_O
+        return EMPTY_CELL
+
+    def in_bounds(self, row, col):
+        return 0 <= row < BOARD_SIZE and 0 <= col < BOARD_SIZE
+
+    def is_empty(self, row, col):
+        return not ((self.x_bits | self.o_bits) & cell_bit(row, col))
+
+    def place(self, row, col, symbol):
+        bit = 1 << (row * STRIDE + col)
+        if symbol == SYMBOL_X:
+            self.x_bits |= bit
+        else:
+            self.o_bits |= bit
+        self.empty_cells -= 1
+
+    def has_five(self, symbol):
+        return has_line(self.bits_of(symbol))
+
+    def is_full(self):
+        return self.empty_cells == 0
+
+    def to_rows(self):
+        return [[self.get(r, c) for c in range(BOARD_SIZE)] for r in range(BOARD_SIZE)]
+
+    def has_five_at(self, row, col, symbol):
+        # The whole-board check is already a handful of big-int operations.
+        return has_line(self.bits_of(symbol))
+
+# Free-style boards (--board-size other than BOARD_SIZE, or 0 for an unbounded plane) keep only
+# the stones that were played, so memory grows with the game rather than with the board.
+LINE_DIRECTIONS = ((0, 1), (1, 0), (1, 1), (1, -1))
+COORDINATE_LIMIT = 2 ** 31  # coordinates travel as int32
+
+class SparseBoard:
+    __slots__ = ('size', 'stones')
+
+    def __init__(self, size=0):
+        self.size = size      # rows and columns, or 0 for no edge at all
+        self.stones = {}      # {(row, col): symbol}
+
+    def in_bounds(self, row, col):
+        if type(row) is not int or type(col) is not int:
+            return False  # the stones dict would take 1.0 and True as keys too
+        if self.size:
+            return 0 <= row < self.size and 0 <= col < self.size
+        return -COORDINATE_LIMIT <= row < COORDINATE_LIMIT and -COORDINATE_LIMIT <= col < COORDINATE_LIMIT
+
+    def get(self, row, col):
+        return self.stones.get((row, col), EMPTY_CELL)
+
+    def is_empty(self, row, col):
+        return (row, col) not in self.stones
+
+    def place(self, row, col, symbol):
+        self.stones[(row, col)] = symbol
+
+    def has_five_at(self, row, col, symbol):
+        # Only lines through the new stone can have been completed: walk both ways along each
+        # direction, at most WIN_CONDITION - 1 steps each.
+        stones = self.stones
+        for dr, dc in LINE_DIRECTIONS:
+            count = 1
+            for sign in (1, -1):
+                r, c = row + sign * dr, col + sign * dc
+                while count < WIN_CONDITION and stones.get((r, c)) == symbol:
+                    count += 1
+                    r, c = r + sign * dr, c + sign * dc
+            if count >= WIN_CONDITION:
+                return True
+        return False
+
+    def is_full(self):
+        return bool(self.size) and len(self.stones) == self.size * self.size
+
+    def stones_in(self, top, left, rows, cols):
+        # [(row, col, symbol)] inside the window, by scanning whichever is smaller: the window's
+        # cells or the stones played.
+        stones = self.stones
+        if rows * cols < len(stones):
+            return [(r, c, stones[(r, c)]) for r in range(top, top + rows) for c in range(left, left + cols)
+                    if (r, c) in stones]
+        return [(r, c, symbol) for (r, c), symbol in stones.items()
+                if top <= r < top + rows and left <= c < left + cols]
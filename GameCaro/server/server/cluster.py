@@ -0,0 +1,205 @@
+﻿import json
+import logging
+import multiprocessing
+import multiprocessing.connection
+import os
+import signal
+import socket
+import tempfile
+import threading
+import time
+
+from logs import setup_logging
+from matchmaker import Matchmaker
+
+# Cluster mode (--workers N): a supervisor starts N worker processes that all accept on the same
+# port with SO_REUSEPORT and host their own games, plus one matchmaker process. Workers pair
+# their own players first; anyone left waiting is reported to the matchmaker, which pairs players
+# across workers. The socket of one of the two players is then handed to the other player's
+# worker over a Unix socket with SCM_RIGHTS, so clients never notice they moved. A client that
+# resumes or watches a game hosted by another worker is moved the same way, without a partner.
+#
+# Worker -> matchmaker: hello {worker}, waiting {players: [[id, rating, avoided id], ...]} (the
+# full list, sent every pass), transfer {to, partner, state} with the player's socket attached.
+# Matchmaker -> worker: pair {players: [id, id]} (both already in that worker), hand_off
+# {player, to, partner}, adopt {partner, state} with the socket attached.
+
+LINK_RECV_SIZE = 256 * 1024
+SNAPSHOT_LIMIT = 4096  # players per waiting report, oldest first; keeps a report in one packet
+CONNECT_TIMEOUT = 10.0
+RESTART_DELAY = 1.0
+
+log = logging.getLogger('caro.cluster')
+
+class ClusterLink:
+    # One SOCK_SEQPACKET connection: every message is one packet holding one JSON object, with
+    # any file descriptors attached to that packet.
+    def __init__(self, sock):
+        self.sock = sock
+        self.lock = threading.Lock()
+
+    def send(self, message_type, data, fds=()):
+        packet = json.dumps({'type': message_type, 'data': data}, separators=(',', ':')).encode('utf-8')
+        with self.lock:
+            socket.send_fds(self.sock, [packet], list(fds))
+
+    def receive(self):
+        # Returns (message, fds), or (None, []) once the other side has gone away.
+        try:
+            packet, fds, _, _ = socket.recv_fds(self.sock, LINK_RECV_SIZE, 1)
+        except OSError:
+            return None, []
+        if not packet:
+            return None, fds
+        return json.loads(packet), fds
+
+    def close(self):
+        self.sock.close()
+
+def connect_link(path, worker, timeout=CONNECT_TIMEOUT):
+    # The matchmaker process may still be starting, so keep trying for a while.
+    deadline = time.monotonic() + timeout
+    while True:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        try:
+            sock.connect(path)
+            break
+        except OSError:
+            sock.close()
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.1)
+    link = ClusterLink(sock)
+    link.send('hello', {'worker': worker})
+    return link
+
+class MatchmakerService:
+    # Runs in the matchmaker process. Players are (worker, id) pairs; each waiting report replaces
+    # everything previously reported by that worker.
+    def __init__(self, path, ranked=False):
+        self.path = path
+        self.matchmaker = Matchmaker(lambda first, second: (first, second), ranked=ranked)
+        self.lock = threading.Lock()
+        self.links = {}     # {worker: ClusterLink}
+        self.reported = {}  # {worker: set of players from its last report}
+
+    def serve_forever(self):
+        if os.path.exists(self.path):
+            os.unlink(self.path)  # left behind by a matchmaker that was restarted
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        listener.bind(self.path)
+        listener.listen()
+        log.info("Matchmaker đang lắng nghe trên %s", self.path)
+        while True:
+            sock, _ = listener.accept()
+            threading.Thread(target=self.serve_link, args=(ClusterLink(sock),), daemon=True).start()
+
+    def serve_link(self, link):
+        worker = None
+        while True:
+            message, fds = link.receive()
+            if message is None:
+                break
+            data = message['data']
+            if message['type'] == 'hello':
+                worker = data['worker']
+                with self.lock:
+                    self.links[worker] = link
+                log.info("Worker %s đã kết nối.", worker)
+            elif message['type'] == 'waiting':
+                self.update_waiting(worker, data['players'])
+                self.dispatch(self.matchmaker.run_pass())
+            elif message['type'] == 'transfer':
+                self.forward(data, fds)
+        log.warning("Worker %s đã ngắt kết nối.", worker)
+        with self.lock:
+            if self.links.get(worker) is link:
+                del self.links[worker]
+        self.update_waiting(worker, [])
+        link.close()
+
+    def update_waiting(self, worker, players):
+        listed = {(worker, player_id): (rating, avoid) for player_id, rating, avoid in players}
+        with self.lock:
+            previous = self.reported.get(worker, set())
+            self.reported[worker] = set(listed)
+        for player in previous - listed.keys():
+            self.matchmaker.cancel(player)
+        for player, (rating, avoid) in listed.items():
+            self.matchmaker.enqueue(player, rating, avoid=(worker, avoid) if avoid else None)
+
+    def dispatch(self, pairs):
+        for (worker1, id1), (worker2, id2) in pairs:
+            if worker1 == worker2:
+                self.send_to(worker1, 'pair', {'players': [id1, id2]})
+            else:
+                # The newer of the two moves to the worker of the one who has waited longer.
+                self.send_to(worker2, 'hand_off', {'player': id2, 'to': worker1, 'partner': id1})
+
+    def forward(self, data, fds):
+        try:
+            self.send_to(data['to'], 'adopt', {'partner': data['partner'], 'state': data['state']}, fds)
+        finally:
+            for fd in fds:
+                os.close(fd)
+
+    def send_to(self, worker, message_type, data, fds=()):
+        with self.lock:
+            link = self.links.get(worker)
+        if link is None:
+            log.warning("Không có worker %s để gửi %s.", worker, message_type)
+            return
+        try:
+            link.send(message_type, data, fds)
+        except OSError as e:
+            log.warning("Lỗi gửi %s tới worker %s: %s", message_type, worker, e)
+
+def run_matchmaker(path, ranked, log_level, log_rate):
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    setup_logging(log_level, log_rate)
+    try:
+        MatchmakerService(path, ranked).serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+def run_supervisor(args, worker_main):
+    # Starts the matchmaker and args.workers copies of worker_main(args, index, link_path), and
+    # restarts any of them that exits until the supervisor itself is stopped.
+    setup_logging(args.log_level, args.log_rate)
+    link_path = os.path.join(tempfile.mkdtemp(prefix='caro-'), 'matchmaker.sock')
+    context = multiprocessing.get_context('spawn')
+    targets = {'matchmaker': (run_matchmaker, (link_path, args.ranked, args.log_level, args.log_rate))}
+    for index in range(args.workers):
+        targets[f"worker-{index}"] = (worker_main, (args, index, link_path))
+    processes = {}
+
+    def start(name):
+        target, target_args = targets[name]
+        process = context.Process(target=target, args=target_args, name=name)
+        process.start()
+        processes[name] = process
+        log.info("Đã khởi động %s (pid %s).", name, process.pid)
+
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    try:
+        for name in targets:
+            start(name)
+        while True:
+            sentinels = {process.sentinel: name for name, process in processes.items()}
+            for sentinel in multiprocessing.connection.wait(list(sentinels)):
+                name = sentinels[sentinel]
+                log.warning("%s đã dừng (mã %s), khởi động lại.", name, processes[name].exitcode)
+                time.sleep(RESTART_DELAY)
+                start(name)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for process in processes.values():
+            process.terminate()
+        for process in processes.values():
+            process.join()
+        try:
+            os.unlink(link_path)
+            os.rmdir(os.path.dirname(link_path))
+        except OSError:
+            pass
@@ -0,0 +1,248 @@
+﻿import asyncio
+import collections
+import logging
+import os
+import socket
+import threading
+import time
+
+from protocol import FrameDecoder
+
+OVERFLOW_POLICIES = ('drop_chat', 'coalesce', 'disconnect')
+# Chat can be lost without breaking a game; a newer board snapshot makes an older one useless.
+DROPPABLE_TYPES = {'chat'}
+COALESCIBLE_TYPES = {'update_board', 'board_sync'}
+
+log = logging.getLogger('caro.connection')
+
+class SendStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.queue_depth = 0
+        self.max_queue_depth = 0
+        self.blocked_seconds = 0.0
+        self.dropped = 0
+        self.coalesced = 0
+        self.overflow_disconnects = 0
+        self.bytes_sent = 0
+
+    def queued(self, count):
+        with self.lock:
+            self.queue_depth += count
+            if self.queue_depth > self.max_queue_depth:
+                self.max_queue_depth = self.queue_depth
+
+    def sent(self, count, blocked_seconds, sent_bytes=0):
+        with self.lock:
+            self.queue_depth -= count
+            self.blocked_seconds += blocked_seconds
+            self.bytes_sent += sent_bytes
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'queue_depth': self.queue_depth,
+                'max_queue_depth': self.max_queue_depth,
+                'send_blocked_seconds': self.blocked_seconds,
+                'dropped': self.dropped,
+                'coalesced': self.coalesced,
+                'overflow_disconnects': self.overflow_disconnects,
+                'bytes_sent': self.bytes_sent,
+            }
+
+send_stats = SendStats()
+
+class ClientConnection:
+    queue_limit = 256
+    overflow_policy = 'coalesce'
+
+    def __init__(self, peername):
+        self.peername = peername
+        self.outbound = collections.deque()  # [message_type, payload]
+        self.max_queue_depth = 0
+        self.send_blocked_seconds = 0.0
+        self.closed = False
+        self.handoff = None  # (worker, partner id, message to handle there) while the connection moves
+        self.last_seen = time.monotonic()  # updated by the read loop on every chunk received
+        self.heartbeat_timer = None
+        # Inbound side: the handshake may switch it to binary frames.
+        self.decoder = FrameDecoder(on_invalid=self.invalid_frame)
+
+    def getpeername(self):
+        return self.peername
+
+    def invalid_frame(self, frame, error):
+        log.warning("Lỗi JSON không hợp lệ từ %s: %s", self.peername, error)
+
+    def queue_message(self, message_type, payload):
+        # Caller guards self.outbound. Returns False when the overflow policy says to disconnect.
+        if len(self.outbound) < self.queue_limit:
+            self.outbound.append([message_type, payload])
+            self.max_queue_depth = max(self.max_queue_depth, len(self.outbound))
+            send_stats.queued(1)
+            return True
+        if self.overflow_policy != 'disconnect':
+            if message_type in DROPPABLE_TYPES:
+                with send_stats.lock:
+                    send_stats.dropped += 1
+                return True
+            if self.overflow_policy == 'coalesce' and message_type in COALESCIBLE_TYPES:
+                for entry in reversed(self.outbound):
+                    if entry[0] == message_type:
+                        entry[1] = payload
+                        with send_stats.lock:
+                            send_stats.coalesced += 1
+                        return True
+        with send_stats.lock:
+            send_stats.overflow_disconnects += 1
+        return False
+
+    def take_batch(self):
+        batch = b''.join(payload for _, payload in self.outbound)
+        count = len(self.outbound)
+        self.outbound.clear()
+        return batch, count
+
+    def abort(self):
+        self.close()
+
+    def overflowed(self):
+        log.warning("Hàng đợi gửi tới %s bị đầy (%d tin). Ngắt kết nối.", self.peername, self.queue_limit)
+        self.close()
+
+class SocketClient(ClientConnection):
+    # Threaded mode: a writer thread per connection drains the queue, so sendall on a full
+    # TCP window only ever blocks that connection's writer.
+    def __init__(self, sock, address):
+        super().__init__(address)
+        self.sock = sock
+        self.condition = threading.Condition()
+        self.writer_thread = threading.Thread(target=self.write_loop, daemon=True)
+        self.writer_thread.start()
+
+    def send(self, message_type, payload):
+        with self.condition:
+            if self.closed:
+                return
+            accepted = self.queue_message(message_type, payload)
+            if accepted:
+                self.condition.notify()
+        if not accepted:
+            self.overflowed()
+
+    def write_loop(self):
+        while True:
+            with self.condition:
+                while not self.outbound and not self.closed:
+                    self.condition.wait()
+                if self.closed:
+                    return
+                batch, count = self.take_batch()
+            started = time.perf_counter()
+            try:
+                self.sock.sendall(batch)
+            except OSError as e:
+                log.warning("Lỗi gửi dữ liệu tới client %s: %s", self.peername, e)
+                send_stats.sent(count, 0.0)
+                self.close()
+                return
+            blocked = time.perf_counter() - started
+            self.send_blocked_seconds += blocked
+            send_stats.sent(count, blocked, len(batch))
+
+    def recv(self, size):
+        return self.sock.recv(size)
+
+    def close(self):
+        with self.condition:
+            already_closed = self.closed
+            self.closed = True
+            pending = len(self.outbound)
+            self.outbound.clear()
+            self.condition.notify()
+        if already_closed:
+            return
+        send_stats.sent(pending, 0.0)
+        # shutdown wakes the reader thread blocked in recv; it then runs handle_disconnect.
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+
+class StreamClient(ClientConnection):
+    # asyncio mode: a writer task per connection. send() must be called on the event loop.
+    def __init__(self, writer, reader=None):
+        super().__init__(writer.get_extra_info('peername'))
+        self.writer = writer
+        self.reader = reader
+        self.wakeup = asyncio.Event()
+        self.writer_task = asyncio.get_running_loop().create_task(self.write_loop())
+
+    def send(self, message_type, payload):
+        if self.closed:
+            return
+        if self.queue_message(message_type, payload):
+            self.wakeup.set()
+        else:
+            self.overflowed()
+
+    async def write_loop(self):
+        try:
+            while not self.closed:
+                await self.wakeup.wait()
+                self.wakeup.clear()
+                while self.outbound and not self.closed:
+                    batch, count = self.take_batch()
+                    started = time.perf_counter()
+                    try:
+                        self.writer.write(batch)
+                        await self.writer.drain()
+                    finally:
+                        blocked = time.perf_counter() - started
+                        self.send_blocked_seconds += blocked
+                        send_stats.sent(count, blocked, len(batch))
+        except (ConnectionError, OSError) as e:
+            log.warning("Lỗi gửi dữ liệu tới client %s: %s", self.peername, e)
+            self.close()
+
+    def stop_reading(self):
+        # Leaves whatever the client sends next in the kernel buffer; the read loop sees EOF
+        # once it has consumed what was already read.
+        self.writer.transport.pause_reading()
+        self.reader.feed_eof()
+
+    async def detach(self):
+        # Flushes what is still queued, closes this end and returns a duplicate of the socket's
+        # descriptor. The duplicate keeps the TCP connection open, so the client sees no close.
+        self.closed = True
+        self.wakeup.set()
+        await self.writer_task
+        if self.outbound:
+            batch, count = self.take_batch()
+            self.writer.write(batch)
+            send_stats.sent(count, 0.0, len(batch))
+        self.writer.transport.set_write_buffer_limits(0)
+        await self.writer.drain()
+        fd = os.dup(self.writer.get_extra_info('socket').fileno())
+        self.writer.close()
+        return fd
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        send_stats.sent(len(self.outbound), 0.0)
+        self.outbound.clear()
+        self.wakeup.set()
+        # Closing the transport feeds EOF to the reader, which then runs handle_disconnect.
+        self.writer.close()
+
+    def abort(self):
+        # close() waits for buffered data to reach the peer, which never happens if it is gone.
+        self.close()
+        self.writer.transport.abort()
+
+def configure_send_queues(queue_limit, overflow_policy):
+    ClientConnection.queue_limit = queue_limit
+    ClientConnection.overflow_policy = overflow_policy
@@ -0,0 +1,340 @@
+﻿import argparse
+import collections
+import glob
+import itertools
+import json
+import logging
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+import zlib
+
+from board import Board, BOARD_SIZE, SparseBoard, SYMBOL_X, SYMBOL_O
+
+log = logging.getLogger('caro.gamelog')
+
+# Append-only record of every finished round. Each server process writes its own segment files,
+# games-<worker>-<number>.log, and starts a new segment whenever it starts or the current one
+# grows past SEGMENT_SIZE, so an existing segment is never written to again.
+#
+# Segment: MAGIC, then records. Record: uint32 body length, uint32 CRC-32 of the body, body.
+# Body: GAME, the X and O player names (UTF-8), then one MOVE per move. X always moves first.
+# Records written by the server end with SESSION, the game id its log lines and spectators see
+# (one per pairing, so shared by rematches); records without it stop after the moves.
+# A crash can leave a partial record at the end of the last segment; readers stop there.
+# Servers on free-style boards write MAGIC_WIDE segments, whose moves hold int32 coordinates;
+# board size 0 there means an unbounded board.
+
+MAGIC = b'CAROLOG1'
+MAGIC_WIDE = b'CAROLOG2'
+RECORD_HEADER = struct.Struct('>II')
+GAME = struct.Struct('>QddBBHBB')  # game id, started, ended (epoch seconds), board size, result, moves, name lengths
+MOVE = struct.Struct('>BBI')       # row, col, milliseconds since the round started
+MOVE_WIDE = struct.Struct('>iiI')
+SESSION = struct.Struct('>Q')
+RESULTS = ('x_won', 'o_won', 'draw', 'abandoned')
+RESULT_X_WON, RESULT_O_WON, RESULT_DRAW, RESULT_ABANDONED = range(len(RESULTS))
+MAX_NAME_BYTES = 255
+MAX_MOVES = 0xFFFF  # GAME holds the move count in 16 bits; longer free-style games keep their first moves
+
+SEGMENT_SIZE = 64 * 1024 * 1024
+FLUSH_INTERVAL = 0.2  # seconds between batched writes (each followed by an fsync)
+MAX_PENDING = 100000  # rounds kept for retry while writes fail; older ones are dropped beyond this
+
+def encode_record(game_id, started, ended, board_size, result, x_name, o_name, moves, session_id=None, move_struct=MOVE):
+    x_bytes = x_name.encode('utf-8')[:MAX_NAME_BYTES]
+    o_bytes = o_name.encode('utf-8')[:MAX_NAME_BYTES]
+    moves = moves[:MAX_MOVES]
+    parts = [GAME.pack(game_id, started, ended, board_size, result, len(moves), len(x_bytes), len(o_bytes)),
+             x_bytes, o_bytes] + [move_struct.pack(*move) for move in moves]
+    if session_id is not None:
+        parts.append(SESSION.pack(session_id))
+    body = b''.join(parts)
+    return RECORD_HEADER.pack(len(body), zlib.crc32(body)) + body
+
+def segment_paths(directory, worker='*'):
+    pattern = f"games-{worker:02d}-*.log" if isinstance(worker, int) else f"games-{worker}-*.log"
+    return sorted(glob.glob(os.path.join(directory, pattern)))
+
+class GameLogWriter:
+    # append() only queues the round; a writer thread encodes the batch, writes it with one
+    # write() and fsyncs before the next batch, so the network loop never waits for the disk.
+    # A batch that fails to write (disk full, I/O error) is kept and retried in a new segment.
+    def __init__(self, directory, worker=0, flush_interval=FLUSH_INTERVAL, segment_size=SEGMENT_SIZE, wide=False):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.worker = worker
+        self.magic, self.move_struct = (MAGIC_WIDE, MOVE_WIDE) if wide else (MAGIC, MOVE)
+        self.flush_interval = flush_interval
+        self.segment_size = segment_size
+        existing = segment_paths(directory, worker)
+        self.segment_number = int(existing[-1].rsplit('-', 1)[1].split('.')[0]) if existing else 0
+        self.file = None
+        self.open_segment()
+        self.ids = itertools.count()
+        self.condition = threading.Condition()
+        self.pending = []
+        self.closed = False
+        self.records_written = 0
+        self.bytes_written = 0
+        self.batches = 0
+        self.errors = 0
+        self.dropped = 0
+        self.thread = threading.Thread(target=self.write_loop, daemon=True)
+        self.thread.start()
+
+    def open_segment(self):
+        self.close_segment()
+        self.segment_number += 1
+        path = os.path.join(self.directory, f"games-{self.worker:02d}-{self.segment_number:06d}.log")
+        self.file = open(path, 'xb')
+        self.file.write(self.magic)
+        self.segment_bytes = len(self.magic)
+
+    def close_segment(self):
+        file, self.file = self.file, None
+        if file:
+            try:
+                file.close()
+            except OSError:
+                pass  # already reported by the write that failed
+
+    def next_game_id(self):
+        # Milliseconds, worker and a per-process counter: unique across workers and restarts, and
+        # sorted by start time.
+        return (int(time.time() * 1000) << 20) | ((self.worker & 0xFF) << 12) | (next(self.ids) & 0xFFF)
+
+    def append(self, game_id, started, ended, board_size, result, x_name, o_name, moves, session_id=None):
+        with self.condition:
+            self.pending.append((game_id, started, ended, board_size, result, x_name, o_name, moves, session_id))
+            self.trim_pending()
+
+    def trim_pending(self):
+        # Called with the condition held. Bounds the queue while writes keep failing.
+        excess = len(self.pending) - MAX_PENDING
+        if excess > 0:
+            del self.pending[:excess]
+            self.dropped += excess
+            log.error("Bỏ %d ván cũ nhất chưa ghi được vào nhật ký.", excess)
+
+    def pending_count(self):
+        return len(self.pending)
+
+    def write_loop(self):
+        while True:
+            with self.condition:
+                if not self.closed:
+                    self.condition.wait(self.flush_interval)
+                batch, self.pending = self.pending, []
+                closed = self.closed
+            if batch:
+                self.write_batch(batch)
+            if closed:
+                if self.pending:
+                    log.error("Mất %d ván chưa ghi được vào %s khi đóng nhật ký.", len(self.pending), self.directory)
+                self.close_segment()
+                return
+
+    def write_batch(self, batch):
+        games, records = [], []
+        for game in batch:
+            try:
+                records.append(encode_record(*game, move_struct=self.move_struct))
+            except Exception as e:
+                # A round that cannot be encoded never will be; keep it from stopping the log.
+                log.error("Bỏ ván %s (Game ID %s) khỏi nhật ký, không mã hóa được: %s", game[0], game[8], e)
+                self.dropped += 1
+                continue
+            games.append(game)
+        if not records:
+            return
+        data = b''.join(records)
+        try:
+            if self.file is None:
+                self.open_segment()
+            self.file.write(data)
+            self.file.flush()
+            os.fsync(self.file.fileno())
+        except OSError as e:
+            # The segment may now end in a partial record, where readers stop, so the retry goes to
+            # a new segment.
+            log.error("Không ghi được %d ván vào %s: %s", len(games), self.directory, e)
+            self.errors += 1
+            self.close_segment()
+            with self.condition:
+                self.pending[:0] = games
+                self.trim_pending()
+            return
+        self.records_written += len(games)
+        self.bytes_written += len(data)
+        self.batches += 1
+        self.segment_bytes += len(data)
+        if self.segment_bytes >= self.segment_size:
+            self.close_segment()  # the next batch opens a new one
+
+    def close(self):
+        # Writes out whatever is still queued (once; a failed last batch is only logged).
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+        self.thread.join()
+
+class GameRecord:
+    __slots__ = ('game_id', 'started', 'ended', 'board_size', 'result', 'x_name', 'o_name', 'moves', 'session_id')
+
+    def __init__(self, game_id, started, ended, board_size, result, x_name, o_name, moves, session_id=None):
+        self.game_id = game_id
+        self.started = started
+        self.ended = ended
+        self.board_size = board_size
+        self.result = result
+        self.x_name = x_name
+        self.o_name = o_name
+        self.moves = moves  # [(row, col, ms since start)]
+        self.session_id = session_id  # the server's game id, None in records written without it
+
+    def replay(self):
+        # Yields (row, col, symbol, board) after each move; the same Board object is reused.
+        board = Board() if self.board_size == BOARD_SIZE else SparseBoard(self.board_size)
+        for i, (row, col, _) in enumerate(self.moves):
+            symbol = SYMBOL_X if i % 2 == 0 else SYMBOL_O
+            board.place(row, col, symbol)
+            yield row, col, symbol, board
+
+    def to_dict(self):
+        return {'game_id': self.game_id, 'session_id': self.session_id, 'started': self.started, 'ended': self.ended, 'board_size': self.board_size,
+                'result': RESULTS[self.result], 'x': self.x_name, 'o': self.o_name,
+                'moves': [[row, col, ms] for row, col, ms in self.moves]}
+
+class GameLogReader:
+    # Maps every segment in `directory` and indexes it by game id and by player name. Records are
+    # only decoded when asked for. `torn` lists (segment, offset) pairs where a segment ends in a
+    # partial or corrupt record, which is what a crash mid-write leaves behind.
+    def __init__(self, directory, verify=True):
+        self.verify = verify
+        self.segments = []
+        self.by_id = {}                              # {game_id: (segment index, body offset)}
+        self.by_player = collections.defaultdict(list)  # {name: [game_id, ...]}, oldest first
+        self.torn = []
+        for path in segment_paths(directory):
+            self.load(path)
+
+    def load(self, path):
+        with open(path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            if size <= len(MAGIC):
+                return
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if data[:len(MAGIC)] not in (MAGIC, MAGIC_WIDE):
+            self.torn.append((path, 0))
+            data.close()
+            return
+        index = len(self.segments)
+        self.segments.append((path, data, MOVE_WIDE if data[:len(MAGIC)] == MAGIC_WIDE else MOVE))
+        view = memoryview(data)
+        by_id, by_player = self.by_id, self.by_player
+        offset = len(MAGIC)
+        while offset < size:
+            if offset + RECORD_HEADER.size > size:
+                self.torn.append((path, offset))
+                break
+            length, crc = RECORD_HEADER.unpack_from(data, offset)
+            start = offset + RECORD_HEADER.size
+            end = start + length
+            if length < GAME.size or end > size or (self.verify and zlib.crc32(view[start:end]) != crc):
+                self.torn.append((path, offset))
+                break
+            game_id, _, _, _, _, _, x_length, o_length = GAME.unpack_from(data, start)
+            offset = end
+            if game_id in by_id:
+                continue  # written again after a failed fsync
+            names_at = start + GAME.size
+            by_id[game_id] = (index, start)
+            by_player[str(view[names_at:names_at + x_length], 'utf-8', 'replace')].append(game_id)
+            by_player[str(view[names_at + x_length:names_at + x_length + o_length], 'utf-8', 'replace')].append(game_id)
+        view.release()
+
+    def __len__(self):
+        return len(self.by_id)
+
+    def game_ids(self):
+        return self.by_id.keys()
+
+    def get(self, game_id):
+        index, start = self.by_id[game_id]
+        _, data, move_struct = self.segments[index]
+        game_id, started, ended, board_size, result, move_count, x_length, o_length = GAME.unpack_from(data, start)
+        names_at = start + GAME.size
+        moves_at = names_at + x_length + o_length
+        moves_end = moves_at + move_count * move_struct.size
+        length, _ = RECORD_HEADER.unpack_from(data, start - RECORD_HEADER.size)
+        session_id = SESSION.unpack_from(data, moves_end)[0] if start + length >= moves_end + SESSION.size else None
+        return GameRecord(game_id, started, ended, board_size, result,
+                          data[names_at:names_at + x_length].decode('utf-8', 'replace'),
+                          data[names_at + x_length:moves_at].decode('utf-8', 'replace'),
+                          list(move_struct.iter_unpack(data[moves_at:moves_end])), session_id)
+
+    def games_of(self, player):
+        return [self.get(game_id) for game_id in self.by_player.get(player, ())]
+
+    def __iter__(self):
+        # In file order, which is end-of-round order within each segment.
+        for game_id in self.by_id:
+            yield self.get(game_id)
+
+    def close(self):
+        for _, data, _ in self.segments:
+            data.close()
+        self.segments = []
+
+def print_game(record):
+    session = f" (Game ID {record.session_id} trên server)" if record.session_id is not None else ""
+    print(f"Game {record.game_id}{session}: {record.x_name} (X) vs {record.o_name} (O), {RESULTS[record.result]}, "
+          f"{len(record.moves)} nước, {record.ended - record.started:.1f}s, bắt đầu "
+          f"{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(record.started))}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Đọc nhật ký ván đấu của Caro server")
+    parser.add_argument('directory')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('verify', help="kiểm tra checksum và báo các bản ghi dở dang")
+    show = subparsers.add_parser('show', help="in một ván và các nước đi")
+    show.add_argument('game_id', type=int)
+    player = subparsers.add_parser('player', help="liệt kê các ván của một người chơi")
+    player.add_argument('name')
+    export = subparsers.add_parser('export', help="xuất mọi ván ra JSON lines")
+    export.add_argument('output', help="đường dẫn file, '-' cho stdout")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    reader = GameLogReader(args.directory)
+    loaded = time.perf_counter() - started
+    if args.command == 'verify':
+        results = collections.Counter(RESULTS[reader.get(game_id).result] for game_id in reader.game_ids())
+        print(f"{len(reader.segments)} segment, {len(reader)} ván, {len(reader.by_player)} người chơi "
+              f"(đánh chỉ mục trong {loaded:.2f}s)")
+        print(', '.join(f"{name}: {results[name]}" for name in RESULTS))
+        for path, offset in reader.torn:
+            print(f"Bản ghi dở dang hoặc hỏng: {path} tại byte {offset}")
+        sys.exit(1 if reader.torn else 0)
+    elif args.command == 'show':
+        record = reader.get(args.game_id)
+        print_game(record)
+        for i, (row, col, symbol, _) in enumerate(record.replay()):
+            print(f"{i + 1:>4}. {symbol} ({row}, {col}) +{record.moves[i][2] / 1000:.1f}s")
+    elif args.command == 'player':
+        for record in reader.games_of(args.name):
+            print_game(record)
+    elif args.command == 'export':
+        output = sys.stdout if args.output == '-' else open(args.output, 'w', encoding='utf-8')
+        for record in reader:
+            output.write(json.dumps(record.to_dict(), ensure_ascii=False) + '\n')
+        if output is not sys.stdout:
+            output.close()
+    reader.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,286 @@
+﻿import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'shared'))
+
+from board import BOARD_SIZE, EMPTY_CELL
+from protocol import FrameDecoder, RECV_SIZE, encode_binary, encode_message
+
+SERVER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'server.py')
+
+# Centre-outwards cell order used by the 'scripted' strategy.
+SCRIPTED_ORDER = sorted(((r, c) for r in range(BOARD_SIZE) for c in range(BOARD_SIZE)),
+                        key=lambda cell: (max(abs(cell[0] - BOARD_SIZE // 2), abs(cell[1] - BOARD_SIZE // 2)), cell))
+
+class LoadStats:
+    def __init__(self):
+        self.connected = 0
+        self.connect_failures = 0
+        self.game_overs = 0
+        self.moves = 0
+        self.chats = 0
+        self.rematches = 0
+        self.errors = 0
+        self.move_latencies = []
+
+class SimulatedPlayer:
+    def __init__(self, index, args, stats):
+        self.index = index
+        self.args = args
+        self.stats = stats
+        self.rng = random.Random(args.seed * 1000003 + index) if args.seed is not None else random.Random()
+        self.username = f"bot{index}"
+        self.writer = None
+        self.decoder = FrameDecoder(negotiating='binary' in args.features)
+        self.binary = False
+        self.board = None
+        self.symbol = None
+        self.pending_move = None
+
+    def send(self, message_type, data):
+        encode = encode_binary if self.binary else encode_message
+        self.writer.write(encode(message_type, data))
+
+    def login(self):
+        self.send('username_set', {'username': self.username, 'features': self.args.features})
+
+    def choose_move(self):
+        if self.args.strategy == 'scripted':
+            for row, col in SCRIPTED_ORDER:
+                if self.board[row][col] == EMPTY_CELL:
+                    return row, col
+            return None
+        empty = [(r, c) for r in range(BOARD_SIZE) for c in range(BOARD_SIZE) if self.board[r][c] == EMPTY_CELL]
+        return self.rng.choice(empty) if empty else None
+
+    def play(self):
+        move = self.choose_move()
+        if move is None:
+            return
+        row, col = move
+        self.pending_move = (row, col, time.perf_counter())
+        self.send('move', {'row': row, 'col': col})
+        if self.rng.random() < self.args.chat_rate:
+            self.send('chat', {'message': f"nước {row},{col}", 'sender': self.username})
+            self.stats.chats += 1
+
+    def confirm_move(self, row, col):
+        if self.pending_move and self.pending_move[:2] == (row, col):
+            self.stats.move_latencies.append(time.perf_counter() - self.pending_move[2])
+            self.stats.moves += 1
+            self.pending_move = None
+
+    def handle(self, message):
+        msg_type = message.get('type')
+        data = message.get('data') or {}
+        if msg_type == 'protocol':
+            if 'binary' in data['features']:
+                self.send('protocol', data)
+                self.binary = True
+        elif msg_type == 'game_start':
+            self.board = data['board']
+            self.symbol = data['symbol']
+            self.pending_move = None
+            if data['is_turn']:
+                self.play()
+        elif msg_type == 'your_turn':
+            self.play()
+        elif msg_type == 'move_made':
+            self.board[data['row']][data['col']] = data['symbol']
+            self.confirm_move(data['row'], data['col'])
+        elif msg_type == 'update_board':
+            self.board = data['board']
+            last_move = data.get('last_move') or {}
+            self.confirm_move(last_move.get('row'), last_move.get('col'))
+        elif msg_type == 'game_over':
+            self.stats.game_overs += 1
+            if self.rng.random() < self.args.rematch_rate:
+                self.stats.rematches += 1
+                self.send('rematch_request', {})
+            else:
+                self.send('rematch_declined', {})
+        elif msg_type == 'ping':
+            self.send('pong', {})
+        elif msg_type == 'error':
+            self.stats.errors += 1
+
+    async def run(self, host, port, deadline):
+        try:
+            reader, self.writer = await asyncio.open_connection(host, port)
+        except OSError:
+            self.stats.connect_failures += 1
+            return
+        self.stats.connected += 1
+        try:
+            self.login()
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    data = await asyncio.wait_for(reader.read(RECV_SIZE), remaining)
+                except asyncio.TimeoutError:
+                    break
+                if not data:
+                    break
+                for message in self.decoder.feed(data):
+                    self.handle(message)
+                await self.writer.drain()
+        except (OSError, ValueError):
+            pass
+        finally:
+            self.writer.close()
+
+def read_process_status(pid):
+    status = {}
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                key, _, value = line.partition(':')
+                status[key] = value.strip()
+    except OSError:
+        return None
+    return status
+
+def process_tree(pid):
+    # The server and, in cluster mode, its matchmaker and worker processes.
+    pids = [pid]
+    for parent in pids:
+        try:
+            with open(f"/proc/{parent}/task/{parent}/children") as f:
+                pids.extend(int(child) for child in f.read().split())
+        except OSError:
+            pass
+    return pids
+
+async def sample_server(pid, peaks, stop):
+    while not stop.is_set():
+        rss_kb = threads = 0
+        for tree_pid in process_tree(pid):
+            status = read_process_status(tree_pid)
+            if status:
+                rss_kb += int(status.get('VmRSS', '0 kB').split()[0])
+                threads += int(status.get('Threads', '0'))
+        if rss_kb:
+            peaks['rss_kb'] = max(peaks.get('rss_kb', 0), rss_kb)
+            peaks['threads'] = max(peaks.get('threads', 0), threads)
+        try:
+            await asyncio.wait_for(stop.wait(), 0.2)
+        except asyncio.TimeoutError:
+            pass
+
+def wait_for_port(host, port, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection((host, port), timeout=0.5).close()
+            return True
+        except OSError:
+            time.sleep(0.1)
+    return False
+
+def percentile(samples, fraction):
+    if not samples:
+        return float('nan')
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+async def run_load(args, server_pid):
+    stats = LoadStats()
+    peaks = {}
+    stop = asyncio.Event()
+    sampler = asyncio.create_task(sample_server(server_pid, peaks, stop)) if server_pid else None
+    started = time.monotonic()
+    deadline = started + args.duration
+    players = [SimulatedPlayer(i, args, stats) for i in range(args.clients)]
+    tasks = []
+    for i, player in enumerate(players):
+        tasks.append(asyncio.create_task(player.run(args.host, args.port, deadline)))
+        # Ramp up so the accept backlog is not flooded.
+        if args.ramp and i % args.ramp == args.ramp - 1:
+            await asyncio.sleep(1)
+    await asyncio.gather(*tasks)
+    elapsed = time.monotonic() - started
+    stop.set()
+    if sampler:
+        await sampler
+    return stats, peaks, elapsed
+
+def report(args, stats, peaks, elapsed):
+    latencies_ms = [latency * 1000 for latency in stats.move_latencies]
+    result = {
+        'mode': args.mode if args.spawn else 'external',
+        'server_workers': args.server_workers if args.spawn else None,
+        'clients': args.clients,
+        'connected': stats.connected,
+        'connect_failures': stats.connect_failures,
+        'seconds': round(elapsed, 2),
+        'matches_per_sec': round(stats.game_overs / 2 / elapsed, 2),
+        'moves_per_sec': round(stats.moves / elapsed, 2),
+        'move_rtt_ms_p50': round(percentile(latencies_ms, 0.50), 3),
+        'move_rtt_ms_p95': round(percentile(latencies_ms, 0.95), 3),
+        'move_rtt_ms_p99': round(percentile(latencies_ms, 0.99), 3),
+        'chats': stats.chats,
+        'rematch_requests': stats.rematches,
+        'errors': stats.errors,
+        'server_peak_rss_mb': round(peaks['rss_kb'] / 1024, 1) if 'rss_kb' in peaks else None,
+        'server_peak_threads': peaks.get('threads'),
+    }
+    if args.json:
+        print(json.dumps(result))
+    else:
+        for key, value in result.items():
+            print(f"{key:>20}: {value}")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Sinh tải cho Caro server bằng các client giả lập")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=12345)
+    parser.add_argument('--clients', type=int, default=100)
+    parser.add_argument('--duration', type=float, default=10.0, help="số giây chạy tải")
+    parser.add_argument('--ramp', type=int, default=500, help="số kết nối mở mỗi giây (0 = mở hết ngay)")
+    parser.add_argument('--strategy', choices=['random', 'scripted'], default='random')
+    parser.add_argument('--features', nargs='*', default=['delta'], help="tính năng giao thức gửi trong username_set")
+    parser.add_argument('--chat-rate', type=float, default=0.1, help="xác suất gửi chat sau mỗi nước đi")
+    parser.add_argument('--rematch-rate', type=float, default=0.5, help="xác suất xin đấu lại sau mỗi ván")
+    parser.add_argument('--seed', type=int, help="chạy tất định: seed cho client và cho server được khởi động")
+    parser.add_argument('--spawn', action='store_true', help="tự khởi động server.py cục bộ")
+    parser.add_argument('--mode', choices=['asyncio', 'threaded'], default='asyncio', help="chế độ server khi --spawn")
+    parser.add_argument('--server-workers', type=int, default=1, help="số worker của server khi --spawn (--workers)")
+    parser.add_argument('--server-pid', type=int, help="pid của server đang chạy để đo RSS/thread")
+    parser.add_argument('--json', action='store_true', help="in kết quả dạng JSON")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    server_process = None
+    server_pid = args.server_pid
+    if args.spawn:
+        # No bot: a player left over by an odd client count would otherwise skew the numbers.
+        command = [sys.executable, SERVER_SCRIPT, '--mode', args.mode, '--host', args.host, '--port', str(args.port), '--no-bot']
+        if args.seed is not None:
+            command += ['--seed', str(args.seed)]
+        if args.server_workers > 1:
+            command += ['--workers', str(args.server_workers), '--metrics-port', '0']
+        server_process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        server_pid = server_process.pid
+        if not wait_for_port(args.host, args.port, 10):
+            server_process.kill()
+            sys.exit("Server không khởi động được.")
+    try:
+        stats, peaks, elapsed = asyncio.run(run_load(args, server_pid))
+    finally:
+        if server_process:
+            server_process.terminate()
+            server_process.wait()
+    report(args, stats, peaks, elapsed)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+﻿import atexit
+import logging
+import logging.handlers
+import queue
+import sys
+import threading
+import time
+
+# Logging for the server. Records are put on a queue by the network threads and written to stdout
+# by a listener thread, so a slow terminal never holds up a send or a receive loop.
+
+LOG_FORMAT = '%(asctime)s %(levelname)s %(name)s: %(message)s'
+
+class RateLimitFilter(logging.Filter):
+    # Lets at most `per_second` records of the same kind (logger and format string) through each
+    # second. The number of records dropped is added to the next record of that kind let through.
+    def __init__(self, per_second):
+        super().__init__()
+        self.per_second = per_second
+        self.lock = threading.Lock()
+        self.windows = {}  # (logger, format) -> [window start, count, suppressed]
+
+    def filter(self, record):
+        if self.per_second <= 0:
+            return True
+        key = (record.name, record.msg)
+        now = time.monotonic()
+        with self.lock:
+            window = self.windows.get(key)
+            if window is None or now - window[0] >= 1.0:
+                suppressed = window[2] if window else 0
+                self.windows[key] = [now, 1, 0]
+            elif window[1] < self.per_second:
+                window[1] += 1
+                suppressed, window[2] = window[2], 0
+            else:
+                window[2] += 1
+                return False
+        if suppressed:
+            record.msg = f"{record.msg} [bỏ qua {suppressed} dòng tương tự]"
+        return True
+
+def setup_logging(level='INFO', per_second=20):
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    log_queue = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(log_queue, handler)
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    # Filtered on the calling thread so suppressed records never reach the queue.
+    queue_handler.addFilter(RateLimitFilter(per_second))
+    root = logging.getLogger()
+    root.handlers[:] = [queue_handler]
+    root.setLevel(level)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
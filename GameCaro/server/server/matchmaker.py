@@ -0,0 +1,158 @@
+﻿import collections
+import math
+import threading
+import time
+
+from rating import DEFAULT_RATING
+
+class QueueEntry:
+    __slots__ = ('player', 'rating', 'bucket', 'enqueued_at', 'avoid', 'avoid_until')
+
+    def __init__(self, player, rating, bucket, enqueued_at, avoid, avoid_until):
+        self.player = player
+        self.rating = rating
+        self.bucket = bucket
+        self.enqueued_at = enqueued_at
+        self.avoid = avoid
+        self.avoid_until = avoid_until
+
+    def can_play(self, other, now):
+        if now >= self.avoid_until and now >= other.avoid_until:
+            return True
+        return self.avoid != other.player and other.avoid != self.player
+
+class Matchmaker:
+    # Players wait in insertion-ordered dicts, so enqueue, cancel and "oldest waiting player"
+    # are all O(1). Unranked, everyone shares bucket 0 and pairing is first-come-first-served.
+    # Ranked, players are bucketed by rating and may be paired with anyone whose bucket lies
+    # within their search window, which widens the longer they wait.
+    def __init__(self, on_pair, is_busy=None, ranked=False, bucket_width=100,
+                 initial_window=0, window_growth=25, max_window=400, avoid_seconds=30, clock=time.monotonic,
+                 lock=None):
+        self.on_pair = on_pair
+        self.is_busy = is_busy
+        self.ranked = ranked
+        self.bucket_width = bucket_width
+        self.initial_window = initial_window
+        self.window_growth = window_growth  # rating points per second of waiting
+        self.max_window = max_window
+        self.avoid_seconds = avoid_seconds  # how long a just-finished pair is kept apart
+        self.clock = clock
+        self.lock = lock or threading.Lock()
+        self.entries = {}  # {player: QueueEntry}, oldest first
+        self.buckets = {}  # {bucket: OrderedDict {player: QueueEntry}}
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, player):
+        return player in self.entries
+
+    def bucket_of(self, rating):
+        return int(rating // self.bucket_width) if self.ranked else 0
+
+    def enqueue(self, player, rating=DEFAULT_RATING, avoid=None):
+        with self.lock:
+            if player in self.entries or (self.is_busy and self.is_busy(player)):
+                return False
+            now = self.clock()
+            entry = QueueEntry(player, rating, self.bucket_of(rating), now, avoid, now + self.avoid_seconds if avoid else now)
+            self.entries[player] = entry
+            self.buckets.setdefault(entry.bucket, collections.OrderedDict())[player] = entry
+            return True
+
+    def cancel(self, player):
+        with self.lock:
+            entry = self.entries.get(player)
+            if entry is None:
+                return False
+            self.remove_locked(entry)
+            return True
+
+    def remove_locked(self, entry):
+        del self.entries[entry.player]
+        bucket = self.buckets[entry.bucket]
+        del bucket[entry.player]
+        if not bucket:
+            del self.buckets[entry.bucket]
+
+    def window_of(self, entry, now):
+        if not self.ranked:
+            return 0
+        return min(self.max_window, self.initial_window + self.window_growth * (now - entry.enqueued_at))
+
+    def find_opponent_locked(self, entry, now):
+        reach = math.ceil(self.window_of(entry, now) / self.bucket_width)
+        best = None
+        for bucket_index in range(entry.bucket - reach, entry.bucket + reach + 1):
+            bucket = self.buckets.get(bucket_index)
+            if not bucket:
+                continue
+            # Only the previous opponent can be skipped, so this looks at no more than three entries.
+            for other in bucket.values():
+                if other is not entry and entry.can_play(other, now):
+                    if best is None or other.enqueued_at < best.enqueued_at:
+                        best = other
+                    break
+        return best
+
+    def match_locked(self, entry, now):
+        opponent = self.find_opponent_locked(entry, now)
+        if opponent is None:
+            return None
+        self.remove_locked(entry)
+        self.remove_locked(opponent)
+        first, second = (opponent, entry) if opponent.enqueued_at <= entry.enqueued_at else (entry, opponent)
+        # on_pair runs under the lock so a player is never seen as neither waiting nor playing.
+        return self.on_pair(first.player, second.player)
+
+    def find_match(self, player):
+        # Event-driven pairing for a player who just joined the queue.
+        with self.lock:
+            entry = self.entries.get(player)
+            if entry is None:
+                return None
+            return self.match_locked(entry, self.clock())
+
+    def run_pass(self):
+        # Periodic pairing: oldest players first, with windows widened by their waiting time.
+        results = []
+        with self.lock:
+            now = self.clock()
+            for player in list(self.entries):
+                entry = self.entries.get(player)
+                if entry is None:
+                    continue
+                result = self.match_locked(entry, now)
+                if result is not None:
+                    results.append(result)
+        return results
+
+    def overdue(self, max_wait):
+        # Players who have waited at least max_wait seconds, oldest first.
+        with self.lock:
+            cutoff = self.clock() - max_wait
+            players = []
+            for entry in self.entries.values():
+                if entry.enqueued_at > cutoff:
+                    break
+                players.append(entry.player)
+            return players
+
+    def avoided(self, player):
+        # The player this one is still being kept apart from, if any.
+        with self.lock:
+            entry = self.entries.get(player)
+            if entry is None or self.clock() >= entry.avoid_until:
+                return None
+            return entry.avoid
+
+    def pair_with(self, player, partner):
+        # Pairs a waiting player with someone who is not in the queue: a server-side bot, or a
+        # player handed over by another worker in cluster mode.
+        with self.lock:
+            entry = self.entries.get(player)
+            if entry is None:
+                return None
+            self.remove_locked(entry)
+            return self.on_pair(player, partner)
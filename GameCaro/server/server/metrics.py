@@ -0,0 +1,157 @@
+﻿import bisect
+import http.server
+import threading
+import time
+
+# A small metrics registry rendered in the Prometheus text exposition format. Label values are
+# passed positionally, in the order the metric's label names were declared.
+
+LATENCY_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+def format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join('%s="%s"' % (name, str(value).replace('\\', '\\\\').replace('"', '\\"')) for name, value in pairs) + '}'
+
+class Metric:
+    kind = 'untyped'
+
+    def __init__(self, name, help_text, labels=(), func=None):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self.func = func  # read at scrape time instead of being updated by the server
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def samples(self):
+        # (name suffix, label values, extra label pairs, value)
+        if self.func is not None:
+            return [('', (), (), self.func())]
+        with self.lock:
+            return [('', key, (), value) for key, value in self.values.items()]
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+        for suffix, key, extra, value in self.samples():
+            lines.append(f"{self.name}{suffix}{format_labels(self.labels, key, extra)} {value}")
+        return lines
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, *label_values, amount=1):
+        with self.lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def set(self, value, *label_values):
+        with self.lock:
+            self.values[label_values] = value
+
+    def inc(self, *label_values, amount=1):
+        with self.lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def dec(self, *label_values, amount=1):
+        self.inc(*label_values, amount=-amount)
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.values.get(label_values)
+            if series is None:
+                # Per-bucket (not cumulative) counts, then sum and count.
+                series = self.values[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def samples(self):
+        with self.lock:
+            snapshot = [(key, list(counts), total, count) for key, (counts, total, count) in self.values.items()]
+        samples = []
+        for key, counts, total, count in snapshot:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += bucket_count
+                samples.append(('_bucket', key, (('le', bound),), cumulative))
+            samples.append(('_sum', key, (), total))
+            samples.append(('_count', key, (), count))
+        return samples
+
+class TimedLock:
+    # Stands in for threading.Lock in `with` blocks and records how long callers waited for the
+    # lock and how long they held it.
+    def __init__(self, wait_histogram, hold_histogram, name):
+        self.lock = threading.Lock()
+        self.wait_histogram = wait_histogram
+        self.hold_histogram = hold_histogram
+        self.name = name
+        self.acquired_at = 0.0
+
+    def __enter__(self):
+        started = time.perf_counter()
+        self.lock.acquire()
+        self.acquired_at = time.perf_counter()
+        self.wait_histogram.observe(self.acquired_at - started, self.name)
+        return self
+
+    def __exit__(self, *exc_info):
+        held = time.perf_counter() - self.acquired_at
+        self.lock.release()
+        self.hold_histogram.observe(held, self.name)
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help_text, labels=(), func=None):
+        return self.register(Counter(name, help_text, labels, func))
+
+    def gauge(self, name, help_text, labels=(), func=None):
+        return self.register(Gauge(name, help_text, labels, func))
+
+    def histogram(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, help_text, labels, buckets))
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+def start_metrics_server(registry, host, port):
+    # Serves GET /metrics from a daemon thread; scrapes never touch the game's network loop.
+    class MetricsHandler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path not in ('/', '/metrics'):
+                self.send_error(404)
+                return
+            body = registry.render().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    httpd = http.server.ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    return httpd
@@ -0,0 +1,227 @@
+﻿import argparse
+import collections
+import mmap
+import os
+import random
+import struct
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from board import BOARD_SIZE, SYMBOL_X, SYMBOL_O, WIN_CONDITION
+from gamelog import GameLogReader, RESULT_DRAW, RESULT_O_WON, RESULT_X_WON
+
+# Opening book: best known move for positions from the first moves of recorded or self-play
+# games. Positions are folded under the 8 symmetries of the square board (a position and its
+# rotations and reflections share one entry, stored in the orientation whose key is smallest),
+# and the file is a sorted array of fixed-size entries that is memory-mapped and binary-searched
+# in place: opening it reads the header and nothing else, and every process mapping the same
+# file shares its pages.
+#
+# File: MAGIC, HEADER, then ENTRY records sorted by key.
+
+MAGIC = b'CAROBK01'
+HEADER = struct.Struct('>IBBBx')    # entries, board size, win condition, max ply
+ENTRY = struct.Struct('>QBBIH')     # position key, row, col (canonical orientation), games, score in 1/1000
+DATA_START = len(MAGIC) + HEADER.size
+
+MAX_PLY = 12     # positions after at most this many moves go into the book
+MIN_GAMES = 2    # a position needs this many games to get an entry
+
+# The keys are part of the file format: a different table would need a new MAGIC.
+_rng = random.Random(0xCA50B00C)
+KEYS = [(0, _rng.getrandbits(64), _rng.getrandbits(64)) for _ in range(BOARD_SIZE * BOARD_SIZE)]
+
+def build_symmetries():
+    last = BOARD_SIZE - 1
+    transforms = (lambda r, c: (r, c), lambda r, c: (c, last - r), lambda r, c: (last - r, last - c),
+                  lambda r, c: (last - c, r), lambda r, c: (r, last - c), lambda r, c: (c, r),
+                  lambda r, c: (last - r, c), lambda r, c: (last - c, last - r))
+    maps = [tuple(row * BOARD_SIZE + col for row, col in (transform(*divmod(cell, BOARD_SIZE))
+                                                           for cell in range(BOARD_SIZE * BOARD_SIZE)))
+            for transform in transforms]
+    inverses = [next(j for j, other in enumerate(maps) if all(other[forward[cell]] == cell for cell in range(len(forward))))
+                for forward in maps]
+    return maps, inverses
+
+SYMMETRIES, INVERSES = build_symmetries()  # SYMMETRIES[t][cell] -> cell; INVERSES[t] undoes t
+
+def canonical(stones):
+    # stones: [(cell, player)]. Returns (key, t): the smallest key over the 8 orientations and the
+    # symmetry that produces it.
+    best_key, best_t = None, 0
+    for t, mapping in enumerate(SYMMETRIES):
+        key = 0
+        for cell, player in stones:
+            key ^= KEYS[mapping[cell]][player]
+        if best_key is None or key < best_key:
+            best_key, best_t = key, t
+    return best_key, best_t
+
+class OpeningBook:
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.data[:len(MAGIC)] != MAGIC:
+            self.data.close()
+            raise ValueError(f"{path} không phải sách khai cuộc")
+        self.entries, board_size, win_condition, self.max_ply = HEADER.unpack_from(self.data, len(MAGIC))
+        if (board_size, win_condition) != (BOARD_SIZE, WIN_CONDITION):
+            self.data.close()
+            raise ValueError(f"{path} dành cho bàn {board_size}x{board_size}, thắng với {win_condition} quân")
+
+    def __len__(self):
+        return self.entries
+
+    def find(self, key):
+        # Binary search over the mapped entries; returns the unpacked entry or None.
+        data, low, high = self.data, 0, self.entries
+        while low < high:
+            middle = (low + high) // 2
+            entry_key = struct.unpack_from('>Q', data, DATA_START + middle * ENTRY.size)[0]
+            if entry_key < key:
+                low = middle + 1
+            elif entry_key > key:
+                high = middle
+            else:
+                return ENTRY.unpack_from(data, DATA_START + middle * ENTRY.size)
+        return None
+
+    def lookup(self, stones):
+        # stones: [(cell, player)] with player 1 for X. Returns (row, col, games, score) in the
+        # position's own orientation, or None.
+        if len(stones) > self.max_ply:
+            return None
+        key, t = canonical(stones)
+        entry = self.find(key)
+        if entry is None:
+            return None
+        _, row, col, games, score = entry
+        row, col = divmod(SYMMETRIES[INVERSES[t]][row * BOARD_SIZE + col], BOARD_SIZE)
+        return row, col, games, score / 1000
+
+    def close(self):
+        self.data.close()
+
+_books = {}
+
+def open_book(path):
+    # One mapping per path and process, for worker processes that are handed a path.
+    book = _books.get(path)
+    if book is None:
+        book = _books[path] = OpeningBook(path)
+    return book
+
+def stones_of(moves):
+    return [(row * BOARD_SIZE + col, 1 + i % 2) for i, (row, col) in enumerate(moves)]
+
+def collect(stats, moves, x_score, max_ply):
+    # Adds one game to stats {key: {canonical cell: [games, score]}}. x_score: 1, 0.5 or 0 for X.
+    stones = []
+    for ply, (row, col) in enumerate(moves[:max_ply + 1]):
+        player = 1 + ply % 2
+        key, t = canonical(stones)
+        move = stats[key][SYMMETRIES[t][row * BOARD_SIZE + col]]
+        move[0] += 1
+        move[1] += x_score if player == 1 else 1 - x_score
+        stones.append((row * BOARD_SIZE + col, player))
+
+def write_book(path, stats, max_ply, min_games):
+    entries = []
+    for key, moves in stats.items():
+        if sum(games for games, _ in moves.values()) < min_games:
+            continue
+        # Smoothed score, so one lucky game does not beat a move that did well many times.
+        cell, (games, score) = max(moves.items(), key=lambda item: ((item[1][1] + 1) / (item[1][0] + 2), item[1][0], -item[0]))
+        entries.append((key, *divmod(cell, BOARD_SIZE), min(games, 2 ** 32 - 1), round(score / games * 1000)))
+    entries.sort()
+    temporary = path + '.tmp'
+    with open(temporary, 'wb') as f:
+        f.write(MAGIC + HEADER.pack(len(entries), BOARD_SIZE, WIN_CONDITION, max_ply))
+        f.write(b''.join(ENTRY.pack(*entry) for entry in entries))
+    os.replace(temporary, path)  # a server mapping the old file keeps its pages
+    return len(entries)
+
+def recorded_games(directories):
+    # (moves, x_score) for every decided or drawn 15x15 round in the game logs.
+    x_scores = {RESULT_X_WON: 1.0, RESULT_DRAW: 0.5, RESULT_O_WON: 0.0}
+    for directory in directories:
+        reader = GameLogReader(directory)
+        for record in reader:
+            if record.board_size == BOARD_SIZE and record.result in x_scores:
+                yield [(row, col) for row, col, _ in record.moves], x_scores[record.result]
+        reader.close()
+
+def self_play_games(policy, count, seed, opening, workers):
+    from tournament import play_game  # tournament imports the server, whose bot imports this module
+    games = [(i, policy, policy, seed * 1000003 + i, opening) for i in range(count)]
+    pool = ProcessPoolExecutor(max_workers=workers) if workers else None
+    results = pool.map(play_game, games, chunksize=max(1, count // (workers * 8))) if pool else map(play_game, games)
+    try:
+        for _, result, moves, _, _ in results:
+            yield [(row, col) for row, col, _ in moves], 1.0 if result == RESULT_X_WON else 0.5 if result == RESULT_DRAW else 0.0
+    finally:
+        if pool:
+            pool.shutdown()
+
+def main():
+    parser = argparse.ArgumentParser(description="Tạo và tra sách khai cuộc cho bàn 15x15")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    build = subparsers.add_parser('build', help="tạo sách từ nhật ký ván đấu và/hoặc các ván tự chơi")
+    build.add_argument('book')
+    build.add_argument('--logs', nargs='*', default=[], metavar='DIR', help="thư mục nhật ký ván đấu (--game-log)")
+    build.add_argument('--self-play', type=int, default=0, metavar='GAMES', help="số ván máy tự chơi thêm")
+    build.add_argument('--policy', default='search:2', help="bot tự chơi, như trong tournament.py")
+    build.add_argument('--opening', type=int, default=2, help="số nước ngẫu nhiên đầu mỗi ván tự chơi")
+    build.add_argument('--seed', type=int, default=1)
+    build.add_argument('--workers', type=int, default=os.cpu_count() or 1, help="số process tự chơi (0 = trong process này)")
+    build.add_argument('--max-ply', type=int, default=MAX_PLY, help="chỉ ghi các thế cờ có tối đa số quân này")
+    build.add_argument('--min-games', type=int, default=MIN_GAMES, help="số ván tối thiểu qua một thế cờ")
+    probe = subparsers.add_parser('probe', help="tra nước đi của sách cho một thế cờ")
+    probe.add_argument('book')
+    probe.add_argument('moves', nargs='*', metavar='ROW,COL', help="các nước đã đi, X trước")
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        if not args.logs and not args.self_play:
+            parser.error("cần --logs hoặc --self-play")
+        if args.self_play:
+            from tournament import make_policy  # see self_play_games
+            try:
+                make_policy(args.policy)
+            except ValueError:
+                parser.error(f"không hiểu bot '{args.policy}'")
+        started = time.perf_counter()
+        stats = collections.defaultdict(lambda: collections.defaultdict(lambda: [0, 0.0]))
+        games = 0
+        sources = [recorded_games(args.logs)]
+        if args.self_play:
+            sources.append(self_play_games(args.policy, args.self_play, args.seed, args.opening, args.workers))
+        for source in sources:
+            for moves, x_score in source:
+                collect(stats, moves, x_score, args.max_ply)
+                games += 1
+        entries = write_book(args.book, stats, args.max_ply, args.min_games)
+        print(f"{games} ván, {len(stats)} thế cờ khác nhau (đã gộp đối xứng), {entries} mục ghi vào {args.book} "
+              f"({DATA_START + entries * ENTRY.size} byte) trong {time.perf_counter() - started:.1f}s")
+    elif args.command == 'probe':
+        started = time.perf_counter()
+        book = OpeningBook(args.book)
+        opened = time.perf_counter() - started
+        try:
+            moves = [tuple(int(part) for part in move.split(',')) for move in args.moves]
+        except ValueError:
+            parser.error("nước đi có dạng ROW,COL")
+        started = time.perf_counter()
+        found = book.lookup(stones_of(moves))
+        looked_up = time.perf_counter() - started
+        print(f"{len(book)} mục, mở trong {opened * 1e3:.2f} ms, tra trong {looked_up * 1e6:.0f} us")
+        if found is None:
+            print("Không có trong sách.")
+        else:
+            row, col, games, score = found
+            symbol = SYMBOL_X if len(moves) % 2 == 0 else SYMBOL_O
+            print(f"{symbol} đi ({row}, {col}): {games} ván, điểm {score:.3f}")
+        book.close()
+
+if __name__ == "__main__":
+    main()
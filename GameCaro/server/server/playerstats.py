@@ -0,0 +1,171 @@
+﻿import bisect
+import logging
+import sqlite3
+import threading
+import time
+
+from rating import DEFAULT_RATING
+
+log = logging.getLogger('caro.stats')
+
+# Results and Elo of every player, kept in SQLite in WAL mode so that reading the file (another
+# server process starting up, a report run next to the server) never waits for the writer. The
+# server holds every player's numbers in memory and only writes: record() queues a change and a
+# writer thread applies whatever has built up every FLUSH_INTERVAL in one transaction. Changes
+# are stored as increments (rating change, one more win, ...), so server processes sharing the
+# file add to each other's results instead of overwriting them.
+
+FLUSH_INTERVAL = 0.5  # seconds between batched commits
+BUSY_TIMEOUT = 5.0    # seconds to wait for another process's write transaction
+LEADERBOARD_SIZE = 100
+
+SCHEMA = '''CREATE TABLE IF NOT EXISTS players (
+    username TEXT PRIMARY KEY,
+    rating REAL NOT NULL,
+    wins INTEGER NOT NULL,
+    draws INTEGER NOT NULL,
+    losses INTEGER NOT NULL,
+    updated REAL NOT NULL
+)'''
+UPSERT = '''INSERT INTO players (username, rating, wins, draws, losses, updated)
+VALUES (:username, :base + :change, :wins, :draws, :losses, :updated)
+ON CONFLICT (username) DO UPDATE SET rating = rating + :change, wins = wins + :wins, draws = draws + :draws,
+    losses = losses + :losses, updated = :updated'''
+
+def result_counts(score):
+    # (wins, draws, losses) for one round scored 1, 0.5 or 0.
+    return (1, 0, 0) if score == 1 else (0, 0, 1) if score == 0 else (0, 1, 0)
+
+class StatsStore:
+    def __init__(self, path, flush_interval=FLUSH_INTERVAL):
+        self.path = path
+        self.flush_interval = flush_interval
+        # Only used by the constructor and then by the writer thread.
+        self.connection = sqlite3.connect(path, timeout=BUSY_TIMEOUT, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')  # WAL stays consistent; a power cut may lose the last batches
+        with self.connection:
+            self.connection.execute(SCHEMA)
+        self.condition = threading.Condition()
+        self.pending = {}  # {username: [rating change, wins, draws, losses]} not yet committed
+        self.closed = False
+        self.rows_written = 0
+        self.batches = 0
+        self.errors = 0
+        self.thread = threading.Thread(target=self.write_loop, daemon=True)
+
+    def load(self):
+        # [(username, rating, wins, draws, losses)] for every player; call before start().
+        return self.connection.execute('SELECT username, rating, wins, draws, losses FROM players').fetchall()
+
+    def start(self):
+        self.thread.start()
+
+    def record(self, username, change, score):
+        wins, draws, losses = result_counts(score)
+        with self.condition:
+            totals = self.pending.setdefault(username, [0.0, 0, 0, 0])
+            totals[0] += change
+            totals[1] += wins
+            totals[2] += draws
+            totals[3] += losses
+
+    def pending_count(self):
+        return len(self.pending)
+
+    def write_loop(self):
+        while True:
+            with self.condition:
+                if not self.closed:
+                    self.condition.wait(self.flush_interval)
+                batch, self.pending = self.pending, {}
+                closed = self.closed
+            if batch:
+                self.write_batch(batch)
+            if closed:
+                self.connection.close()
+                return
+
+    def write_batch(self, batch):
+        now = time.time()
+        rows = [{'username': username, 'base': DEFAULT_RATING, 'change': change, 'wins': wins, 'draws': draws,
+                 'losses': losses, 'updated': now} for username, (change, wins, draws, losses) in batch.items()]
+        try:
+            with self.connection:
+                self.connection.executemany(UPSERT, rows)
+        except sqlite3.Error as e:
+            # Kept for the next batch, merged with whatever was recorded meanwhile.
+            log.error("Không ghi được %d người chơi vào %s: %s", len(rows), self.path, e)
+            self.errors += 1
+            with self.condition:
+                for username, totals in batch.items():
+                    merged = self.pending.setdefault(username, [0.0, 0, 0, 0])
+                    for i, value in enumerate(totals):
+                        merged[i] += value
+            return
+        self.rows_written += len(rows)
+        self.batches += 1
+
+    def close(self):
+        # Commits whatever is still queued (once; a failed last batch is only logged).
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+        if self.thread.is_alive():
+            self.thread.join()
+
+class Leaderboard:
+    # Every player ordered by rating, kept sorted as results come in (a bisect and a list insert
+    # per change), so the top of the table is a slice rather than a sort or a query. The reply
+    # rows for the first `size` places are built once and reused until a change reaches them.
+    def __init__(self, size=LEADERBOARD_SIZE):
+        self.size = size
+        self.order = []    # [(-rating, username)], best first
+        self.players = {}  # {username: [rating, wins, draws, losses]}
+        self.lock = threading.Lock()
+        self.top_rows = None
+
+    def load(self, rows):
+        with self.lock:
+            self.players = {username: [rating, wins, draws, losses] for username, rating, wins, draws, losses in rows}
+            self.order = sorted((-player[0], username) for username, player in self.players.items())
+            self.top_rows = None
+
+    def __len__(self):
+        return len(self.order)
+
+    def update(self, username, rating, score):
+        with self.lock:
+            player = self.players.get(username)
+            touches_top = False
+            if player is None:
+                player = self.players[username] = [rating, 0, 0, 0]
+            else:
+                index = bisect.bisect_left(self.order, (-player[0], username))
+                del self.order[index]
+                touches_top = index < self.size
+                player[0] = rating
+            for i, count in enumerate(result_counts(score), 1):
+                player[i] += count
+            index = bisect.bisect_left(self.order, (-rating, username))
+            self.order.insert(index, (-rating, username))
+            if touches_top or index < self.size:
+                self.top_rows = None
+
+    def row(self, rank, username):
+        rating, wins, draws, losses = self.players[username]
+        return {'rank': rank, 'username': username, 'rating': round(rating), 'wins': wins, 'draws': draws, 'losses': losses}
+
+    def top(self):
+        with self.lock:
+            if self.top_rows is None:
+                self.top_rows = [self.row(rank, username) for rank, (_, username) in enumerate(self.order[:self.size], 1)]
+            return self.top_rows
+
+    def entry(self, username):
+        # The player's own row, with their rank, or None for someone without a finished game.
+        with self.lock:
+            player = self.players.get(username)
+            if player is None:
+                return None
+            return self.row(bisect.bisect_left(self.order, (-player[0], username)) + 1, username)
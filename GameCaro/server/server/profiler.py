@@ -0,0 +1,140 @@
+﻿import functools
+import os
+import threading
+import time
+
+# Profiling for --profile. Nothing in this module runs unless the server swaps its functions and
+# locks for the wrapped ones below at start-up, so a server started without the switch pays
+# nothing for it, not even a flag check.
+#
+# Spans nest per thread: send_to_client called while a 'move' is handled is recorded under the
+# stack 'handle_message:move;send_to_client'. Each finished span adds its self time (its own
+# time less its children's) to its stack, which is the collapsed-stack format flamegraph.pl and
+# speedscope read. Waiting for a lock is a span too ('wait:session'), so contention shows in
+# the flame graph where it happens; how long locks are held goes to the lock table.
+
+CONTENDED_SECONDS = 0.0001  # a wait longer than this counts as contention
+
+class Profiler:
+    def __init__(self):
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.spans = {}   # {name: [calls, total seconds, max seconds]}
+        self.stacks = {}  # {'outer;inner': self seconds}
+        self.locks = {}   # {name: [acquisitions, contended, wait total, wait max, hold total, hold max]}
+        self.started = time.perf_counter()
+
+    def enter(self, name):
+        frames = getattr(self.local, 'frames', None)
+        if frames is None:
+            frames = self.local.frames = []
+        frames.append([name, time.perf_counter(), 0.0])  # name, start, time spent in children
+
+    def exit(self):
+        # Ends the innermost span of this thread and returns its wall time.
+        frames = self.local.frames
+        stack = ';'.join(frame[0] for frame in frames)
+        name, started, children = frames.pop()
+        elapsed = time.perf_counter() - started
+        if frames:
+            frames[-1][2] += elapsed
+        with self.lock:
+            span = self.spans.get(name)
+            if span is None:
+                span = self.spans[name] = [0, 0.0, 0.0]
+            span[0] += 1
+            span[1] += elapsed
+            span[2] = max(span[2], elapsed)
+            self.stacks[stack] = self.stacks.get(stack, 0.0) + elapsed - children
+        return elapsed
+
+    def wrap(self, func, name):
+        @functools.wraps(func)
+        def profiled(*args, **kwargs):
+            self.enter(name)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.exit()
+        return profiled
+
+    def wrap_handler(self, func, name, label):
+        # For handle_message(connection, address, message): one span per label(message). The
+        # label must come from a fixed set (the message types the server knows), not straight
+        # from the client, or every invented type would add a span.
+        @functools.wraps(func)
+        def profiled(client_socket, client_address, message):
+            self.enter(f"{name}:{label(message)}")
+            try:
+                return func(client_socket, client_address, message)
+            finally:
+                self.exit()
+        return profiled
+
+    def wrap_lock(self, lock, name):
+        return ProfiledLock(self, lock, name)
+
+    def lock_used(self, name, waited, held):
+        with self.lock:
+            stats = self.locks.get(name)
+            if stats is None:
+                stats = self.locks[name] = [0, 0, 0.0, 0.0, 0.0, 0.0]
+            stats[0] += 1
+            stats[1] += waited > CONTENDED_SECONDS
+            stats[2] += waited
+            stats[3] = max(stats[3], waited)
+            stats[4] += held
+            stats[5] = max(stats[5], held)
+
+    def summary(self):
+        # The tables logged every --profile-interval: spans by total time, then locks.
+        with self.lock:
+            spans = sorted(self.spans.items(), key=lambda item: item[1][1], reverse=True)
+            locks = sorted(self.locks.items(), key=lambda item: item[1][2], reverse=True)
+        wall = time.perf_counter() - self.started
+        lines = [f"Profile sau {wall:.0f}s:",
+                 f"{'span':<32} {'lần':>9} {'tổng ms':>10} {'tb us':>9} {'max us':>9} {'% thời gian':>11}"]
+        for name, (calls, total, longest) in spans:
+            lines.append(f"{name:<32} {calls:>9} {total * 1e3:>10.1f} {total / calls * 1e6:>9.1f} "
+                         f"{longest * 1e6:>9.0f} {total / wall * 100:>11.2f}")
+        lines.append(f"{'lock':<32} {'lần':>9} {'tranh chấp':>10} {'chờ ms':>9} {'chờ max us':>10} "
+                     f"{'giữ ms':>9} {'giữ max us':>10}")
+        for name, (count, contended, waited, longest_wait, held, longest_hold) in locks:
+            lines.append(f"{name:<32} {count:>9} {contended:>10} {waited * 1e3:>9.1f} {longest_wait * 1e6:>10.0f} "
+                         f"{held * 1e3:>9.1f} {longest_hold * 1e6:>10.0f}")
+        return '\n'.join(lines)
+
+    def write_collapsed(self, path):
+        # One 'outer;inner microseconds' line per stack, replaced atomically.
+        with self.lock:
+            stacks = sorted(self.stacks.items())
+        temporary = path + '.tmp'
+        with open(temporary, 'w', encoding='utf-8') as f:
+            for stack, seconds in stacks:
+                if seconds > 0:
+                    f.write(f"{stack} {round(seconds * 1e6)}\n")
+        os.replace(temporary, path)
+
+class ProfiledLock:
+    # Wraps a lock used in `with` blocks (threading.Lock or metrics.TimedLock).
+    def __init__(self, profiler, lock, name):
+        self.profiler = profiler
+        self.lock = lock
+        self.name = name
+        self.waited = 0.0
+        self.acquired_at = 0.0
+
+    def __enter__(self):
+        self.profiler.enter('wait:' + self.name)
+        try:
+            self.lock.__enter__()
+        finally:
+            waited = self.profiler.exit()
+        # Only the holder writes these, and only while it holds the lock.
+        self.waited, self.acquired_at = waited, time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        waited, held = self.waited, time.perf_counter() - self.acquired_at
+        self.lock.__exit__(*exc_info)
+        self.profiler.lock_used(self.name, waited, held)
@@ -0,0 +1,9 @@
+DEFAULT_RATING = 1200
+K_FACTOR = 32
+
+def expected_score(rating, opponent_rating):
+    return 1 / (1 + 10 ** ((opponent_rating - rating) / 400))
+
+def elo_update(rating, opponent_rating, score, k_factor=K_FACTOR):
+    # score: 1 for a win, 0.5 for a draw, 0 for a loss.
+    return rating + k_factor * (score - expected_score(rating, opponent_rating))
@@ -1,329 +1,1386 @@
 ﻿import socket
 import threading
-import json
+import asyncio
+import argparse
+import atexit
+import itertools
+import logging
+import os
+import sys
+import random
+import secrets
+import signal
 import time
+import multiprocessing
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'shared'))
+
+from ai import BotClient
+from analysis import TOP_MOVES, AnalysisCache, analyze_position, position_key
+from board import Board, BOARD_SIZE, SparseBoard, SYMBOL_X, SYMBOL_O
+from cluster import SNAPSHOT_LIMIT, connect_link, run_supervisor
+from connection import SocketClient, StreamClient, OVERFLOW_POLICIES, configure_send_queues, send_stats
+from gamelog import GameLogWriter, RESULT_ABANDONED, RESULT_DRAW, RESULT_O_WON, RESULT_X_WON
+from logs import setup_logging
+from matchmaker import Matchmaker
+from metrics import Registry, TimedLock, start_metrics_server
+from openingbook import OpeningBook
+from playerstats import LEADERBOARD_SIZE, Leaderboard, StatsStore
+from profiler import Profiler
+from protocol import RECV_SIZE, encode_binary, encode_message
+from rating import DEFAULT_RATING, elo_update
+from timerwheel import TimerWheel
 
 HOST = '0.0.0.0'
 PORT = 12345
 
-BOARD_SIZE = 15
-EMPTY_CELL = ' '
-
-lock = threading.Lock()
+MATCHMAKING_INTERVAL = 1.0  # seconds between periodic pairing passes
 
-players_in_waitlist = []
 player_names = {}
-game_pairs = {}
-game_boards = {}
-current_turns = {}
-player_symbols = {}
-rematch_requests = {}  # {game_id: set([player_socket])}
-last_moves = {}        # {game_id: {'row': r, 'col': c}}
-rematch_declined_flags = {}  # {game_id: set([player_socket])}
-
-SYMBOL_X = 'X'
-SYMBOL_O = 'O'
-WIN_CONDITION = 5
+player_ratings = {}   # {username: Elo rating}
+player_features = {}  # {player_socket: set of protocol features announced in username_set}
+player_sessions = {}  # {player_socket: GameSession}
+game_sessions = {}    # {game_id: GameSession}
+game_ids = itertools.count(1)  # in cluster mode worker i hands out i + 1, i + 1 + workers, ...
+spectating = {}       # {spectator connection: GameSession being watched}
+GAME_LIST_LIMIT = 50  # games per 'games' reply
+# Decides who moves first; seeded from --seed so load tests can be replayed.
+rng = random.Random()
 
-def create_new_board():
-    return [[EMPTY_CELL for _ in range(BOARD_SIZE)] for _ in range(BOARD_SIZE)]
+# 'delta': the client applies 'move_made' deltas and asks for 'board_sync' when it sees a gap.
+# 'binary': length-prefixed binary frames after the 'protocol' handshake (see protocol.py).
+# 'resume': the client gets a 'session' token with its first game_start and may send 'resume'
+# with it after reconnecting.
+# 'heartbeat': the client answers 'ping' with 'pong' and may be dropped after IDLE_TIMEOUT of silence.
+# 'sparse': the client can play free-style boards: 'sparse_start' instead of 'game_start', 'stone'
+# deltas, 'place' moves and 'viewport' requests for the part of the board it shows.
+SUPPORTED_FEATURES = {'delta', 'binary', 'resume', 'heartbeat', 'sparse'}
+
+# Free-style mode (--board-size other than BOARD_SIZE): boards are SparseBoards of board_size
+# (0 for an unbounded plane) and nothing sent to a client grows with the board's area.
+board_size = BOARD_SIZE
+free_style = False
+VIEWPORT_LIMIT = 64  # rows and columns per 'viewport' reply
+
+# Every deadline (heartbeats, turn clocks, resume grace periods) lives in one timer wheel driven
+# by a single loop, so thousands of them cost a list entry each.
+timers = TimerWheel()
+PING_INTERVAL = 15.0  # a connection silent this long gets a 'ping'
+IDLE_TIMEOUT = 45.0   # 'heartbeat' clients (and connections that never logged in) silent this long are dropped
+TURN_TIMEOUT = 120.0  # a player who does not move in time loses the round
+
+# A player of a 'resume' client who drops mid-game keeps their seat this long before the opponent
+# is told the game is over.
+RESUME_GRACE_SECONDS = 60.0
+resume_tokens = {}     # {token: GameSession}
+away_players = {}      # {player_socket: Timer ending the grace period} for dropped players whose seat is kept
+
+# Server-side bot: a player who has waited BOT_WAIT_SECONDS without an opponent is paired with it.
+BOT_NAME = 'Máy'
+BOT_WAIT_SECONDS = 15.0
+BOT_TIME_BUDGET = 1.0  # seconds of search per move
+bot_pool = None        # ProcessPoolExecutor running the searches; None disables the bot
+opening_book = None    # path from --opening-book, checked at start-up; the bot and 'analyze' map it in their workers
+bot_ids = itertools.count(1)
+server_loop = None     # the asyncio loop, so worker callbacks can hand their results back to it
+
+# Cluster mode (see cluster.py): players left waiting this long are offered to the matchmaker process.
+CLUSTER_WAIT_SECONDS = 1.0
+cluster_link = None    # ClusterLink to the matchmaker process; None when this server runs alone
+cluster_ids = {}       # {player_socket: id the matchmaker process knows the player by}
+cluster_players = {}   # {id: player_socket}
+next_cluster_ids = itertools.count(1)
+worker_index = 0       # this process's worker number; resume tokens start with it
+worker_count = 1
+
+game_log = None        # GameLogWriter from --game-log; every finished or abandoned round is appended to it
+
+# Every rated round updates the in-memory leaderboard and, with --stats-db, is queued for the
+# batched SQLite writer (see playerstats.py). 'leaderboard' requests never touch the database.
+stats_store = None     # StatsStore from --stats-db
+leaderboard = Leaderboard()
+
+# --profile wraps these, every handle_message branch and every session, matchmaker and analysis
+# lock acquisition (see profiler.py and enable_profiling).
+PROFILED_FUNCTIONS = ('send_to_client', 'broadcast', 'check_win', 'cleanup_game', 'update_ratings')
+PROFILE_INTERVAL = 10.0  # seconds between summary tables
+profiler = None        # Profiler from --profile; None when profiling is off
+
+# 'analyze' requests (see analysis.py) are evaluated in their own process pool. Results are kept
+# in an LRU by position key, and identical requests in flight share one evaluation. Only
+# evaluations count against a player's allowance: ANALYSIS_RATE per second, up to ANALYSIS_BURST.
+ANALYSIS_RATE = 1.0
+ANALYSIS_BURST = 5
+ANALYSIS_QUEUE_LIMIT = 64  # positions being evaluated at once, across all players
+analysis_pool = None   # ProcessPoolExecutor from --analysis-workers; None disables 'analyze'
+analysis_cache = AnalysisCache(10000)
+analysis_lock = threading.Lock()  # cache and in-flight table; threaded mode finishes on pool threads
+analysis_inflight = {}  # {position key: [(connection, seq, top) waiting for the result]}
+analysis_buckets = {}   # {connection: (evaluations left, time.monotonic() of the last refill)}
+
+log = logging.getLogger('caro.server')
+
+# Served as Prometheus text on --metrics-port. Gauges built on a function are read at scrape time.
+METRICS_PORT = 9100
+metrics = Registry()
+connections_open = metrics.gauge('caro_connections', "Kết nối đang mở")
+connections_total = metrics.counter('caro_connections_total', "Số kết nối đã nhận")
+metrics.gauge('caro_waiting_players', "Người chơi đang chờ ghép cặp", func=lambda: len(matchmaker))
+metrics.gauge('caro_active_games', "Số game đang chơi", func=lambda: len(game_sessions))
+metrics.gauge('caro_spectators', "Kết nối đang xem trận", func=lambda: len(spectating))
+metrics.gauge('caro_away_players', "Người chơi mất kết nối đang được giữ chỗ", func=lambda: len(away_players))
+metrics.gauge('caro_timers', "Hẹn giờ đang chờ trong timer wheel", func=lambda: len(timers))
+metrics.counter('caro_timers_fired_total', "Hẹn giờ đã chạy", func=lambda: timers.fired)
+reaped_total = metrics.counter('caro_reaped_connections_total', "Kết nối bị ngắt vì im lặng quá lâu")
+turn_timeouts_total = metrics.counter('caro_turn_timeouts_total', "Lượt bị xử thua vì hết giờ")
+resumes_total = metrics.counter('caro_resumes_total', "Lần nối lại phiên chơi theo kết quả", ('result',))
+messages_received = metrics.counter('caro_messages_received_total', "Tin nhận được theo loại", ('type',))
+messages_sent = metrics.counter('caro_messages_sent_total', "Tin đưa vào hàng đợi gửi theo loại", ('type',))
+bytes_received = metrics.counter('caro_bytes_received_total', "Số byte nhận từ client")
+metrics.counter('caro_bytes_sent_total', "Số byte đã ghi ra socket", func=lambda: send_stats.bytes_sent)
+metrics.gauge('caro_send_queue_depth', "Tin đang chờ gửi trên mọi kết nối", func=lambda: send_stats.queue_depth)
+metrics.gauge('caro_send_queue_max_depth', "Độ sâu lớn nhất của hàng đợi gửi", func=lambda: send_stats.max_queue_depth)
+metrics.counter('caro_send_blocked_seconds_total', "Thời gian writer chờ socket", func=lambda: send_stats.blocked_seconds)
+metrics.counter('caro_send_dropped_total', "Tin chat bị bỏ khi hàng đợi đầy", func=lambda: send_stats.dropped)
+metrics.counter('caro_send_coalesced_total', "Cập nhật bàn cờ bị gộp khi hàng đợi đầy", func=lambda: send_stats.coalesced)
+metrics.counter('caro_send_overflow_disconnects_total', "Kết nối bị ngắt vì hàng đợi đầy",
+                func=lambda: send_stats.overflow_disconnects)
+move_seconds = metrics.histogram('caro_move_seconds', "Thời gian xử lý một nước đi trên server")
+lock_wait_seconds = metrics.histogram('caro_lock_wait_seconds', "Thời gian chờ lấy lock", ('lock',))
+lock_hold_seconds = metrics.histogram('caro_lock_hold_seconds', "Thời gian giữ lock", ('lock',))
+analysis_requests = metrics.counter('caro_analysis_requests_total', "Yêu cầu phân tích theo kết quả", ('result',))
+analysis_seconds = metrics.histogram('caro_analysis_seconds', "Thời gian từ lúc gửi một thế cờ đi phân tích đến khi có kết quả")
+metrics.gauge('caro_analysis_cache_entries', "Thế cờ trong bộ nhớ đệm phân tích", func=lambda: len(analysis_cache))
+metrics.counter('caro_game_log_records_total', "Ván đã ghi và fsync vào nhật ký",
+                func=lambda: game_log.records_written if game_log else 0)
+metrics.counter('caro_game_log_bytes_total', "Số byte đã ghi vào nhật ký", func=lambda: game_log.bytes_written if game_log else 0)
+metrics.counter('caro_game_log_batches_total', "Số lần ghi và fsync nhật ký", func=lambda: game_log.batches if game_log else 0)
+metrics.counter('caro_game_log_errors_total', "Lần ghi nhật ký thất bại", func=lambda: game_log.errors if game_log else 0)
+metrics.counter('caro_game_log_dropped_total', "Ván bị bỏ vì nhật ký ghi lỗi quá lâu",
+                func=lambda: game_log.dropped if game_log else 0)
+metrics.gauge('caro_game_log_pending', "Ván đang chờ ghi vào nhật ký", func=lambda: game_log.pending_count() if game_log else 0)
+metrics.gauge('caro_leaderboard_players', "Người chơi có trong bảng xếp hạng", func=lambda: len(leaderboard))
+metrics.gauge('caro_stats_pending', "Người chơi có kết quả chưa ghi vào --stats-db",
+              func=lambda: stats_store.pending_count() if stats_store else 0)
+metrics.counter('caro_stats_rows_total', "Dòng đã ghi vào --stats-db", func=lambda: stats_store.rows_written if stats_store else 0)
+metrics.counter('caro_stats_batches_total', "Số transaction ghi --stats-db", func=lambda: stats_store.batches if stats_store else 0)
+metrics.counter('caro_stats_errors_total', "Lần ghi --stats-db thất bại", func=lambda: stats_store.errors if stats_store else 0)
+
+class GameSession:
+    __slots__ = ('game_id', 'players', 'board', 'current_turn', 'symbols', 'last_move', 'move_count',
+                 'rematch_requests', 'active', 'lock', 'moves', 'started_at', 'started_clock', 'names', 'tokens',
+                 'spectators', 'watcher_cache', 'turn_timer')
+
+    def __init__(self, game_id, player1, player2):
+        self.game_id = game_id
+        self.players = (player1, player2)
+        self.board = None
+        self.current_turn = None
+        self.symbols = {}
+        self.last_move = None
+        self.move_count = 0
+        self.moves = []  # (row, col, ms since the round started), for the game log
+        self.started_at = 0.0
+        self.started_clock = 0.0  # time.monotonic() at started_at, for move offsets that survive clock changes
+        self.names = ('', '')  # X and O player names, kept for the game log after a disconnect
+        self.rematch_requests = set()
+        self.tokens = {}  # {player_socket: resume token}, issued once per session
+        self.spectators = {}  # {connection: True if it reads binary frames}
+        self.watcher_cache = ()
+        self.turn_timer = None
+        self.active = True
+        self.lock = TimedLock(lock_wait_seconds, lock_hold_seconds, 'session')
+
+    def opponent_of(self, player_socket):
+        player1, player2 = self.players
+        return player2 if player_socket is player1 else player1
+
+    def start_round(self, first_player_socket):
+        self.board = create_new_board()
+        self.last_move = None
+        self.move_count = 0
+        self.moves = []
+        self.started_at = time.time()
+        self.started_clock = time.monotonic()
+        self.current_turn = first_player_socket
+        for player_socket in self.players:
+            self.symbols[player_socket] = SYMBOL_X if player_socket is first_player_socket else SYMBOL_O
+        self.names = (player_names.get(first_player_socket, ''), player_names.get(self.opponent_of(first_player_socket), ''))
+        self.rematch_requests = set()
+        self.restart_turn_timer()
 
-def generate_game_id(socket1, socket2):
-    return tuple(sorted([socket1.fileno(), socket2.fileno()]))
+    def restart_turn_timer(self):
+        # Called with the lock held whenever current_turn changes.
+        if self.turn_timer is not None:
+            self.turn_timer.cancel()
+            self.turn_timer = None
+        if self.active and self.current_turn is not None and TURN_TIMEOUT > 0:
+            self.turn_timer = timers.schedule(TURN_TIMEOUT, turn_timed_out, self, self.current_turn, self.move_count)
+
+    def start_message(self, player_socket):
+        if free_style:
+            return 'sparse_start', self.game_start_data(player_socket)
+        return 'game_start', self.game_start_data(player_socket)
+
+    def game_start_data(self, player_socket):
+        if free_style:
+            # No board: the client asks for the stones around it with 'viewport'.
+            return {'symbol': self.symbols[player_socket], 'is_turn': (self.current_turn is player_socket),
+                    'seq': self.move_count, 'size': board_size, 'last_move': self.last_move,
+                    'opponent_name': player_names.get(self.opponent_of(player_socket), 'Đối thủ')}
+        return {
+            'symbol': self.symbols[player_socket],
+            'is_turn': (self.current_turn is player_socket),
+            'board': self.board.to_rows(),
+            'seq': self.move_count,
+            'opponent_name': player_names.get(self.opponent_of(player_socket), 'Đối thủ')
+        }
+
+    def sync_data(self):
+        return {'board': self.board.to_rows(), 'last_move': self.last_move, 'seq': self.move_count}
+
+    def resync_data(self, player_socket):
+        # Everything a resumed client needs, in one frame: game_start plus the last move and
+        # whether the round is still being played.
+        data = self.game_start_data(player_socket)
+        data['last_move'] = self.last_move
+        data['in_progress'] = self.current_turn is not None
+        data['rematch_requested'] = self.opponent_of(player_socket) in self.rematch_requests
+        return data
+
+    def viewport_data(self, top, left, rows, cols):
+        stones = {SYMBOL_X: [], SYMBOL_O: []}
+        for row, col, symbol in self.board.stones_in(top, left, rows, cols):
+            stones[symbol] += (row, col)
+        return {'top': top, 'left': left, 'rows': rows, 'cols': cols, 'seq': self.move_count,
+                'last_move': self.last_move, 'x': stones[SYMBOL_X], 'o': stones[SYMBOL_O]}
+
+    def spectate_data(self):
+        x_name, o_name = self.names
+        return {'game_id': self.game_id, 'board': None if free_style else self.board.to_rows(),
+                'size': board_size, 'last_move': self.last_move,
+                'seq': self.move_count, 'x_name': x_name, 'o_name': o_name,
+                'turn': self.symbols.get(self.current_turn), 'in_progress': self.current_turn is not None}
+
+    def watchers(self):
+        # Taken under the lock; the fan-out itself runs after the lock is released. The tuple is
+        # only rebuilt after someone starts or stops watching.
+        if self.watcher_cache is None:
+            self.watcher_cache = tuple(self.spectators.items())
+        return self.watcher_cache
+
+    def set_spectator(self, connection, binary):
+        self.spectators[connection] = binary
+        self.watcher_cache = None
+
+    def remove_spectator(self, connection):
+        if self.spectators.pop(connection, None) is not None:
+            self.watcher_cache = None
+
+    def issue_token(self, player_socket):
+        token = self.tokens[player_socket] = f"{worker_index}.{secrets.token_urlsafe(16)}"
+        resume_tokens[token] = self
+        return token
+
+    def player_with_token(self, token):
+        for player_socket, player_token in self.tokens.items():
+            if player_token == token:
+                return player_socket
+        return None
+
+    def replace_player(self, old_socket, new_socket):
+        self.players = tuple(new_socket if player_socket is old_socket else player_socket for player_socket in self.players)
+        self.symbols[new_socket] = self.symbols.pop(old_socket)
+        self.tokens[new_socket] = self.tokens.pop(old_socket)
+        if self.current_turn is old_socket:
+            self.current_turn = new_socket
+        if old_socket in self.rematch_requests:
+            self.rematch_requests.discard(old_socket)
+            self.rematch_requests.add(new_socket)
+
+    def record_round(self, result):
+        # Called with the lock held when a round ends. The writer thread does the encoding and I/O.
+        if game_log is None:
+            return
+        game_log.append(game_log.next_game_id(), self.started_at, time.time(), board_size, result, *self.names, self.moves,
+                        session_id=self.game_id)
+
+def create_new_board():
+    return SparseBoard(board_size) if free_style else Board()
 
 def check_win(board, row, col, symbol):
-    directions = [(0, 1), (1, 0), (1, 1), (1, -1)]
-    for dr, dc in directions:
-        count = 1
-        for i in range(1, WIN_CONDITION):
-            r, c = row + i * dr, col + i * dc
-            if 0 <= r < BOARD_SIZE and 0 <= c < BOARD_SIZE and board[r][c] == symbol:
-                count += 1
-            else:
-                break
-        for i in range(1, WIN_CONDITION):
-            r, c = row - i * dr, col - i * dc
-            if 0 <= r < BOARD_SIZE and 0 <= c < BOARD_SIZE and board[r][c] == symbol:
-                count += 1
-            else:
-                break
-        if count >= WIN_CONDITION:
-            return True
-    return False
+    # Only the player who just moved can have completed a line, and (row, col) is on it.
+    return board.has_five_at(row, col, symbol)
 
 def is_board_full(board):
-    for r in range(BOARD_SIZE):
-        for c in range(BOARD_SIZE):
-            if board[r][c] == EMPTY_CELL:
-                return False
-    return True
+    return board.is_full()
+
+def choose_first_player(player1_socket, player2_socket):
+    return player1_socket if rng.random() < 0.5 else player2_socket
 
 def send_to_client(client_socket, message_type, data):
-    message = {'type': message_type, 'data': data}
-    try:
-        client_socket.sendall((json.dumps(message)+ '\n').encode('utf-8'))
-    except (socket.error, BrokenPipeError) as e:
-        print(f"Lỗi gửi dữ liệu tới client {player_names.get(client_socket, client_socket.getpeername())}: {e}")
-        handle_disconnect(client_socket)
+    # Only queues the message; the connection's own writer does the socket I/O.
+    messages_sent.inc(message_type)
+    if 'binary' in player_features.get(client_socket, ()):
+        client_socket.send(message_type, encode_binary(message_type, data))
+    else:
+        client_socket.send(message_type, encode_message(message_type, data))
 
-def cleanup_game(game_id):
-    with lock:
-        if game_id in game_boards:
-            del game_boards[game_id]
-        if game_id in current_turns:
-            del current_turns[game_id]
-        if game_id in rematch_requests:
-            del rematch_requests[game_id]
-        if game_id in last_moves:
-            del last_moves[game_id]
-        if game_id in rematch_declined_flags:
-            del rematch_declined_flags[game_id]
-        p1_socket, p2_socket = None, None
-        for s1, s2 in list(game_pairs.items()):
-            if generate_game_id(s1, s2) == game_id:
-                p1_socket = s1
-                p2_socket = s2
-                break
-        if p1_socket and p2_socket:
-            if p1_socket in game_pairs:
-                del game_pairs[p1_socket]
-            if p2_socket in game_pairs:
-                del game_pairs[p2_socket]
-            if p1_socket in player_names and p1_socket not in players_in_waitlist:
-                players_in_waitlist.append(p1_socket)
-                send_to_client(p1_socket, 'wait', {'message': 'Game kết thúc. Đang chờ đối thủ mới...'})
-            if p2_socket in player_names and p2_socket not in players_in_waitlist:
-                players_in_waitlist.append(p2_socket)
-                send_to_client(p2_socket, 'wait', {'message': 'Game kết thúc. Đang chờ đối thủ mới...'})
-        if p1_socket in player_symbols:
-            del player_symbols[p1_socket]
-        if p2_socket in player_symbols:
-            del player_symbols[p2_socket]
-        if p1_socket in current_turns:
-            del current_turns[p1_socket]
-        if p2_socket in current_turns:
-            del current_turns[p2_socket]
-        print(f"Game {game_id} đã được dọn dẹp.")
+def deliver(outbox):
+    for client_socket, message_type, data in outbox:
+        send_to_client(client_socket, message_type, data)
+
+def broadcast(watchers, message_type, data):
+    # Encodes the message once per wire format and queues the same bytes on every watcher,
+    # rather than one send_to_client (and one encode) per connection.
+    if not watchers:
+        return
+    payloads = {}
+    for connection, binary in watchers:
+        payload = payloads.get(binary)
+        if payload is None:
+            payload = payloads[binary] = encode_binary(message_type, data) if binary else encode_message(message_type, data)
+        connection.send(message_type, payload)
+    messages_sent.inc(message_type, amount=len(watchers))
+
+def cleanup_game(session, leaver=None):
+    # leaver: the player whose departure ends the game; a round still being played counts as
+    # their loss.
+    with session.lock:
+        if not session.active:
+            return
+        session.active = False
+        abandoned = session.current_turn is not None
+        if abandoned:
+            session.record_round(RESULT_ABANDONED)
+        session.restart_turn_timer()
+        watchers = session.watchers()
+        session.spectators, session.watcher_cache = {}, ()
+    game_sessions.pop(session.game_id, None)
+    for connection, _ in watchers:
+        spectating.pop(connection, None)
+    broadcast(watchers, 'spectate_end', {'game_id': session.game_id, 'message': 'Trận đấu đã kết thúc.'})
+    for token in session.tokens.values():
+        resume_tokens.pop(token, None)
+    for player_socket in session.players:
+        if player_sessions.get(player_socket) is session:
+            del player_sessions[player_socket]
+    log.info("Game %s đã được dọn dẹp.", session.game_id)
+    if abandoned and leaver is not None:
+        update_ratings(session, session.opponent_of(leaver))
+    for player_socket in session.players:
+        if isinstance(player_socket, BotClient):
+            release_bot(player_socket)
+            continue
+        # Popped rather than tested first: in threaded mode expire_away_player may take it meanwhile.
+        timer = away_players.pop(player_socket, None)
+        if timer is not None:
+            timer.cancel()
+            forget_player(player_socket)  # dropped earlier and never came back; nothing to requeue
+        elif player_socket in player_names:
+            send_to_client(player_socket, 'wait', {'message': 'Game kết thúc. Đang chờ đối thủ mới...'})
+            queue_player(player_socket, avoid=session.opponent_of(player_socket))
+
+def forget_player(player_socket):
+    player_names.pop(player_socket, None)
+    player_features.pop(player_socket, None)
+    analysis_buckets.pop(player_socket, None)
+    forget_cluster_id(player_socket)
 
 def handle_disconnect(client_socket):
-    with lock:
-        username = player_names.get(client_socket, client_socket.getpeername())
-        print(f"Client {username} ({client_socket.getpeername()}) đã ngắt kết nối.")
-        if client_socket in players_in_waitlist:
-            players_in_waitlist.remove(client_socket)
-            print(f"Removed {username} from waitlist.")
-        opponent_socket = game_pairs.get(client_socket)
-        if opponent_socket:
-            game_id = generate_game_id(client_socket, opponent_socket)
-            send_to_client(opponent_socket, 'opponent_disconnected', {
-                'message': f"Đối thủ {username} đã ngắt kết nối. Trò chơi kết thúc."
-            })
-            cleanup_game(game_id)
-            print(f"Game between {username} and {player_names.get(opponent_socket, 'unknown')} ended due to disconnect.")
-        if client_socket in player_names:
-            del player_names[client_socket]
-        if client_socket in player_symbols:
-            del player_symbols[client_socket]
-        try:
-            client_socket.close()
-        except Exception as e:
-            print(f"Error closing socket for {username}: {e}")
+    username = player_names.get(client_socket, client_socket.getpeername())
+    log.info("Client %s (%s) đã ngắt kết nối.", username, client_socket.getpeername())
+    connections_open.dec()
+    session = player_sessions.get(client_socket)
+    if (session and RESUME_GRACE_SECONDS > 0 and client_socket in session.tokens
+            and 'resume' in player_features.get(client_socket, ())):
+        # Keep the seat; the game only ends if the client is not back with its token in time.
+        away_players[client_socket] = timers.schedule(RESUME_GRACE_SECONDS, expire_away_player, client_socket)
+        log.info("Giữ chỗ cho %s trong game %s thêm %ss.", username, session.game_id, RESUME_GRACE_SECONDS)
+        send_to_client(session.opponent_of(client_socket), 'opponent_away', {
+            'message': f"Đối thủ {username} bị mất kết nối. Đang chờ kết nối lại...",
+            'seconds': RESUME_GRACE_SECONDS
+        })
+    else:
+        drop_player(client_socket)
+    log.debug("Hàng đợi gửi của %s: tối đa %d tin, chờ gửi %.1f ms.", username, client_socket.max_queue_depth,
+              client_socket.send_blocked_seconds * 1000)
+    try:
+        client_socket.close()
+    except Exception as e:
+        log.warning("Error closing socket for %s: %s", username, e)
 
-def handle_client(client_socket, client_address):
-    print(f"Đã kết nối tới {client_address}")
+def drop_player(client_socket):
+    # The player is gone for good: leave the queue and end their game.
+    username = player_names.get(client_socket, client_socket.getpeername())
+    stop_watching(client_socket)
+    if matchmaker.cancel(client_socket):
+        log.info("Removed %s from waitlist.", username)
+    forget_player(client_socket)
+    session = player_sessions.get(client_socket)
+    if session:
+        opponent_socket = session.opponent_of(client_socket)
+        send_to_client(opponent_socket, 'opponent_disconnected', {
+            'message': f"Đối thủ {username} đã ngắt kết nối. Trò chơi kết thúc."
+        })
+        cleanup_game(session, leaver=client_socket)
+        log.info("Game between %s and %s ended due to disconnect.", username, player_names.get(opponent_socket, 'unknown'))
+
+def stop_watching(client_socket):
+    session = spectating.pop(client_socket, None)
+    if session:
+        with session.lock:
+            session.remove_spectator(client_socket)
+
+def watch_game(client_socket, game_id):
+    session = game_sessions.get(game_id)
+    if session is None:
+        send_to_client(client_socket, 'error', {'message': f"Không tìm thấy trận {game_id}."})
+        return
+    stop_watching(client_socket)
+    matchmaker.cancel(client_socket)
+    spectating[client_socket] = session
+    with session.lock:
+        if not session.active:
+            spectating.pop(client_socket, None)
+            send_to_client(client_socket, 'error', {'message': f"Không tìm thấy trận {game_id}."})
+            return
+        session.set_spectator(client_socket, 'binary' in player_features.get(client_socket, ()))
+        # Queued under the lock so no move_made fan-out can overtake the snapshot.
+        send_to_client(client_socket, 'spectate_start', session.spectate_data())
+    log.info("%s đang xem game %s (%d người xem).", player_names.get(client_socket, client_socket.getpeername()),
+             game_id, len(session.spectators))
+
+def list_games():
+    games = []
+    # A copy: in threaded mode other handlers and the timer thread add and remove games meanwhile.
+    for session in list(game_sessions.values())[:GAME_LIST_LIMIT]:
+        x_name, o_name = session.names
+        games.append({'game_id': session.game_id, 'x_name': x_name, 'o_name': o_name,
+                      'seq': session.move_count, 'spectators': len(session.spectators)})
+    return games
+
+def expire_away_player(player_socket):
+    if away_players.pop(player_socket, None) is not None:
+        log.info("%s không kết nối lại kịp.", player_names.get(player_socket, player_socket.getpeername()))
+        resumes_total.inc('expired')
+        drop_player(player_socket)
+
+def start_heartbeat(client_socket):
+    if PING_INTERVAL > 0:
+        client_socket.heartbeat_timer = timers.schedule(PING_INTERVAL, check_heartbeat, client_socket)
+
+def held_to_idle_timeout(client_socket):
+    # Clients without 'heartbeat' never answer pings, so only their failed reads and writes end
+    # them, unless they never even logged in.
+    if 'heartbeat' in player_features.get(client_socket, ()):
+        return True
+    return client_socket not in player_names and client_socket not in spectating
+
+def check_heartbeat(client_socket):
+    if client_socket.closed:
+        return
+    idle = time.monotonic() - client_socket.last_seen
+    if IDLE_TIMEOUT > 0 and idle >= IDLE_TIMEOUT and held_to_idle_timeout(client_socket):
+        log.info("%s im lặng %.0fs, ngắt kết nối.", player_names.get(client_socket, client_socket.getpeername()), idle)
+        reaped_total.inc()
+        client_socket.abort()  # the read loop then runs handle_disconnect
+        return
+    if idle >= PING_INTERVAL:
+        send_to_client(client_socket, 'ping', {})
+    delay = PING_INTERVAL if IDLE_TIMEOUT <= 0 else min(PING_INTERVAL, max(IDLE_TIMEOUT - idle, timers.tick))
+    client_socket.heartbeat_timer = timers.schedule(delay, check_heartbeat, client_socket)
+
+def turn_timed_out(session, player_socket, move_count):
+    outbox = []
+    with session.lock:
+        if not session.active or session.current_turn is not player_socket or session.move_count != move_count:
+            return  # a move or a cleanup got there first
+        opponent_socket = session.opponent_of(player_socket)
+        symbol = session.symbols[opponent_socket]
+        session.current_turn = None
+        session.turn_timer = None
+        session.record_round(RESULT_X_WON if symbol == SYMBOL_X else RESULT_O_WON)
+        loser_name = player_names.get(player_socket, 'Đối thủ')
+        winner_name = player_names.get(opponent_socket, 'Đối thủ')
+        outbox.append((player_socket, 'game_over', {'winner': False, 'message': "Hết giờ! Bạn bị xử thua ván này."}))
+        outbox.append((opponent_socket, 'game_over', {'winner': True, 'message': f"{loser_name} đã hết giờ. Bạn thắng!"}))
+        watchers = session.watchers()
+    log.info("%s hết giờ, %s thắng. Game ID: %s", loser_name, winner_name, session.game_id)
+    turn_timeouts_total.inc()
+    deliver(outbox)
+    broadcast(watchers, 'spectate_over', {'winner': symbol, 'message': f"{loser_name} hết giờ, {winner_name} ({symbol}) thắng!"})
+    update_ratings(session, opponent_socket)
+
+def resume_session(client_socket, token):
+    session = resume_tokens.get(token)
+    old_socket = session.player_with_token(token) if session else None
+    if old_socket is None or old_socket is client_socket:
+        resumes_total.inc('failed')
+        send_to_client(client_socket, 'resume_failed', {'message': 'Phiên chơi đã hết hạn. Đang tìm đối thủ mới...'})
+        return
+    if client_socket in player_sessions:
+        # Taking another seat would leave this connection's own game without a player.
+        resumes_total.inc('failed')
+        send_to_client(client_socket, 'resume_failed', {'message': 'Bạn đang trong một trận đấu khác.'})
+        return
+    # old_socket may still look connected if the server never saw the drop; it is closed below
+    # and its read loop then finds nothing left to clean up.
+    timer = away_players.pop(old_socket, None)
+    if timer is not None:
+        timer.cancel()
+    matchmaker.cancel(client_socket)
+    with session.lock:
+        session.replace_player(old_socket, client_socket)
+        data = session.resync_data(client_socket)
+        opponent_socket = session.opponent_of(client_socket)
+    username = player_names.pop(old_socket, None) or player_names.get(client_socket, '')
+    player_names[client_socket] = username
+    player_features.pop(old_socket, None)
+    analysis_buckets.pop(old_socket, None)
+    forget_cluster_id(old_socket)
+    player_sessions.pop(old_socket, None)
+    player_sessions[client_socket] = session
+    old_socket.close()
+    resumes_total.inc('resumed')
+    log.info("%s đã kết nối lại vào game %s.", username, session.game_id)
+    send_to_client(client_socket, 'resync', data)
+    send_to_client(opponent_socket, 'opponent_back', {'message': f"Đối thủ {username} đã kết nối lại."})
+
+def take_analysis_token(client_socket):
+    # Token bucket; called with analysis_lock held.
+    now = time.monotonic()
+    tokens, refilled = analysis_buckets.get(client_socket, (ANALYSIS_BURST, now))
+    tokens = min(ANALYSIS_BURST, tokens + (now - refilled) * ANALYSIS_RATE)
+    if tokens < 1:
+        analysis_buckets[client_socket] = (tokens, now)
+        return False
+    analysis_buckets[client_socket] = (tokens - 1, now)
+    return True
+
+def request_analysis(client_socket, moves, seq, top):
+    key = position_key(moves)
+    submit = False
+    with analysis_lock:
+        result = analysis_cache.get(key)
+        if result is not None:
+            outcome = 'hit'
+        elif key in analysis_inflight:
+            outcome = 'joined'
+            analysis_inflight[key].append((client_socket, seq, top))
+        elif not take_analysis_token(client_socket):
+            outcome = 'limited'
+        elif len(analysis_inflight) >= ANALYSIS_QUEUE_LIMIT:
+            outcome = 'busy'
+        else:
+            outcome, submit = 'evaluated', True
+            analysis_inflight[key] = [(client_socket, seq, top)]
+    analysis_requests.inc(outcome)
+    if result is not None:
+        send_analysis(client_socket, seq, top, result, True)
+    elif outcome == 'limited':
+        send_to_client(client_socket, 'error', {'message': 'Bạn yêu cầu phân tích quá nhanh, hãy chờ một chút.'})
+    elif outcome == 'busy':
+        send_to_client(client_socket, 'error', {'message': 'Server đang bận phân tích, hãy thử lại sau.'})
+    elif submit:
+        started = time.perf_counter()
+        future = analysis_pool.submit(analyze_position, moves, book_path=opening_book)
+        future.add_done_callback(lambda done: call_in_server(finish_analysis, key, done, started))
+
+def finish_analysis(key, future, started):
+    analysis_seconds.observe(time.perf_counter() - started)
+    try:
+        result = future.result()
+    except Exception as e:
+        log.error("Lỗi khi phân tích thế cờ %x: %s", key, e)
+        result = None
+    with analysis_lock:
+        waiters = analysis_inflight.pop(key, ())
+        if result is not None:
+            analysis_cache.put(key, result)
+    for client_socket, seq, top in waiters:
+        if client_socket.closed:
+            continue
+        if result is None:
+            send_to_client(client_socket, 'error', {'message': 'Không phân tích được thế cờ này.'})
+        else:
+            send_analysis(client_socket, seq, top, result, False)
+
+def send_analysis(client_socket, seq, top, result, cached):
+    send_to_client(client_socket, 'analysis', {
+        'seq': seq, 'to_move': result['to_move'], 'score': result['score'], 'cached': cached,
+        'moves': [{'row': row, 'col': col, 'score': score, 'pattern': pattern}
+                  for row, col, score, pattern in result['moves'][:top]]
+    })
+
+def open_session(player1_socket, player2_socket):
+    # Called by the matchmaker while it holds its lock.
+    session = GameSession(next(game_ids), player1_socket, player2_socket)
+    session.start_round(choose_first_player(player1_socket, player2_socket))
+    game_sessions[session.game_id] = session
+    player_sessions[player1_socket] = session
+    player_sessions[player2_socket] = session
+    return session
+
+matchmaker = Matchmaker(open_session, is_busy=lambda player_socket: player_socket in player_sessions,
+                        lock=TimedLock(lock_wait_seconds, lock_hold_seconds, 'matchmaker'))
+
+def rating_of(player_socket):
+    return player_ratings.get(player_names.get(player_socket), DEFAULT_RATING)
+
+def queue_player(player_socket, avoid=None):
+    if not matchmaker.enqueue(player_socket, rating_of(player_socket), avoid=avoid):
+        return
+    session = matchmaker.find_match(player_socket)
+    if session:
+        announce_game(session)
+
+def run_matchmaking_pass():
+    for session in matchmaker.run_pass():
+        announce_game(session)
+    if bot_pool is not None:
+        for player_socket in matchmaker.overdue(BOT_WAIT_SECONDS):
+            pair_with_bot(player_socket)
+
+def call_in_server(func, *args):
+    # Worker pool callbacks arrive on a pool thread; in asyncio mode handlers must run on the loop.
+    if server_loop is not None:
+        server_loop.call_soon_threadsafe(func, *args)
+    else:
+        func(*args)
+
+def bot_reply(bot, message):
+    call_in_server(handle_message, bot, bot.getpeername(), message)
+
+def pair_with_bot(player_socket):
+    bot = BotClient(next(bot_ids), bot_pool, bot_reply, BOT_TIME_BUDGET, opening_book)
+    player_names[bot] = BOT_NAME
+    player_features[bot] = {'delta'}
+    session = matchmaker.pair_with(player_socket, bot)
+    if session:
+        announce_game(session)
+    else:
+        release_bot(bot)
+
+def release_bot(bot):
+    player_names.pop(bot, None)
+    player_features.pop(bot, None)
+    bot.close()
+
+def cluster_id_of(player_socket):
+    player_id = cluster_ids.get(player_socket)
+    if player_id is None:
+        player_id = cluster_ids[player_socket] = next(next_cluster_ids)
+        cluster_players[player_id] = player_socket
+    return player_id
+
+def forget_cluster_id(player_socket):
+    player_id = cluster_ids.pop(player_socket, None)
+    if player_id is not None:
+        del cluster_players[player_id]
+
+def report_waiting():
+    # The full list every pass, so a report lost to a hand-off that fell through heals itself.
+    players = []
+    for player_socket in matchmaker.overdue(CLUSTER_WAIT_SECONDS)[:SNAPSHOT_LIMIT]:
+        # A rematch that was just declined keeps the pair apart here; the matchmaker must know too.
+        avoided = matchmaker.avoided(player_socket)
+        avoided_id = cluster_id_of(avoided) if avoided in player_names and not isinstance(avoided, BotClient) else None
+        players.append([cluster_id_of(player_socket), rating_of(player_socket), avoided_id])
+    try:
+        cluster_link.send('waiting', {'players': players})
+    except OSError as e:
+        log.warning("Không gửi được danh sách chờ tới matchmaker: %s", e)
+
+def handle_cluster_message(message, fds):
+    msg_type = message.get('type')
+    msg_data = message.get('data')
+    if msg_type == 'pair':
+        first, second = (cluster_players.get(player_id) for player_id in msg_data['players'])
+        if first is not None and second is not None and matchmaker.cancel(second):
+            session = matchmaker.pair_with(first, second)
+            if session:
+                announce_game(session)
+            else:
+                queue_player(second)
+    elif msg_type == 'hand_off':
+        # Players who were paired here or left since the report stay put; the matchmaker hears
+        # about their partner again in the next report.
+        player_socket = cluster_players.get(msg_data['player'])
+        if player_socket is not None and not player_socket.closed and matchmaker.cancel(player_socket):
+            player_socket.handoff = (msg_data['to'], msg_data['partner'], None)
+            player_socket.stop_reading()
+    elif msg_type == 'adopt':
+        if fds:
+            server_loop.create_task(adopt_player(msg_data, fds[0]))
+        else:
+            log.warning("Tin adopt không kèm socket.")
+
+async def hand_off(client_socket):
+    # Runs once the read loop of a player picked for a hand-off has stopped. Returns False if the
+    # connection could not be handed over, in which case it is treated as disconnected.
+    worker, partner, replay = client_socket.handoff
+    decoder = client_socket.decoder
+    username = player_names.get(client_socket)
+    state = {'username': username, 'features': sorted(player_features.get(client_socket, ())),
+             'rating': rating_of(client_socket), 'buffer': bytes(decoder.buffer).hex(),
+             'binary': decoder.binary, 'negotiating': decoder.negotiating, 'replay': replay}
+    username = username or client_socket.getpeername()  # for the log lines below
+    try:
+        fd = await client_socket.detach()
+    except (ConnectionError, OSError) as e:
+        log.warning("Không chuyển được %s sang worker %s: %s", username, worker, e)
+        return False
+    try:
+        cluster_link.send('transfer', {'to': worker, 'partner': partner, 'state': state}, [fd])
+    except OSError as e:
+        log.warning("Không chuyển được %s sang worker %s: %s", username, worker, e)
+        return False
+    finally:
+        os.close(fd)
+    log.info("Đã chuyển %s sang worker %s.", username, worker)
+    connections_open.dec()
+    # serve_stream skips handle_disconnect after a hand-off, so everything drop_player would
+    # clear goes here, or the connection would stay queued here as a player nobody can reach.
+    matchmaker.cancel(client_socket)
+    stop_watching(client_socket)
+    forget_player(client_socket)
+    return True
+
+async def adopt_player(data, fd):
+    state = data['state']
+    reader, writer = await asyncio.open_connection(sock=socket.socket(fileno=fd))
+    client_socket = StreamClient(writer, reader)
+    client_socket.decoder.buffer += bytes.fromhex(state['buffer'])
+    client_socket.decoder.binary = state['binary']
+    client_socket.decoder.negotiating = state['negotiating']
+    if state['username'] is not None:
+        player_names[client_socket] = state['username']
+        player_ratings.setdefault(state['username'], state['rating'])
+    player_features[client_socket] = set(state['features'])
+    connections_open.inc()
+    start_heartbeat(client_socket)
+    log.info("Nhận %s từ worker khác.", state['username'] or client_socket.getpeername())
+    if state.get('replay'):
+        # A connection sent here by the worker that read its first message, e.g. a 'resume'
+        # whose game lives in this worker.
+        handle_message(client_socket, client_socket.getpeername(), state['replay'])
+    else:
+        partner = cluster_players.get(data['partner'])
+        session = matchmaker.pair_with(partner, client_socket) if partner is not None else None
+        if session:
+            announce_game(session)
+        else:
+            queue_player(client_socket)
+    await serve_stream(client_socket, reader)
+
+def update_ratings(session, winner_socket):
+    # Names come from the round, so a player who has already disconnected is still rated. Bot
+    # seats are neither rated nor recorded (every bot shares BOT_NAME); their human opponent
+    # plays them as a DEFAULT_RATING player.
+    seats = []
+    for player_socket in session.players:
+        name = session.names[0 if session.symbols.get(player_socket) == SYMBOL_X else 1]
+        score = 0.5 if winner_socket is None else (1.0 if winner_socket is player_socket else 0.0)
+        if isinstance(player_socket, BotClient):
+            seats.append((None, DEFAULT_RATING, score))
+        elif not name:
+            return
+        else:
+            seats.append((name, player_ratings.get(name, DEFAULT_RATING), score))
+    (name1, rating1, score1), (name2, rating2, score2) = seats
+    for name, rating, opponent_rating, score in ((name1, rating1, rating2, score1), (name2, rating2, rating1, score2)):
+        if name is None:
+            continue
+        player_ratings[name] = elo_update(rating, opponent_rating, score)
+        leaderboard.update(name, player_ratings[name], score)
+        if stats_store is not None:
+            stats_store.record(name, player_ratings[name] - rating, score)
+
+def announce_game(session):
+    with session.lock:
+        outbox = []
+        for player_socket in session.players:
+            if 'resume' in player_features.get(player_socket, ()):
+                outbox.append((player_socket, 'session', {'token': session.issue_token(player_socket),
+                                                          'grace': RESUME_GRACE_SECONDS}))
+            outbox.append((player_socket, *session.start_message(player_socket)))
+        player1_socket, player2_socket = session.players
+        log.info("Trò chơi bắt đầu giữa %s (%s) và %s (%s). Game ID: %s", player_names.get(player1_socket),
+                 session.symbols[player1_socket], player_names.get(player2_socket), session.symbols[player2_socket],
+                 session.game_id)
+    deliver(outbox)
+
+# The types handle_message answers. Metric labels use only these, so a client inventing types
+# cannot add series without bound.
+MESSAGE_TYPES = frozenset(('username_set', 'resume', 'watch', 'unwatch', 'list_games', 'move', 'place', 'sync_request',
+                           'viewport', 'analyze', 'leaderboard', 'chat', 'rematch_request', 'rematch_declined',
+                           'rematch_start', 'protocol', 'ping', 'pong'))
+
+def message_label(message):
+    msg_type = message.get('type')
+    return msg_type if isinstance(msg_type, str) and msg_type in MESSAGE_TYPES else 'other'
+
+def handle_message(client_socket, client_address, message):
+    msg_type = message.get('type')
+    msg_data = message.get('data')
+    current_username = player_names.get(client_socket, client_address)
+    messages_received.inc(message_label(message))
+    log.debug("Nhận được từ %s: %s - %s", current_username, msg_type, msg_data)
+
+    if msg_type == 'username_set':
+        username = msg_data['username']
+        player_names[client_socket] = username
+        negotiate_features(client_socket, msg_data)
+        stop_watching(client_socket)
+        if free_style and not {'sparse', 'delta'} <= player_features[client_socket]:
+            send_to_client(client_socket, 'error', {'message': "Server đang chơi bàn cờ tự do; client cần hỗ trợ 'sparse'."})
+            return
+        if client_socket not in matchmaker and client_socket not in player_sessions:
+            log.info("Client %s đã đặt tên người dùng là: %s. Đã thêm vào danh sách chờ.", client_address, username)
+            send_to_client(client_socket, 'wait', {'message': f"Chào mừng {username}! Đang chờ đối thủ..."})
+            queue_player(client_socket)
+        else:
+            send_to_client(client_socket, 'wait', {'message': f"Chào mừng {username}! Bạn đang chờ hoặc đã trong game."})
+
+    elif msg_type == 'resume':
+        token = str(msg_data.get('token', ''))
+        owner = token.partition('.')[0]
+        if (cluster_link is not None and owner.isdigit() and int(owner) != worker_index
+                and client_socket not in player_sessions):
+            # The game lives in the worker that issued the token; the connection moves there and
+            # this message is handled again on arrival. It leaves the queue and any game it watches
+            # here first, or it would stay behind as a player nobody can reach.
+            matchmaker.cancel(client_socket)
+            stop_watching(client_socket)
+            client_socket.handoff = (int(owner), None, message)
+            client_socket.stop_reading()
+            return
+        negotiate_features(client_socket, msg_data)
+        resume_session(client_socket, token)
+
+    elif msg_type == 'watch':
+        game_id = msg_data.get('game_id')
+        if not isinstance(game_id, int) or game_id < 1:
+            send_to_client(client_socket, 'error', {'message': 'Mã trận không hợp lệ.'})
+            return
+        owner = (game_id - 1) % worker_count
+        if cluster_link is not None and owner != worker_index and client_socket not in player_sessions:
+            # Game ids are striped across workers; move the connection to the one hosting the game.
+            matchmaker.cancel(client_socket)
+            stop_watching(client_socket)
+            client_socket.handoff = (owner, None, message)
+            client_socket.stop_reading()
+            return
+        if client_socket in player_sessions:
+            send_to_client(client_socket, 'error', {'message': 'Bạn đang trong một trận đấu.'})
+            return
+        negotiate_features(client_socket, msg_data)
+        if 'delta' not in player_features[client_socket]:
+            send_to_client(client_socket, 'error', {'message': "Xem trận cần client hỗ trợ 'delta'."})
+            return
+        if free_style and 'sparse' not in player_features[client_socket]:
+            send_to_client(client_socket, 'error', {'message': "Server đang chơi bàn cờ tự do; client cần hỗ trợ 'sparse'."})
+            return
+        watch_game(client_socket, game_id)
+
+    elif msg_type == 'unwatch':
+        stop_watching(client_socket)
+
+    elif msg_type == 'list_games':
+        send_to_client(client_socket, 'games', {'games': list_games()})
+
+    elif msg_type == 'move' or msg_type == 'place':
+        started = time.perf_counter()
+        row = msg_data['row']
+        col = msg_data['col']
+        session = player_sessions.get(client_socket)
+        if not session:
+            send_to_client(client_socket, 'error', {'message': 'Bạn chưa vào game hoặc game đã kết thúc.'})
+            return
+        outbox = []
+        watchers, spectator_messages = (), []
+        finished, winner_socket = False, None
+        with session.lock:
+            opponent_socket = session.opponent_of(client_socket)
+            board = session.board
+            symbol = session.symbols.get(client_socket)
+            if not session.active:
+                outbox.append((client_socket, 'error', {'message': 'Bạn chưa vào game hoặc game đã kết thúc.'}))
+            elif session.current_turn is not client_socket:
+                outbox.append((client_socket, 'error', {'message': 'Chưa đến lượt của bạn.'}))
+            elif not board or not symbol:
+                outbox.append((client_socket, 'error', {'message': 'Dữ liệu game không hợp lệ.'}))
+            elif board.in_bounds(row, col) and board.is_empty(row, col):
+                board.place(row, col, symbol)
+                session.last_move = {'row': row, 'col': col}
+                session.move_count += 1
+                session.moves.append((row, col, int((time.monotonic() - session.started_clock) * 1000)))
+                session.current_turn = opponent_socket
+                delta = {'row': row, 'col': col, 'symbol': symbol, 'seq': session.move_count}
+                delta_type = 'stone' if free_style else 'move_made'
+                watchers = session.watchers()
+                spectator_messages.append((delta_type, delta))
+                update = None
+                for player_socket in (client_socket, opponent_socket):
+                    if 'delta' in player_features.get(player_socket, ()):
+                        outbox.append((player_socket, delta_type, delta))
+                    else:
+                        update = update or {'board': board.to_rows(), 'last_move': session.last_move}
+                        outbox.append((player_socket, 'update_board', update))
+                if check_win(board, row, col, symbol):
+                    session.current_turn = None
+                    finished, winner_socket = True, client_socket
+                    session.record_round(RESULT_X_WON if symbol == SYMBOL_X else RESULT_O_WON)
+                    winner_name = player_names.get(client_socket, client_address[0])
+                    log.info("Người chơi %s (%s) thắng! Game ID: %s", winner_name, symbol, session.game_id)
+                    outbox.append((client_socket, 'game_over', {'winner': True, 'message': f"Bạn đã thắng! Chúc mừng, {winner_name}!"}))
+                    outbox.append((opponent_socket, 'game_over', {'winner': False, 'message': f"Bạn đã thua cuộc! {winner_name} là người thắng."}))
+                    spectator_messages.append(('spectate_over', {'winner': symbol, 'message': f"{winner_name} ({symbol}) thắng!"}))
+                elif is_board_full(board):
+                    session.current_turn = None
+                    finished = True
+                    session.record_round(RESULT_DRAW)
+                    log.info("Game hòa! Bàn cờ đã đầy. Game ID: %s", session.game_id)
+                    message = "Hòa! Bàn cờ đã đầy."
+                    outbox.append((client_socket, 'game_over', {'winner': None, 'message': message}))
+                    outbox.append((opponent_socket, 'game_over', {'winner': None, 'message': message}))
+                    spectator_messages.append(('spectate_over', {'winner': None, 'message': message}))
+                else:
+                    outbox.append((opponent_socket, 'your_turn', {}))
+                    outbox.append((client_socket, 'wait_turn', {}))
+                session.restart_turn_timer()
+            else:
+                outbox.append((client_socket, 'error', {'message': 'Ô đã có người hoặc không hợp lệ.'}))
+        deliver(outbox)
+        for message_type, data in spectator_messages:
+            broadcast(watchers, message_type, data)
+        move_seconds.observe(time.perf_counter() - started)
+        if finished:
+            update_ratings(session, winner_socket)
+
+    elif msg_type == 'sync_request':
+        session = player_sessions.get(client_socket) or spectating.get(client_socket)
+        if not session:
+            send_to_client(client_socket, 'error', {'message': 'Bạn chưa vào game hoặc game đã kết thúc.'})
+            return
+        if free_style:
+            send_to_client(client_socket, 'error', {'message': "Bàn cờ tự do không gửi cả bàn; hãy dùng 'viewport'."})
+            return
+        with session.lock:
+            data = session.sync_data()
+        send_to_client(client_socket, 'board_sync', data)
+
+    elif msg_type == 'viewport':
+        # Free-style boards only: the stones inside a window of at most VIEWPORT_LIMIT squared cells.
+        session = player_sessions.get(client_socket) or spectating.get(client_socket)
+        if not session or not free_style:
+            send_to_client(client_socket, 'error', {'message': 'Bạn chưa vào game hoặc game đã kết thúc.'})
+            return
+        top, left = msg_data.get('top'), msg_data.get('left')
+        rows, cols = msg_data.get('rows', VIEWPORT_LIMIT), msg_data.get('cols', VIEWPORT_LIMIT)
+        if not all(type(value) is int for value in (top, left, rows, cols)) or rows < 1 or cols < 1:
+            send_to_client(client_socket, 'error', {'message': 'Vùng nhìn không hợp lệ.'})
+            return
+        rows, cols = min(rows, VIEWPORT_LIMIT), min(cols, VIEWPORT_LIMIT)
+        with session.lock:
+            data = session.viewport_data(top, left, rows, cols)
+        send_to_client(client_socket, 'viewport', data)
+
+    elif msg_type == 'analyze':
+        # Best moves and a score for the current position of the sender's game, or with 'seq'
+        # for the position after that many moves of the round (post-game review).
+        session = player_sessions.get(client_socket) or spectating.get(client_socket)
+        if not session:
+            send_to_client(client_socket, 'error', {'message': 'Bạn chưa vào game hoặc game đã kết thúc.'})
+            return
+        if analysis_pool is None:
+            send_to_client(client_socket, 'error', {'message': 'Server không bật phân tích thế cờ.'})
+            return
+        top, seq = msg_data.get('top', 5), msg_data.get('seq')
+        if type(top) is not int or top < 1 or (seq is not None and type(seq) is not int):
+            send_to_client(client_socket, 'error', {'message': 'Yêu cầu phân tích không hợp lệ.'})
+            return
+        with session.lock:
+            if seq is None:
+                seq = len(session.moves)
+            moves = tuple((row, col) for row, col, _ in session.moves[:max(seq, 0)])
+        if not 0 <= seq <= len(session.moves):
+            send_to_client(client_socket, 'error', {'message': 'Không có nước đi đó trong ván này.'})
+            return
+        request_analysis(client_socket, moves, seq, min(top, TOP_MOVES))
+
+    elif msg_type == 'leaderboard':
+        limit = msg_data.get('limit', 10)
+        if type(limit) is not int or limit < 1:
+            send_to_client(client_socket, 'error', {'message': 'Yêu cầu bảng xếp hạng không hợp lệ.'})
+            return
+        username = player_names.get(client_socket)
+        send_to_client(client_socket, 'leaderboard', {'players': leaderboard.top()[:limit],
+                                                      'you': leaderboard.entry(username) if username else None})
+
+    elif msg_type == 'chat':
+        message_content = msg_data['message']
+        sender_name = msg_data.get('sender', 'Người lạ')
+        session = player_sessions.get(client_socket)
+        if session:
+            opponent_socket = session.opponent_of(client_socket)
+            send_to_client(opponent_socket, 'chat', {'message': message_content, 'sender': sender_name})
+            log.debug("Chat từ %s tới %s: %s", sender_name, player_names.get(opponent_socket, 'opponent'), message_content)
+        else:
+            log.debug("Chat từ %s: %s (không tìm thấy đối thủ).", sender_name, message_content)
+            send_to_client(client_socket, 'error', {'message': 'Không tìm thấy đối thủ để chat.'})
+
+    # --- Rematch logic ---
+    elif msg_type == 'rematch_request':
+        session = player_sessions.get(client_socket)
+        if not session:
+            send_to_client(client_socket, 'error', {'message': 'Không tìm thấy đối thủ để đấu lại.'})
+            return
+        outbox = []
+        watchers = ()
+        with session.lock:
+            if session.current_turn is not None:
+                # Rematch answers only make sense once a round is over; this one is a late
+                # reply to the previous game that reached a freshly paired session.
+                return
+            opponent_socket = session.opponent_of(client_socket)
+            session.rematch_requests.add(client_socket)
+            outbox.append((opponent_socket, 'rematch_request', {}))
+            # If both players requested rematch, start new game
+            if len(session.rematch_requests) == 2:
+                outbox.append((client_socket, 'rematch_start', {}))
+                outbox.append((opponent_socket, 'rematch_start', {}))
+                session.start_round(choose_first_player(client_socket, opponent_socket))
+                outbox.append((client_socket, *session.start_message(client_socket)))
+                outbox.append((opponent_socket, *session.start_message(opponent_socket)))
+                watchers, snapshot = session.watchers(), session.spectate_data()
+        deliver(outbox)
+        if watchers:
+            broadcast(watchers, 'spectate_start', snapshot)
+
+    elif msg_type == 'rematch_declined':
+        session = player_sessions.get(client_socket)
+        if not session:
+            return
+        with session.lock:
+            round_over = session.current_turn is None
+        if not round_over:
+            return
+        send_to_client(session.opponent_of(client_socket), 'rematch_declined', {})
+        # One refusal ends the pairing: both clients go back to waiting as soon as it is declined.
+        cleanup_game(session)
+
+    elif msg_type == 'rematch_start':
+        pass
+
+    elif msg_type == 'protocol':
+        pass  # the connection's decoder has already switched to binary frames
+
+    elif msg_type == 'ping':
+        send_to_client(client_socket, 'pong', {})
+
+    elif msg_type == 'pong':
+        pass  # the read loop has already noted that the client is alive
+
+def negotiate_features(client_socket, msg_data):
+    features = set(msg_data.get('features', ())) & SUPPORTED_FEATURES
+    if 'binary' in player_features.get(client_socket, ()):
+        features.add('binary')  # once switched, the stream stays binary
+    elif 'features' in msg_data:
+        # Clients that announce features learn which ones were accepted. When binary was
+        # accepted this is the last JSON line they get, and their 'protocol' reply switches
+        # our decoder.
+        send_to_client(client_socket, 'protocol', {'features': sorted(features)})
+        client_socket.decoder.negotiating = 'binary' in features
+    player_features[client_socket] = features
+
+def welcome_client(client_socket, client_address):
+    log.info("Đã kết nối tới %s", client_address)
+    connections_open.inc()
+    connections_total.inc()
+    start_heartbeat(client_socket)
     send_to_client(client_socket, 'wait', {'message': 'Chào mừng bạn! Vui lòng nhập tên người dùng để bắt đầu.'})
+
+def handle_client(client_socket, client_address):
+    welcome_client(client_socket, client_address)
     try:
-        buffer = ""
         while True:
-            data = client_socket.recv(4096).decode('utf-8')
+            data = client_socket.recv(RECV_SIZE)
             if not data:
                 break
-            buffer += data
-            while '\n' in buffer:
-                message_str, buffer = buffer.split('\n', 1)
-                if not message_str.strip():
-                    continue
-                try:
-                    message = json.loads(message_str)
-                except Exception as e:
-                    print(f"Lỗi JSON không hợp lệ từ {client_address}: {e}")
-                    continue
-                msg_type = message.get('type')
-                msg_data = message.get('data')
-                current_username = player_names.get(client_socket, client_address)
-                print(f"Nhận được từ {current_username}: {msg_type} - {msg_data}")
-
-                if msg_type == 'username_set':
-                    username = msg_data['username']
-                    with lock:
-                        player_names[client_socket] = username
-                        if client_socket not in players_in_waitlist and client_socket not in game_pairs:
-                            players_in_waitlist.append(client_socket)
-                            print(f"Client {client_address} đã đặt tên người dùng là: {username}. Đã thêm vào danh sách chờ.")
-                            send_to_client(client_socket, 'wait', {'message': f"Chào mừng {username}! Đang chờ đối thủ..."})
-                        else:
-                            send_to_client(client_socket, 'wait', {'message': f"Chào mừng {username}! Bạn đang chờ hoặc đã trong game."})
-                        if len(players_in_waitlist) >= 2:
-                            player1_socket = players_in_waitlist.pop(0)
-                            player2_socket = players_in_waitlist.pop(0)
-                            if not player_names.get(player1_socket) or not player_names.get(player2_socket):
-                                print("Một trong hai người chơi chờ đã ngắt kết nối. Đang tìm người khác.")
-                                if player_names.get(player1_socket) and player1_socket not in players_in_waitlist:
-                                    players_in_waitlist.insert(0, player1_socket)
-                                elif player_names.get(player2_socket) and player2_socket not in players_in_waitlist:
-                                    players_in_waitlist.insert(0, player2_socket)
-                                continue
-                            player1_name = player_names[player1_socket]
-                            player2_name = player_names[player2_socket]
-                            game_id = generate_game_id(player1_socket, player2_socket)
-                            game_boards[game_id] = create_new_board()
-                            last_moves[game_id] = None
-                            game_pairs[player1_socket] = player2_socket
-                            game_pairs[player2_socket] = player1_socket
-                            rematch_requests[game_id] = set()
-                            rematch_declined_flags[game_id] = set()
-                            first_player_socket = player1_socket if time.time() % 2 < 1 else player2_socket
-                            current_turns[game_id] = first_player_socket
-                            symbol1 = SYMBOL_X if first_player_socket == player1_socket else SYMBOL_O
-                            symbol2 = SYMBOL_O if first_player_socket == player1_socket else SYMBOL_X
-                            player_symbols[player1_socket] = symbol1
-                            player_symbols[player2_socket] = symbol2
-                            print(f"Trò chơi bắt đầu giữa {player1_name} ({symbol1}) và {player2_name} ({symbol2}). Game ID: {game_id}")
-                            send_to_client(player1_socket, 'game_start', {
-                                'symbol': symbol1,
-                                'is_turn': (first_player_socket == player1_socket),
-                                'board': game_boards[game_id],
-                                'opponent_name': player2_name
-                            })
-                            send_to_client(player2_socket, 'game_start', {
-                                'symbol': symbol2,
-                                'is_turn': (first_player_socket == player2_socket),
-                                'board': game_boards[game_id],
-                                'opponent_name': player1_name
-                            })
-
-                elif msg_type == 'move':
-                    row = msg_data['row']
-                    col = msg_data['col']
-                    with lock:
-                        opponent_socket = game_pairs.get(client_socket)
-                        if not opponent_socket:
-                            send_to_client(client_socket, 'error', {'message': 'Bạn chưa vào game hoặc game đã kết thúc.'})
-                            continue
-                        game_id = generate_game_id(client_socket, opponent_socket)
-                        if current_turns.get(game_id) != client_socket:
-                            send_to_client(client_socket, 'error', {'message': 'Chưa đến lượt của bạn.'})
-                            continue
-                        board = game_boards.get(game_id)
-                        symbol = player_symbols.get(client_socket)
-                        if not board or not symbol:
-                            send_to_client(client_socket, 'error', {'message': 'Dữ liệu game không hợp lệ.'})
-                            continue
-                        if 0 <= row < BOARD_SIZE and 0 <= col < BOARD_SIZE and board[row][col] == EMPTY_CELL:
-                            board[row][col] = symbol
-                            last_moves[game_id] = {'row': row, 'col': col}
-                            current_turns[game_id] = opponent_socket
-                            send_to_client(client_socket, 'update_board', {'board': board, 'last_move': last_moves[game_id]})
-                            send_to_client(opponent_socket, 'update_board', {'board': board, 'last_move': last_moves[game_id]})
-                            if check_win(board, row, col, symbol):
-                                winner_name = player_names.get(client_socket, client_address[0])
-                                loser_name = player_names.get(opponent_socket, opponent_socket.getpeername()[0])
-                                print(f"Người chơi {winner_name} ({symbol}) thắng! Game ID: {game_id}")
-                                send_to_client(client_socket, 'game_over', {'winner': True, 'message': f"Bạn đã thắng! Chúc mừng, {winner_name}!"})
-                                send_to_client(opponent_socket, 'game_over', {'winner': False, 'message': f"Bạn đã thua cuộc! {winner_name} là người thắng."})
-                            elif is_board_full(board):
-                                print(f"Game hòa! Bàn cờ đã đầy. Game ID: {game_id}")
-                                message = "Hòa! Bàn cờ đã đầy."
-                                send_to_client(client_socket, 'game_over', {'winner': None, 'message': message})
-                                send_to_client(opponent_socket, 'game_over', {'winner': None, 'message': message})
-                            else:
-                                send_to_client(opponent_socket, 'your_turn', {})
-                                send_to_client(client_socket, 'wait_turn', {})
-                        else:
-                            send_to_client(client_socket, 'error', {'message': 'Ô đã có người hoặc không hợp lệ.'})
-
-                elif msg_type == 'chat':
-                    message_content = msg_data['message']
-                    sender_name = msg_data.get('sender', 'Người lạ')
-                    with lock:
-                        opponent_socket = game_pairs.get(client_socket)
-                        if opponent_socket:
-                            send_to_client(opponent_socket, 'chat', {'message': message_content, 'sender': sender_name})
-                            print(f"Chat từ {sender_name} tới {player_names.get(opponent_socket, 'opponent')}: {message_content}")
-                        else:
-                            print(f"Chat từ {sender_name}: {message_content} (không tìm thấy đối thủ).")
-                            send_to_client(client_socket, 'error', {'message': 'Không tìm thấy đối thủ để chat.'})
-
-                # --- Rematch logic ---
-                elif msg_type == 'rematch_request':
-                    with lock:
-                        opponent_socket = game_pairs.get(client_socket)
-                        if not opponent_socket:
-                            send_to_client(client_socket, 'error', {'message': 'Không tìm thấy đối thủ để đấu lại.'})
-                            continue
-                        game_id = generate_game_id(client_socket, opponent_socket)
-                        if game_id not in rematch_requests:
-                            rematch_requests[game_id] = set()
-                        rematch_requests[game_id].add(client_socket)
-                        send_to_client(opponent_socket, 'rematch_request', {})
-                        # If both players requested rematch, start new game
-                        if len(rematch_requests[game_id]) == 2:
-                            send_to_client(client_socket, 'rematch_start', {})
-                            send_to_client(opponent_socket, 'rematch_start', {})
-                            game_boards[game_id] = create_new_board()
-                            last_moves[game_id] = None
-                            first_player_socket = client_socket if time.time() % 2 < 1 else opponent_socket
-                            current_turns[game_id] = first_player_socket
-                            symbol1 = SYMBOL_X if first_player_socket == client_socket else SYMBOL_O
-                            symbol2 = SYMBOL_O if first_player_socket == client_socket else SYMBOL_X
-                            player_symbols[client_socket] = symbol1
-                            player_symbols[opponent_socket] = symbol2
-                            send_to_client(client_socket, 'game_start', {
-                                'symbol': symbol1,
-                                'is_turn': (first_player_socket == client_socket),
-                                'board': game_boards[game_id],
-                                'opponent_name': player_names.get(opponent_socket, 'Đối thủ')
-                            })
-                            send_to_client(opponent_socket, 'game_start', {
-                                'symbol': symbol2,
-                                'is_turn': (first_player_socket == opponent_socket),
-                                'board': game_boards[game_id],
-                                'opponent_name': player_names.get(client_socket, 'Đối thủ')
-                            })
-                            rematch_requests[game_id] = set()  # Reset for next rematch
-
-                elif msg_type == 'rematch_declined':
-                    with lock:
-                        opponent_socket = game_pairs.get(client_socket)
-                        if not opponent_socket:
-                            continue
-                        game_id = generate_game_id(client_socket, opponent_socket)
-                        if game_id not in rematch_declined_flags:
-                            rematch_declined_flags[game_id] = set()
-                        rematch_declined_flags[game_id].add(client_socket)
-                        send_to_client(opponent_socket, 'rematch_declined', {})
-                        # If both players declined, cleanup and put both to waitlist
-                        if len(rematch_declined_flags[game_id]) == 2:
-                            cleanup_game(game_id)
-
-                elif msg_type == 'rematch_start':
-                    pass
-
+            bytes_received.inc(amount=len(data))
+            client_socket.last_seen = time.monotonic()
+            for message in client_socket.decoder.feed(data):
+                handle_message(client_socket, client_address, message)
     except Exception as e:
-        print(f"Lỗi trong handle_client cho {client_address}: {e}")
+        log.warning("Lỗi trong handle_client cho %s: %s", client_address, e)
     finally:
         handle_disconnect(client_socket)
 
-def start_server():
+def matchmaking_loop():
+    while True:
+        time.sleep(MATCHMAKING_INTERVAL)
+        run_matchmaking_pass()
+
+def timer_loop():
+    while True:
+        time.sleep(timers.tick)
+        timers.advance()
+
+def start_server(host=HOST, port=PORT):
     server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-    server_socket.bind((HOST, PORT))
-    server_socket.listen(5)
-    print(f"Server đang lắng nghe trên {HOST}:{PORT}")
+    server_socket.bind((host, port))
+    server_socket.listen(socket.SOMAXCONN)
+    log.info("Server (threaded) đang lắng nghe trên %s:%s", host, port)
+    threading.Thread(target=matchmaking_loop, daemon=True).start()
+    threading.Thread(target=timer_loop, daemon=True).start()
     while True:
         client_socket, client_address = server_socket.accept()
-        client_handler = threading.Thread(target=handle_client, args=(client_socket, client_address), daemon=True)
+        client = SocketClient(client_socket, client_address)
+        client_handler = threading.Thread(target=handle_client, args=(client, client_address), daemon=True)
         client_handler.start()
 
+async def handle_client_async(reader, writer):
+    client_socket = StreamClient(writer, reader)
+    welcome_client(client_socket, client_socket.getpeername())
+    await serve_stream(client_socket, reader)
+
+async def serve_stream(client_socket, reader):
+    client_address = client_socket.getpeername()
+    try:
+        while True:
+            data = await reader.read(RECV_SIZE)
+            if not data:
+                break
+            bytes_received.inc(amount=len(data))
+            client_socket.last_seen = time.monotonic()
+            for message in client_socket.decoder.feed(data):
+                handle_message(client_socket, client_address, message)
+    except Exception as e:
+        log.warning("Lỗi trong handle_client_async cho %s: %s", client_address, e)
+    finally:
+        if client_socket.handoff is None or not await hand_off(client_socket):
+            handle_disconnect(client_socket)
+
+async def matchmaking_loop_async():
+    while True:
+        await asyncio.sleep(MATCHMAKING_INTERVAL)
+        run_matchmaking_pass()
+        if cluster_link is not None:
+            report_waiting()
+
+async def timer_loop_async():
+    while True:
+        await asyncio.sleep(timers.tick)
+        timers.advance()
+
+async def run_async_server(host, port, reuse_port=False):
+    global server_loop
+    server_loop = asyncio.get_running_loop()
+    server = await asyncio.start_server(handle_client_async, host, port, reuse_address=True, reuse_port=reuse_port)
+    log.info("Server (asyncio) đang lắng nghe trên %s:%s", host, port)
+    asyncio.create_task(matchmaking_loop_async())
+    asyncio.create_task(timer_loop_async())
+    async with server:
+        await server.serve_forever()
+
+def start_async_server(host=HOST, port=PORT, reuse_port=False):
+    asyncio.run(run_async_server(host, port, reuse_port))
+
+def follow_cluster(link_path, index):
+    # Link thread of a worker: hands matchmaker messages to the event loop and reconnects if the
+    # matchmaker process is restarted.
+    global cluster_link
+    while True:
+        message, fds = cluster_link.receive()
+        if message is not None:
+            call_in_server(handle_cluster_message, message, fds)
+            continue
+        log.warning("Mất kết nối tới matchmaker, đang kết nối lại...")
+        cluster_link.close()
+        while True:
+            try:
+                cluster_link = connect_link(link_path, index)
+                break
+            except OSError:
+                time.sleep(MATCHMAKING_INTERVAL)
+
+def run_worker(args, index, link_path):
+    # Entry point of a worker process in cluster mode.
+    global cluster_link
+    configure(args, index)
+    cluster_link = connect_link(link_path, index)
+    threading.Thread(target=follow_cluster, args=(link_path, index), daemon=True).start()
+    try:
+        start_async_server(args.host, args.port, reuse_port=True)
+    except KeyboardInterrupt:
+        pass
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Caro game server")
+    parser.add_argument('--mode', choices=['asyncio', 'threaded'], default='asyncio',
+                        help="asyncio: một event loop cho mọi kết nối; threaded: một thread cho mỗi kết nối")
+    parser.add_argument('--host', default=HOST)
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('--seed', type=int, help="seed cho việc chọn người đi trước (để chạy lại benchmark)")
+    parser.add_argument('--send-queue-size', type=int, default=256, help="số tin tối đa chờ gửi cho mỗi kết nối")
+    parser.add_argument('--overflow-policy', choices=OVERFLOW_POLICIES, default='coalesce',
+                        help="khi hàng đợi gửi đầy: bỏ chat, gộp cập nhật bàn cờ (và bỏ chat), hoặc ngắt kết nối")
+    parser.add_argument('--ranked', action='store_true', help="ghép cặp theo Elo với cửa sổ nới rộng dần")
+    parser.add_argument('--no-bot', action='store_true', help="không ghép người chơi đang chờ với máy")
+    parser.add_argument('--bot-wait', type=float, default=BOT_WAIT_SECONDS,
+                        help="số giây chờ đối thủ trước khi được ghép với máy")
+    parser.add_argument('--bot-time', type=float, default=BOT_TIME_BUDGET, help="thời gian suy nghĩ tối đa của máy cho mỗi nước (giây)")
+    parser.add_argument('--bot-workers', type=int, default=2, help="số process tìm nước đi cho máy")
+    parser.add_argument('--metrics-host', default='127.0.0.1')
+    parser.add_argument('--metrics-port', type=int, default=METRICS_PORT, help="cổng HTTP cho /metrics (0 để tắt)")
+    parser.add_argument('--log-level', choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'], default='INFO')
+    parser.add_argument('--log-rate', type=int, default=20,
+                        help="số dòng log cùng loại tối đa mỗi giây (0 để không giới hạn)")
+    parser.add_argument('--resume-grace', type=float, default=RESUME_GRACE_SECONDS,
+                        help="số giây giữ chỗ cho người chơi mất kết nối giữa ván (0 để tắt)")
+    parser.add_argument('--ping-interval', type=float, default=PING_INTERVAL,
+                        help="gửi 'ping' cho kết nối im lặng sau số giây này (0 để tắt heartbeat)")
+    parser.add_argument('--idle-timeout', type=float, default=IDLE_TIMEOUT,
+                        help="ngắt client 'heartbeat' im lặng quá số giây này (0 để tắt)")
+    parser.add_argument('--turn-timeout', type=float, default=TURN_TIMEOUT,
+                        help="số giây cho mỗi lượt đi trước khi bị xử thua (0 để tắt)")
+    parser.add_argument('--analysis-workers', type=int, default=1,
+                        help="số process phân tích thế cờ cho tin 'analyze' (0 để tắt)")
+    parser.add_argument('--analysis-cache', type=int, default=10000, help="số thế cờ đã phân tích được giữ lại")
+    parser.add_argument('--analysis-rate', type=float, default=ANALYSIS_RATE,
+                        help="số lần phân tích mới mỗi giây cho một người chơi")
+    parser.add_argument('--opening-book', metavar='FILE',
+                        help="sách khai cuộc từ openingbook.py cho máy và cho tin 'analyze'")
+    parser.add_argument('--board-size', type=int, default=BOARD_SIZE,
+                        help=f"cạnh bàn cờ, 5-255; khác {BOARD_SIZE} là bàn cờ tự do lưu thưa, 0 là bàn cờ vô hạn "
+                             "(chỉ cho client hỗ trợ 'sparse', không có máy)")
+    parser.add_argument('--game-log', metavar='DIR', help="ghi mọi ván vào nhật ký nhị phân trong thư mục này")
+    parser.add_argument('--stats-db', metavar='FILE', help="lưu thành tích và Elo của người chơi vào file SQLite này")
+    parser.add_argument('--leaderboard-size', type=int, default=LEADERBOARD_SIZE, help="số người tối đa trong tin 'leaderboard'")
+    parser.add_argument('--profile', metavar='FILE',
+                        help="đo thời gian từng loại tin, hàm và lock; in bảng định kỳ và ghi collapsed stack "
+                             "(cho flamegraph) vào file này")
+    parser.add_argument('--profile-interval', type=float, default=PROFILE_INTERVAL, help="số giây giữa hai lần in bảng profile")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="số process cùng nhận kết nối trên một cổng (SO_REUSEPORT); worker i dùng cổng metrics + i")
+    args = parser.parse_args()
+    if args.workers > 1 and args.mode != 'asyncio':
+        parser.error("--workers chỉ dùng được với --mode asyncio")
+    if args.board_size != 0 and not 5 <= args.board_size <= 255:
+        parser.error("--board-size phải là 0 hoặc từ 5 đến 255")
+    if args.profile_interval <= 0:
+        parser.error("--profile-interval phải lớn hơn 0")
+    if args.leaderboard_size < 1:
+        parser.error("--leaderboard-size phải lớn hơn 0")
+    return args
+
+def write_profile(path):
+    log.info("%s", profiler.summary())
+    try:
+        profiler.write_collapsed(path)
+    except OSError as e:
+        log.warning("Không ghi được %s: %s", path, e)
+
+def report_profile(path, interval):
+    while True:
+        time.sleep(interval)
+        write_profile(path)
+
+def enable_profiling(path, interval):
+    # Rebinds the module-level names the rest of the server calls through. Without --profile
+    # nothing is wrapped, so the instrumentation costs nothing when it is off.
+    global profiler, analysis_lock
+    profiler = Profiler()
+    module = globals()
+    for name in PROFILED_FUNCTIONS:
+        module[name] = profiler.wrap(module[name], name)
+    module['handle_message'] = profiler.wrap_handler(handle_message, 'handle_message', message_label)
+    timed_lock = TimedLock
+
+    def profiled_lock(wait_histogram, hold_histogram, name):
+        return profiler.wrap_lock(timed_lock(wait_histogram, hold_histogram, name), name)
+    module['TimedLock'] = profiled_lock  # sessions are created after this
+    matchmaker.lock = profiler.wrap_lock(matchmaker.lock, 'matchmaker')
+    analysis_lock = profiler.wrap_lock(analysis_lock, 'analysis')
+    threading.Thread(target=report_profile, args=(path, interval), daemon=True).start()
+    atexit.register(write_profile, path)
+    log.info("Đang profile; bảng tổng hợp mỗi %ss, collapsed stack ở %s.", interval, path)
+
+def configure(args, index=0):
+    # Applies the command line to this process; in cluster mode each worker calls it with its index.
+    global BOT_WAIT_SECONDS, BOT_TIME_BUDGET, RESUME_GRACE_SECONDS, PING_INTERVAL, IDLE_TIMEOUT, TURN_TIMEOUT
+    global bot_pool, game_log, worker_index, worker_count, game_ids, board_size, free_style
+    global analysis_pool, analysis_cache, ANALYSIS_RATE, opening_book, stats_store, leaderboard
+    worker_index, worker_count = index, args.workers
+    game_ids = itertools.count(index + 1, args.workers)
+    setup_logging(args.log_level, args.log_rate)
+    if args.profile:
+        enable_profiling(f"{args.profile}.{index}" if args.workers > 1 else args.profile, args.profile_interval)
+    if args.metrics_port:
+        metrics_port = args.metrics_port + index
+        try:
+            start_metrics_server(metrics, args.metrics_host, metrics_port)
+            log.info("Metrics tại http://%s:%s/metrics", args.metrics_host, metrics_port)
+        except OSError as e:
+            log.warning("Không mở được cổng metrics %s: %s", metrics_port, e)
+    if args.seed is not None:
+        rng.seed(args.seed + index)
+    configure_send_queues(args.send_queue_size, args.overflow_policy)
+    matchmaker.ranked = args.ranked
+    RESUME_GRACE_SECONDS = args.resume_grace
+    PING_INTERVAL, IDLE_TIMEOUT, TURN_TIMEOUT = args.ping_interval, args.idle_timeout, args.turn_timeout
+    board_size, free_style = args.board_size, args.board_size != BOARD_SIZE
+    if args.game_log:
+        game_log = GameLogWriter(args.game_log, worker=index, wide=free_style)
+        atexit.register(game_log.close)
+    leaderboard = Leaderboard(args.leaderboard_size)
+    if args.stats_db:
+        try:
+            stats_store = StatsStore(args.stats_db)
+            rows = stats_store.load()
+        except sqlite3.Error as e:
+            log.error("Không mở được %s: %s", args.stats_db, e)
+            sys.exit(1)
+        player_ratings.update((username, rating) for username, rating, _, _, _ in rows)
+        leaderboard.load(rows)
+        stats_store.start()
+        atexit.register(stats_store.close)
+        log.info("Đã nạp thành tích của %d người chơi từ %s.", len(rows), args.stats_db)
+    BOT_WAIT_SECONDS, BOT_TIME_BUDGET = args.bot_wait, args.bot_time
+    ANALYSIS_RATE, analysis_cache = args.analysis_rate, AnalysisCache(args.analysis_cache)
+    if args.opening_book and not free_style:
+        # Opened here only to fail early on a bad file; the workers map it themselves.
+        try:
+            book = OpeningBook(args.opening_book)
+        except (OSError, ValueError) as e:
+            log.error("Không dùng được sách khai cuộc %s: %s", args.opening_book, e)
+            sys.exit(1)
+        log.info("Sách khai cuộc %s: %d thế cờ.", args.opening_book, len(book))
+        book.close()
+        opening_book = os.path.abspath(args.opening_book)
+    # spawn rather than fork: forking a process that already runs threads is not safe. Neither
+    # the bot's search nor the evaluator knows anything but the 15x15 board.
+    if not args.no_bot and not free_style:
+        bot_pool = ProcessPoolExecutor(max_workers=args.bot_workers, mp_context=multiprocessing.get_context('spawn'))
+    if args.analysis_workers > 0 and not free_style:
+        analysis_pool = ProcessPoolExecutor(max_workers=args.analysis_workers, mp_context=multiprocessing.get_context('spawn'))
+    if bot_pool is not None or analysis_pool is not None or stats_store is not None:
+        # Stop on SIGTERM the way Ctrl+C does, so the worker processes are shut down with the server
+        # and the last results are committed.
+        signal.signal(signal.SIGTERM, signal.default_int_handler)
+
 if __name__ == "__main__":
-    start_server()
\ No newline at end of file
+    args = parse_args()
+    if args.workers > 1:
+        run_supervisor(args, run_worker)
+    elif args.mode == 'threaded':
+        configure(args)
+        start_server(args.host, args.port)
+    else:
+        configure(args)
+        start_async_server(args.host, args.port)
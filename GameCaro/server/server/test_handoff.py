@@ -0,0 +1,68 @@
+﻿import asyncio
+import os
+import unittest
+
+import server
+from connection import ClientConnection
+
+# Cross-worker hand-offs run without a cluster here: the connection and the link to the
+# supervisor are stand-ins, and handle_message and hand_off are called directly.
+
+class FakeConnection(ClientConnection):
+    def __init__(self, peername):
+        super().__init__(peername)
+        self.sent = []
+
+    def send(self, message_type, payload):
+        self.sent.append(message_type)
+
+    def stop_reading(self):
+        pass
+
+    async def detach(self):
+        self.closed = True
+        return os.open(os.devnull, os.O_RDONLY)
+
+class FakeLink:
+    def __init__(self):
+        self.sent = []
+
+    def send(self, message_type, data, fds=()):
+        self.sent.append((message_type, data['to']))
+
+class HandOffTest(unittest.TestCase):
+    def setUp(self):
+        self.saved = server.cluster_link, server.worker_count, server.worker_index
+        server.cluster_link, server.worker_count, server.worker_index = FakeLink(), 2, 0
+
+    def tearDown(self):
+        server.cluster_link, server.worker_count, server.worker_index = self.saved
+
+    def queued_player(self, username):
+        player = FakeConnection(('127.0.0.1', len(server.player_names) + 1))
+        server.handle_message(player, player.peername, {'type': 'username_set',
+                                                        'data': {'username': username, 'features': ['delta']}})
+        self.assertIn(player, server.matchmaker)
+        return player
+
+    def test_watch_hand_off_leaves_queue(self):
+        player = self.queued_player('watcher')
+        # Game 2 belongs to worker 1, so the connection is moved there.
+        server.handle_message(player, player.peername, {'type': 'watch', 'data': {'game_id': 2, 'features': ['delta']}})
+        self.assertEqual(player.handoff[0], 1)
+        self.assertTrue(asyncio.run(server.hand_off(player)))
+        self.assertEqual(len(server.matchmaker), 0)
+        self.assertNotIn(player, server.player_names)
+        self.assertEqual(server.cluster_link.sent, [('transfer', 1)])
+
+    def test_hand_off_clears_queued_player(self):
+        player = self.queued_player('mover')
+        server.analysis_buckets[player] = (1, 0.0)
+        player.handoff = (1, None, None)
+        self.assertTrue(asyncio.run(server.hand_off(player)))
+        self.assertEqual(len(server.matchmaker), 0)
+        self.assertNotIn(player, server.analysis_buckets)
+        self.assertNotIn(player, server.player_features)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+﻿import threading
+import time
+
+# Hashed timing wheel: one list per slot, and a timer due at tick t sits in slot t % slots. A
+# single driver calls advance() every `tick` seconds and only looks at the slots of the ticks that
+# have passed, so scheduling and cancelling are O(1) however many timers there are. Timers more
+# than one turn of the wheel away stay in their slot until the turn they are due in.
+
+TICK = 0.1
+SLOTS = 1024  # about 100 s per turn of the wheel at the default tick
+
+class Timer:
+    __slots__ = ('due', 'callback', 'args', 'cancelled')
+
+    def __init__(self, due, callback, args):
+        self.due = due
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        # The entry is dropped when the wheel reaches its slot.
+        self.cancelled = True
+
+class TimerWheel:
+    def __init__(self, tick=TICK, slots=SLOTS, clock=time.monotonic):
+        self.tick = tick
+        self.clock = clock
+        self.slots = [[] for _ in range(slots)]
+        self.lock = threading.Lock()
+        self.current = self.tick_of(clock())  # the next tick advance() will process
+        self.pending = 0
+        self.fired = 0
+
+    def tick_of(self, when):
+        return int(when / self.tick)
+
+    def schedule(self, delay, callback, *args):
+        # callback(*args) runs on the thread driving advance(), at most one tick late.
+        with self.lock:
+            due = max(self.tick_of(self.clock() + delay), self.current)
+            timer = Timer(due, callback, args)
+            self.slots[due % len(self.slots)].append(timer)
+            self.pending += 1
+        return timer
+
+    def advance(self):
+        now_tick = self.tick_of(self.clock())
+        due = []
+        with self.lock:
+            # After a long stall, one turn of the wheel already visits every slot.
+            last = min(now_tick, self.current + len(self.slots) - 1)
+            for tick in range(self.current, last + 1):
+                index = tick % len(self.slots)
+                slot = self.slots[index]
+                if not slot:
+                    continue
+                waiting = []
+                for timer in slot:
+                    if timer.cancelled:
+                        self.pending -= 1
+                    elif timer.due <= now_tick:
+                        self.pending -= 1
+                        due.append(timer)
+                    else:
+                        waiting.append(timer)
+                self.slots[index] = waiting
+            self.current = now_tick + 1
+        for timer in due:
+            if not timer.cancelled:
+                self.fired += 1
+                timer.callback(*timer.args)
+        return len(due)
+
+    def __len__(self):
+        # Includes cancelled timers whose slot has not been reached yet.
+        return self.pending
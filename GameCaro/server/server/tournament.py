@@ -0,0 +1,223 @@
+﻿import argparse
+import json
+import os
+import random
+import sys
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+
+import server
+from ai import CELLS, SearchEngine, TranspositionTable
+from board import BOARD_SIZE, SYMBOL_X, SYMBOL_O
+from gamelog import GameLogWriter, RESULT_DRAW, RESULT_O_WON, RESULT_X_WON
+from rating import DEFAULT_RATING, elo_update
+
+# Bot-vs-bot round robin without sockets: every game is played in a worker process on the
+# server's own rules (create_new_board, check_win, is_board_full; X first, then alternating
+# turns) and the results come back in schedule order, so the Elo table and the game log of a
+# seeded run are the same whatever the number of workers. Only timings differ between runs.
+#
+# Policies: 'random', 'heuristic' (best threat score one ply deep), 'search:<depth>' (the
+# server bot's search cut at a fixed depth, reproducible) and 'timed:<seconds>' (the search
+# with a time budget like the server bot; its moves depend on the machine).
+
+SEARCH_POLICIES = ('search', 'timed')
+UNLIMITED_SECONDS = 10 ** 6  # fixed-depth searches never stop on time
+OPENING_RADIUS = 2           # random opening moves fall within this distance of the centre
+
+def random_move(engine, player, rng):
+    return rng.choice([cell for cell in range(CELLS) if not engine.cells[cell]])
+
+def heuristic_move(engine, player, rng):
+    return engine.candidates(player, 1)[0]
+
+def search_move(engine, player, max_depth):
+    # Never reaches its deadline, so every move it tries is undone again.
+    cell, _ = engine.search(player, UNLIMITED_SECONDS, max_depth)
+    return cell
+
+def timed_move(engine, player, seconds):
+    # A search stopped by its deadline leaves moves played on the engine, so it runs on a copy.
+    scratch = SearchEngine(engine.table)
+    for cell, owner in enumerate(engine.cells):
+        if owner:
+            scratch.play(cell, owner)
+    cell, _ = scratch.search(player, seconds)
+    return cell
+
+def make_policy(spec):
+    # Raises ValueError for an unknown or malformed spec.
+    name, _, argument = spec.partition(':')
+    if name == 'random' and not argument:
+        return random_move
+    if name == 'heuristic' and not argument:
+        return heuristic_move
+    if name == 'search':
+        depth = int(argument)
+        if depth < 1:
+            raise ValueError(spec)
+        return lambda engine, player, rng: search_move(engine, player, depth)
+    if name == 'timed':
+        seconds = float(argument)
+        if seconds <= 0:
+            raise ValueError(spec)
+        return lambda engine, player, rng: timed_move(engine, player, seconds)
+    raise ValueError(spec)
+
+def opening_move(engine, rng):
+    center = BOARD_SIZE // 2
+    cells = [row * BOARD_SIZE + col
+             for row in range(center - OPENING_RADIUS, center + OPENING_RADIUS + 1)
+             for col in range(center - OPENING_RADIUS, center + OPENING_RADIUS + 1)
+             if not engine.cells[row * BOARD_SIZE + col]]
+    return rng.choice(cells)
+
+def play_game(game):
+    # Runs in a worker. Returns (index, result, moves, started, ended); moves are
+    # (row, col, ms since the game started) as in the game log.
+    index, x_spec, o_spec, seed, opening = game
+    rng = random.Random(seed)
+    policies = {1: make_policy(x_spec), 2: make_policy(o_spec)}
+    # Each searching side gets a fresh table per game: entries left by other games would make
+    # the moves depend on which worker played what before.
+    tables = {player: TranspositionTable() for player, spec in ((1, x_spec), (2, o_spec))
+              if spec.partition(':')[0] in SEARCH_POLICIES}
+    engine = SearchEngine(TranspositionTable(0))
+    board = server.create_new_board()
+    moves = []
+    started, clock = time.time(), time.perf_counter()
+    player, result = 1, RESULT_DRAW
+    while True:
+        if len(moves) < opening:
+            cell = opening_move(engine, rng)
+        else:
+            engine.table = tables.get(player, engine.table)
+            cell = policies[player](engine, player, rng)
+        row, col = divmod(cell, BOARD_SIZE)
+        symbol = SYMBOL_X if player == 1 else SYMBOL_O
+        if not board.is_empty(row, col):
+            raise RuntimeError(f"{x_spec if player == 1 else o_spec} chọn ô đã có quân ({row}, {col})")
+        board.place(row, col, symbol)
+        engine.play(cell, player)
+        moves.append((row, col, int((time.perf_counter() - clock) * 1000)))
+        if server.check_win(board, row, col, symbol):
+            result = RESULT_X_WON if player == 1 else RESULT_O_WON
+            break
+        if server.is_board_full(board):
+            break
+        player = 3 - player
+    return index, result, moves, started, time.time()
+
+def schedule(policies, rounds, seed, opening):
+    # Every policy plays every other one `rounds` times with each colour.
+    games = []
+    for _ in range(rounds):
+        for x_spec in policies:
+            for o_spec in policies:
+                if x_spec != o_spec:
+                    games.append((len(games), x_spec, o_spec, seed * 1000003 + len(games), opening))
+    return games
+
+class Standings:
+    def __init__(self, policies):
+        self.ratings = {spec: float(DEFAULT_RATING) for spec in policies}
+        self.records = {spec: [0, 0, 0] for spec in policies}  # wins, draws, losses
+        self.moves = 0
+        self.games = 0
+        self.digest = 0  # CRC-32 over every result and move, to compare two seeded runs
+
+    def record(self, x_spec, o_spec, result, moves):
+        score = {RESULT_X_WON: 1.0, RESULT_O_WON: 0.0}.get(result, 0.5)
+        x_rating, o_rating = self.ratings[x_spec], self.ratings[o_spec]
+        self.ratings[x_spec] = elo_update(x_rating, o_rating, score)
+        self.ratings[o_spec] = elo_update(o_rating, x_rating, 1 - score)
+        for spec, own_score in ((x_spec, score), (o_spec, 1 - score)):
+            self.records[spec][0 if own_score == 1 else 2 if own_score == 0 else 1] += 1
+        self.moves += len(moves)
+        self.games += 1
+        self.digest = zlib.crc32(json.dumps([result, [move[:2] for move in moves]]).encode(), self.digest)
+
+    def table(self):
+        rows = []
+        for spec in sorted(self.ratings, key=self.ratings.get, reverse=True):
+            wins, draws, losses = self.records[spec]
+            rows.append({'policy': spec, 'elo': round(self.ratings[spec], 1), 'wins': wins, 'draws': draws,
+                         'losses': losses, 'score': round((wins + draws / 2) / max(wins + draws + losses, 1), 3)})
+        return rows
+
+def run(args, games, standings, game_log):
+    # Results are consumed in schedule order (map, not as_completed): Elo depends on the order.
+    started = time.perf_counter()
+    if args.workers:
+        chunksize = args.chunk or max(1, len(games) // (args.workers * 8))
+        pool = ProcessPoolExecutor(max_workers=args.workers)
+        results = pool.map(play_game, games, chunksize=chunksize)
+    else:
+        pool, results = None, map(play_game, games)
+    try:
+        for index, result, moves, game_started, game_ended in results:
+            _, x_spec, o_spec, _, _ = games[index]
+            standings.record(x_spec, o_spec, result, moves)
+            if game_log:
+                game_log.append(game_log.next_game_id(), game_started, game_ended, BOARD_SIZE, result, x_spec, o_spec, moves)
+            if args.report_every and standings.games % args.report_every == 0:
+                elapsed = time.perf_counter() - started
+                print(f"{standings.games}/{len(games)} ván, {standings.games / elapsed:.1f} ván/giây", file=sys.stderr)
+    finally:
+        if pool:
+            pool.shutdown(cancel_futures=True)
+    return time.perf_counter() - started
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Giải đấu giữa các bot, không cần socket hay giao diện")
+    parser.add_argument('policies', nargs='+', metavar='POLICY',
+                        help="random, heuristic, search:<độ sâu> hoặc timed:<giây mỗi nước>")
+    parser.add_argument('--rounds', type=int, default=10, help="số lượt gặp nhau của mỗi cặp với mỗi bên cầm X")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help="số process chơi (0 = chạy ngay trong process này)")
+    parser.add_argument('--chunk', type=int, default=0, help="số ván gửi cho worker mỗi lần (0 = tự chọn)")
+    parser.add_argument('--opening', type=int, default=2, help="số nước đầu đi ngẫu nhiên gần tâm để các ván khác nhau")
+    parser.add_argument('--seed', type=int, default=1, help="cùng seed và cùng danh sách bot cho ra cùng các ván")
+    parser.add_argument('--game-log', metavar='DIR', help="ghi mọi ván vào nhật ký nhị phân trong thư mục này")
+    parser.add_argument('--report-every', type=int, default=0, help="in tiến độ sau mỗi số ván này (0 để tắt)")
+    parser.add_argument('--json', action='store_true', help="in kết quả dạng JSON")
+    args = parser.parse_args()
+    if len(set(args.policies)) != len(args.policies) or len(args.policies) < 2:
+        parser.error("cần ít nhất hai bot khác nhau")
+    for spec in args.policies:
+        try:
+            make_policy(spec)
+        except ValueError:
+            parser.error(f"không hiểu bot '{spec}'")
+    return args
+
+def main():
+    args = parse_args()
+    games = schedule(args.policies, args.rounds, args.seed, args.opening)
+    standings = Standings(args.policies)
+    game_log = GameLogWriter(args.game_log) if args.game_log else None
+    try:
+        elapsed = run(args, games, standings, game_log)
+    finally:
+        if game_log:
+            game_log.close()
+    result = {
+        'games': standings.games,
+        'workers': args.workers,
+        'seconds': round(elapsed, 2),
+        'games_per_sec': round(standings.games / elapsed, 2),
+        'moves_per_sec': round(standings.moves / elapsed, 1),
+        'digest': f"{standings.digest:08x}",
+        'standings': standings.table(),
+    }
+    if args.json:
+        print(json.dumps(result))
+        return
+    print(f"{'bot':>14} {'elo':>8} {'thắng':>6} {'hòa':>5} {'thua':>5} {'điểm':>6}")
+    for row in result['standings']:
+        print(f"{row['policy']:>14} {row['elo']:>8.1f} {row['wins']:>6} {row['draws']:>5} {row['losses']:>5} {row['score']:>6.3f}")
+    print(f"{result['games']} ván trong {result['seconds']}s với {args.workers} worker: {result['games_per_sec']} ván/giây, "
+          f"{result['moves_per_sec']} nước/giây; digest {result['digest']}")
+
+if __name__ == "__main__":
+    main()
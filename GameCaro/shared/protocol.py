@@ -0,0 +1,264 @@
+﻿import json
+import struct
+
+# Wire format shared by the server and the client. By default every message is one compact JSON
+# object per line. Peers that both announce the 'binary' feature switch to length-prefixed binary
+# frames once the handshake below is done:
+#   1. the client sends username_set with 'binary' in its features (JSON);
+#   2. the server answers with a 'protocol' message listing the accepted features (JSON) and
+#      sends binary frames from then on;
+#   3. the client echoes a 'protocol' message (JSON) and sends binary frames from then on.
+# A decoder switches to binary right after the 'protocol' frame, even mid-chunk.
+DELIMITER = b'\n'
+MAX_FRAME_SIZE = 64 * 1024
+RECV_SIZE = 65536
+
+class FrameError(ValueError):
+    pass
+
+class FrameTooLarge(FrameError):
+    pass
+
+def encode_message(message_type, data):
+    message = {'type': message_type, 'data': data}
+    return (json.dumps(message, separators=(',', ':')) + '\n').encode('utf-8')
+
+# --- Binary frames: uint16 length (of what follows), uint8 message code, body ---
+
+FRAME_HEADER = struct.Struct('>HB')
+JSON_CODE = 0  # any message without a fixed layout: the body is the compact JSON message
+# Append only: a code keeps its meaning for peers built before later types were added.
+# 'place' and 'stone' are 'move' and 'move_made' for free-style boards, whose coordinates need
+# not fit in a byte (or be positive); only 'sparse' clients get them.
+BINARY_TYPES = ('move', 'move_made', 'your_turn', 'wait_turn', 'game_over', 'game_start', 'update_board',
+                'board_sync', 'sync_request', 'rematch_request', 'rematch_start', 'rematch_declined',
+                'place', 'stone')
+TYPE_CODES = {message_type: code for code, message_type in enumerate(BINARY_TYPES, 1)}
+
+SYMBOL_CODES = {' ': 0, 'X': 1, 'O': 2}
+CODE_SYMBOLS = ' XO'
+WINNER_CODES = {False: 0, True: 1, None: 2}
+CODE_WINNERS = (False, True, None)
+NO_CELL = 255  # row/col of a missing last_move
+
+MOVE = struct.Struct('>BB')             # row, col
+MOVE_MADE = struct.Struct('>BBBH')      # row, col, symbol, seq
+GAME_OVER = struct.Struct('>B')         # winner, then the message as UTF-8
+GAME_START = struct.Struct('>BBH')      # symbol, is_turn, seq, then the board, then the opponent name
+UPDATE_BOARD = struct.Struct('>BB')     # last move row, col, then the board
+BOARD_SYNC = struct.Struct('>BBH')      # last move row, col, seq, then the board
+PLACE = struct.Struct('>ii')            # row, col
+STONE = struct.Struct('>iiBI')          # row, col, symbol, seq
+
+# Boards are packed 2 bits per cell, four cells per byte, after one byte holding the side length.
+# Packing goes through a base-4 number so the heavy lifting stays in int() and to_bytes().
+BOARD_DIGITS = str.maketrans(' XO', '012')
+DIGIT_SYMBOLS = str.maketrans('012', ' XO')
+BYTE_DIGITS = [''.join('0123'[(value >> shift) & 3] for shift in (6, 4, 2, 0)) for value in range(256)]
+
+def packed_board_size(size):
+    return 1 + (size * size + 3) // 4
+
+def pack_board(rows):
+    size = len(rows)
+    digits = ''.join([''.join(row) for row in rows]).translate(BOARD_DIGITS)
+    return bytes((size,)) + int(digits, 4).to_bytes(packed_board_size(size) - 1, 'big')
+
+def unpack_board(view):
+    size = view[0]
+    cells = size * size
+    digits = ''.join([BYTE_DIGITS[value] for value in view[1:packed_board_size(size)]])
+    symbols = digits[len(digits) - cells:].translate(DIGIT_SYMBOLS)
+    return [list(symbols[start:start + size]) for start in range(0, cells, size)]
+
+def cell_codes(last_move):
+    return (last_move['row'], last_move['col']) if last_move else (NO_CELL, NO_CELL)
+
+def last_move_of(row, col):
+    return None if row == NO_CELL else {'row': row, 'col': col}
+
+def encode_body(message_type, data):
+    if message_type == 'move_made':
+        return MOVE_MADE.pack(data['row'], data['col'], SYMBOL_CODES[data['symbol']], data['seq'])
+    if message_type == 'move':
+        return MOVE.pack(data['row'], data['col'])
+    if message_type == 'stone':
+        return STONE.pack(data['row'], data['col'], SYMBOL_CODES[data['symbol']], data['seq'])
+    if message_type == 'place':
+        return PLACE.pack(data['row'], data['col'])
+    if message_type == 'game_over':
+        return GAME_OVER.pack(WINNER_CODES[data['winner']]) + data['message'].encode('utf-8')
+    if message_type == 'game_start':
+        return (GAME_START.pack(SYMBOL_CODES[data['symbol']], data['is_turn'], data['seq'])
+                + pack_board(data['board']) + data['opponent_name'].encode('utf-8'))
+    if message_type == 'update_board':
+        return UPDATE_BOARD.pack(*cell_codes(data.get('last_move'))) + pack_board(data['board'])
+    if message_type == 'board_sync':
+        return BOARD_SYNC.pack(*cell_codes(data.get('last_move')), data['seq']) + pack_board(data['board'])
+    return b''  # turn notices and the rematch/sync messages carry nothing
+
+def decode_body(message_type, view):
+    if message_type == 'move_made':
+        row, col, symbol, seq = MOVE_MADE.unpack_from(view)
+        return {'row': row, 'col': col, 'symbol': CODE_SYMBOLS[symbol], 'seq': seq}
+    if message_type == 'move':
+        row, col = MOVE.unpack_from(view)
+        return {'row': row, 'col': col}
+    if message_type == 'stone':
+        row, col, symbol, seq = STONE.unpack_from(view)
+        return {'row': row, 'col': col, 'symbol': CODE_SYMBOLS[symbol], 'seq': seq}
+    if message_type == 'place':
+        row, col = PLACE.unpack_from(view)
+        return {'row': row, 'col': col}
+    if message_type == 'game_over':
+        return {'winner': CODE_WINNERS[view[0]], 'message': str(view[GAME_OVER.size:], 'utf-8', 'replace')}
+    if message_type == 'game_start':
+        symbol, is_turn, seq = GAME_START.unpack_from(view)
+        board_view = view[GAME_START.size:]
+        board_end = packed_board_size(board_view[0])
+        return {'symbol': CODE_SYMBOLS[symbol], 'is_turn': bool(is_turn), 'board': unpack_board(board_view),
+                'seq': seq, 'opponent_name': str(board_view[board_end:], 'utf-8', 'replace')}
+    if message_type == 'update_board':
+        row, col = UPDATE_BOARD.unpack_from(view)
+        return {'board': unpack_board(view[UPDATE_BOARD.size:]), 'last_move': last_move_of(row, col)}
+    if message_type == 'board_sync':
+        row, col, seq = BOARD_SYNC.unpack_from(view)
+        return {'board': unpack_board(view[BOARD_SYNC.size:]), 'last_move': last_move_of(row, col), 'seq': seq}
+    return {}
+
+def encode_binary(message_type, data):
+    code = TYPE_CODES.get(message_type, JSON_CODE)
+    if code == JSON_CODE:
+        body = json.dumps({'type': message_type, 'data': data}, separators=(',', ':')).encode('utf-8')
+    else:
+        body = encode_body(message_type, data)
+    if len(body) >= MAX_FRAME_SIZE:
+        raise FrameTooLarge(f"{message_type} frame of {len(body)} bytes exceeds {MAX_FRAME_SIZE}")
+    return FRAME_HEADER.pack(len(body) + 1, code) + body
+
+def decode_binary(code, view):
+    if code == JSON_CODE:
+        return json.loads(str(view, 'utf-8'))
+    message_type = BINARY_TYPES[code - 1]
+    return {'type': message_type, 'data': decode_body(message_type, view)}
+
+def switches_to_binary(message):
+    return message.get('type') == 'protocol' and 'binary' in (message.get('data') or {}).get('features', ())
+
+class FrameDecoder:
+    # Incremental decoder for a byte stream. Chunks are appended to one bytearray and only the
+    # bytes that arrived since the last call are searched for the delimiter. Everything up to the
+    # last delimiter is decoded in one go, straight from a memoryview, and split into frames;
+    # a multibyte character cut in two by recv() therefore stays in the buffer until it is whole.
+    # While `negotiating`, JSON lines are taken one at a time so that a 'protocol' frame can
+    # switch the bytes behind it to binary frames.
+    def __init__(self, max_frame_size=MAX_FRAME_SIZE, on_invalid=None, negotiating=False):
+        self.buffer = bytearray()
+        self.scan_from = 0  # bytes before this offset hold no delimiter
+        self.max_frame_size = max_frame_size
+        self.on_invalid = on_invalid  # called with (frame, error) for frames that cannot be decoded
+        self.negotiating = negotiating
+        self.binary = False
+
+    def feed(self, data):
+        # Returns the batch of messages completed by `data`, parsed.
+        self.buffer += data
+        messages = []
+        while self.negotiating and not self.binary:
+            frame = self.next_line()
+            if frame is None:
+                break
+            message = self.parse_json(frame)
+            if message is not None:
+                messages.append(message)
+                if message.get('type') == 'protocol':
+                    self.negotiating = False
+                    self.binary = switches_to_binary(message)
+        if self.binary:
+            # A partial binary frame is bounded by the length check in take_binary.
+            self.take_binary(messages)
+            return messages
+        if not self.negotiating:
+            for frame in self.take_lines():
+                message = self.parse_json(frame)
+                if message is not None:
+                    messages.append(message)
+        if len(self.buffer) > self.max_frame_size:
+            raise FrameTooLarge(f"unterminated frame exceeds {self.max_frame_size} bytes")
+        return messages
+
+    def feed_frames(self, data):
+        # Returns the JSON lines completed by `data` as str, without parsing them.
+        self.buffer += data
+        frames = self.take_lines()
+        if len(self.buffer) > self.max_frame_size:
+            raise FrameTooLarge(f"unterminated frame exceeds {self.max_frame_size} bytes")
+        return frames
+
+    def parse_json(self, frame):
+        try:
+            return json.loads(frame)
+        except ValueError as e:
+            if self.on_invalid:
+                self.on_invalid(frame, e)
+            return None
+
+    def take_lines(self):
+        buffer = self.buffer
+        end = buffer.rfind(DELIMITER, self.scan_from)
+        if end < 0:
+            self.scan_from = len(buffer)
+            return []
+        if end > self.max_frame_size:
+            self.check_frame_sizes(end)
+        with memoryview(buffer) as view:
+            text = str(view[:end], 'utf-8', 'replace')
+        del buffer[:end + 1]
+        self.scan_from = len(buffer)
+        return [frame for frame in text.split('\n') if frame]
+
+    def next_line(self):
+        buffer = self.buffer
+        while True:
+            end = buffer.find(DELIMITER, self.scan_from)
+            if end < 0:
+                self.scan_from = len(buffer)
+                return None
+            if end > self.max_frame_size:
+                raise FrameTooLarge(f"frame of {end} bytes exceeds {self.max_frame_size}")
+            frame = buffer[:end].decode('utf-8', 'replace')
+            del buffer[:end + 1]
+            self.scan_from = 0
+            if frame:
+                return frame
+
+    def take_binary(self, messages):
+        buffer = self.buffer
+        start = 0
+        available = len(buffer)
+        with memoryview(buffer) as view:
+            while available - start >= FRAME_HEADER.size:
+                length, code = FRAME_HEADER.unpack_from(buffer, start)
+                if length > self.max_frame_size:
+                    raise FrameTooLarge(f"frame of {length} bytes exceeds {self.max_frame_size}")
+                if not length:
+                    raise FrameError("binary frame without a message code")
+                end = start + 2 + length
+                if end > available:
+                    break
+                try:
+                    messages.append(decode_binary(code, view[start + FRAME_HEADER.size:end]))
+                except (ValueError, IndexError, struct.error) as e:
+                    if self.on_invalid:
+                        self.on_invalid(bytes(view[start:end]), e)
+                start = end
+        if start:
+            del buffer[:start]
+
+    def check_frame_sizes(self, end):
+        start = 0
+        while start <= end:
+            stop = self.buffer.find(DELIMITER, start, end + 1)
+            if stop - start > self.max_frame_size:
+                raise FrameTooLarge(f"frame of {stop - start} bytes exceeds {self.max_frame_size}")
+            start = stop + 1